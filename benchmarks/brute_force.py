@@ -0,0 +1,69 @@
+"""
+Times a brute force clustering run, and reports the cost of scoring each combination of medoids.
+
+Usage:  python benchmarks/brute_force.py [--leaves 1399] [--available 50] [--variants 4] [--repeats 1] [--repo PATH]
+
+A random tree is generated, and 'available' of its leaves (spread evenly through the tree order) are made available, so the run scores every combination of 'variants' of them. '--repo' loads navargator_resources from another checkout (e.g. 'git worktree add /tmp/old <commit>'), so the timings can be compared with older versions. The best variants and scores are printed as well, so the results of two versions can be compared.
+"""
+import os, sys, time, random, argparse
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class DiscardOutput(object):
+    """Stands in for sys.stdout while the clustering runs, which print their run times."""
+    def write(self, text):
+        pass
+    def flush(self):
+        pass
+
+def random_newick(num_leaves, seed=1):
+    """Returns the Newick string of a random tree with branch lengths."""
+    rng = random.Random(seed)
+    clades = ['leaf{}:{:.6f}'.format(i, rng.uniform(0.001, 1.0)) for i in range(num_leaves)]
+    while len(clades) > 2:
+        joined = [clades.pop(rng.randrange(len(clades))) for i in range(2)]
+        clades.append('({}):{:.6f}'.format(','.join(joined), rng.uniform(0.001, 1.0)))
+    return '({});'.format(','.join(clades))
+
+def num_combinations(n, k):
+    count = 1
+    for i in range(k):
+        count = count * (n - i) // (i + 1)
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='Times a brute force clustering run.')
+    parser.add_argument('--leaves', type=int, default=1399, help='number of leaves in the generated tree (default 1399)')
+    parser.add_argument('--available', type=int, default=50, help='number of available leaves (default 50)')
+    parser.add_argument('--variants', type=int, default=4, help='number of variants to find (default 4)')
+    parser.add_argument('--repeats', type=int, default=1, help='the best of this many runs is reported (default 1)')
+    parser.add_argument('--repo', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='checkout to load navargator_resources from (default this one)')
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.abspath(args.repo))
+    from navargator_resources.variant_finder import VariantFinder
+
+    vf = VariantFinder(random_newick(args.leaves), verbose=False)
+    step = len(vf.leaves) // args.available
+    vf.available = vf.leaves[::step][:args.available]
+    combinations = num_combinations(args.available, args.variants)
+    print('Brute force of {} variants from {} available, in a tree of {} leaves ({} combinations), from {}'.format(args.variants, args.available, args.leaves, combinations, os.path.dirname(os.path.abspath(sys.modules[VariantFinder.__module__].__file__))))
+    best = None
+    for i in range(args.repeats):
+        vf._clear_cache()
+        run_id = vf.generate_run_id()
+        vf.cache[run_id] = {'status':'running', 'params':(args.variants, 1.0), 'args':(args.variants, 1.0), 'method':'brute force', 'run_time':time.time(), 'cycles_used':0, 'quit_now':False}
+        stdout, sys.stdout = sys.stdout, DiscardOutput()
+        try:
+            start = timer()
+            variants, scores, alt_variants = vf.find_variants(run_id, 'brute force', None, args.variants, 1.0)
+            elapsed = timer() - start
+        finally:
+            sys.stdout = stdout
+        best = elapsed if best is None else min(best, elapsed)
+    print('  {:.3f} s, {:.2f} us per combination'.format(best, best / combinations * 1e6))
+    print('  variants: {}'.format(sorted(vf.leaves[ind] for ind in variants)))
+    print('  total score: {:.10g}, alternative patterns: {}'.format(sum(scores), len(alt_variants)))
+
+if __name__ == '__main__':
+    main()
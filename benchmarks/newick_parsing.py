@@ -0,0 +1,75 @@
+"""
+Measures the throughput of the Newick parser in MB/s, on a generated tree with branch lengths, support values, internal names, quoted names, and nested comments.
+
+Usage:  python benchmarks/newick_parsing.py [--leaves 100000] [--repeats 3] [--no-comments] [--repo PATH]
+
+Three paths are timed: Tree.tokenize_newick() alone, load_newick_string() on the whole string, and load_newick() on a temporary file, which streams it through the parser in chunks. The load times include building the TreeNode objects and process_tree_nodes(). '--repo' loads navargator_resources from another checkout (e.g. 'git worktree add /tmp/old <commit>'), so the throughput can be compared with older versions; anything a version lacks is reported as failed.
+"""
+import os, sys, time, random, argparse, tempfile
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def random_newick(num_leaves, comments=True, seed=1):
+    """Returns the Newick string of a random tree. Every leaf has a branch length, some have quoted names, and one in 5 has a nested comment. Internal nodes have a support value or (one in 10) a name, and one in 4 has a nested comment. If 'comments' is False there are none at all, which was the slowest case for the parser before tokenize_newick()."""
+    rng = random.Random(seed)
+    def leaf(i):
+        name = "'seq {} {}'".format(i, rng.choice('abc')) if i % 50 == 0 else 'seq_{}'.format(i)
+        comment = '[&&NHX:S=species{}[sampled {}]]'.format(i % 97, 2000 + i % 20) if comments and i % 5 == 0 else ''
+        return '{}{}:{:.6f}'.format(name, comment, rng.uniform(0.0001, 0.2))
+    def internal(children, i):
+        label = 'clade{}'.format(i) if i % 10 == 0 else '{:.2f}'.format(rng.random())
+        comment = '[&rate={:.3f}[ci=({:.2f},{:.2f})]]'.format(rng.uniform(0.5, 2), rng.random(), rng.random()) if comments and i % 4 == 0 else ''
+        return '({}){}{}:{:.6f}'.format(','.join(children), label, comment, rng.uniform(0.0001, 0.2))
+    clades = [leaf(i) for i in range(num_leaves)]
+    num_internal = 0
+    while len(clades) > 2:
+        rng.shuffle(clades) # Joins random pairs level by level, so the tree is roughly balanced
+        joined = [internal(clades[i:i+2], num_internal + i//2) for i in range(0, len(clades) - 1, 2)]
+        num_internal += len(joined)
+        clades = joined + clades[len(joined)*2:]
+    return '{}({});\n'.format('[Generated by newick_parsing.py]' if comments else '', ','.join(clades))
+
+def time_operation(label, fxn, num_bytes, repeats):
+    """Prints the throughput of the fastest of 'repeats' calls to fxn(), and returns its last result (or None if it raised an exception)."""
+    best, result = None, None
+    for i in range(repeats):
+        start = timer()
+        try:
+            result = fxn()
+        except Exception as err:
+            print('  {:<22} failed: {}: {}'.format(label, type(err).__name__, err))
+            return None
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('  {:<22} {:8.3f} s  {:7.2f} MB/s'.format(label, best, num_bytes / 1024.0**2 / best))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the throughput of the Newick parser.')
+    parser.add_argument('--leaves', type=int, default=100000, help='number of leaves in the generated tree (default 100000)')
+    parser.add_argument('--repeats', type=int, default=3, help='the best of this many runs of each path is reported (default 3)')
+    parser.add_argument('--no-comments', action='store_true', help='generate the tree without any comments')
+    parser.add_argument('--repo', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='checkout to load navargator_resources from (default this one)')
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.abspath(args.repo))
+    from navargator_resources import phylo
+    phylo.verbose = False
+
+    tree_string = random_newick(args.leaves, comments=not args.no_comments)
+    num_bytes = len(tree_string.encode('utf-8'))
+    print('Random tree of {} leaves, {:.2f} MB, from {}'.format(args.leaves, num_bytes / 1024.0**2, os.path.dirname(os.path.abspath(phylo.__file__))))
+    time_operation('tokenize_newick', lambda: sum(1 for token in phylo.Tree().tokenize_newick([tree_string])), num_bytes, args.repeats)
+    from_string = time_operation('load_newick_string', lambda: phylo.load_newick_string(tree_string), num_bytes, args.repeats)
+    tmp_fd, tmp_path = tempfile.mkstemp(suffix='.nwk')
+    try:
+        with os.fdopen(tmp_fd, 'w') as f:
+            f.write(tree_string)
+        from_file = time_operation('load_newick (file)', lambda: phylo.load_newick(tmp_path), num_bytes, args.repeats)
+    finally:
+        os.remove(tmp_path)
+    if from_string is not None and from_file is not None and from_string.newick_string() != from_file.newick_string():
+        print('Warning: the trees parsed from the string and from the file differ.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Times the phylo.Tree walks on a caterpillar (ladder-shaped) tree, where every internal node has one leaf child and one internal child. The tree is as deep as it has leaves, which is the worst case for any recursive walk.
+
+Usage:  python benchmarks/traversal.py [--leaves 50000] [--repeats 3] [--repo PATH]
+
+'--repo' loads navargator_resources from another checkout (e.g. 'git worktree add /tmp/old <commit>'), so the timings can be compared with older versions. An operation that fails is reported with its exception instead of a time; the recursive walks of older versions raise RecursionError on deep trees.
+"""
+import os, sys, time, random, argparse
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def caterpillar_newick(num_leaves, seed=1):
+    """Returns the Newick string (L0,(L1,(L2,...(Ln-2,Ln-1)...))); with random branch lengths."""
+    rng = random.Random(seed)
+    branch = lambda: '{:.5f}'.format(rng.uniform(0.001, 0.1))
+    parts = ['(L{}:{},'.format(i, branch()) for i in range(num_leaves-1)]
+    parts.append('L{}:{}'.format(num_leaves-1, branch()))
+    parts.extend('):{}'.format(branch()) for i in range(num_leaves-2))
+    parts.append(');')
+    return ''.join(parts)
+
+def time_operation(label, fxn, repeats):
+    """Prints the fastest of 'repeats' calls to fxn(), and returns its last result (or None if it raised an exception)."""
+    best, result = None, None
+    for i in range(repeats):
+        start = timer()
+        try:
+            result = fxn()
+        except Exception as err: # Includes RecursionError (a RuntimeError in Python 2)
+            print('  {:<24} failed: {}'.format(label, type(err).__name__))
+            return None
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('  {:<24} {:8.3f} s'.format(label, best))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the phylo.Tree walks on a deep caterpillar tree.')
+    parser.add_argument('--leaves', type=int, default=50000, help='number of leaves in the tree (default 50000)')
+    parser.add_argument('--repeats', type=int, default=3, help='the best of this many runs of each operation is reported (default 3)')
+    parser.add_argument('--repo', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='checkout to load navargator_resources from (default this one)')
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.abspath(args.repo))
+    from navargator_resources import phylo
+    phylo.verbose = False
+
+    tree_string = caterpillar_newick(args.leaves)
+    print('Caterpillar tree of {} leaves, from {}'.format(args.leaves, os.path.dirname(os.path.abspath(phylo.__file__))))
+    tree = time_operation('load_newick_string', lambda: phylo.load_newick_string(tree_string), 1)
+    if tree is None:
+        return
+    time_operation('newick_string', lambda: tree.newick_string(), args.repeats)
+    time_operation('copy', lambda: tree.copy(), args.repeats)
+    time_operation('get_named_leaves', lambda: tree.get_named_leaves(), args.repeats)
+    time_operation('reorder_children', lambda: tree.reorder_children(increasing=True), args.repeats)
+    time_operation('root_midpoint', lambda: tree.copy().root_midpoint(), args.repeats) # Includes a copy, so each run starts from the same tree
+    def prune_copy():
+        pruned = tree.copy()
+        pruned.prune_to_nodes([pruned.node_names['L{}'.format(i)] for i in range(0, args.leaves, 2)])
+        return pruned
+    time_operation('prune_to_nodes (half)', prune_copy, args.repeats) # Also includes a copy
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import sys, os, webbrowser, socket
 from navargator_resources.variant_finder import load_navargator_file
 from navargator_resources import navargator_daemon
+from navargator_resources.distance_cache import default_cache_dir
 
 __author__ = 'David Curran'
 __version__ = '0.7.0'
@@ -54,8 +55,16 @@ if __name__ == '__main__':
     num_threads = 3
     verbose = False
     tree_format = 'auto'
+    distance_dtype = 'float64' # 'float32' halves the memory needed for large trees
+    lazy_distances = False # True calculates distances from the tree as they're needed, for trees too large to hold their distance matrix
+    memory_budget = None # In bytes; distance matrices larger than this are memory-mapped from temporary files on the local disk
+    distance_workers = 1 # Processes used to calculate the distance matrix of each new tree; None uses every CPU
+    distance_cache_dir = None # Where the distance matrices of large trees are saved, so reopening them is fast, along with the progress of brute force runs. None turns off the cache; set it to default_cache_dir() (~/.cache/navargator/distance_matrices) or any other directory to turn it on
+    distance_cache_size = 4*1024**3 # In bytes; the least recently used matrices are deleted to keep the cache below this
+    k_medoids_init = 'random' # How k medoids replicates pick their starting medoids: 'random', 'lab', 'build', or 'k-medoids++'
+    clustering_workers = 1 # Processes that run the k medoids replicates and brute force ranges; None uses every CPU
 
-    daemon = navargator_daemon.NavargatorDaemon(server_port, threads=num_threads, verbose=verbose)
+    daemon = navargator_daemon.NavargatorDaemon(server_port, threads=num_threads, distance_dtype=distance_dtype, lazy_distances=lazy_distances, memory_budget=memory_budget, distance_workers=distance_workers, distance_cache_dir=distance_cache_dir, distance_cache_size=distance_cache_size, k_medoids_init=k_medoids_init, clustering_workers=clustering_workers, verbose=verbose)
 
     if len(sys.argv) == 1:
         input_url = 'http://127.0.0.1:{}/input?{}'.format(server_port, daemon.local_input_session_id)
@@ -64,7 +73,7 @@ if __name__ == '__main__':
         file_name = os.path.basename(input_file)
 
         if input_file.lower().endswith('.nvrgtr'):
-            vfinder = load_navargator_file(input_file, verbose=verbose)
+            vfinder = load_navargator_file(input_file, distance_dtype=distance_dtype, verbose=verbose)
             session_id = daemon.add_variant_finder(vfinder)
         else:
             tree_data = open(input_file).read().strip()
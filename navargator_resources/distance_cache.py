@@ -0,0 +1,147 @@
+"""
+Defines the DistanceCache class, a size-bounded store of tree distance matrices on the local disk.
+
+Each matrix is saved as the raw .npy file of its condensed upper triangle (see distance_matrix.py), named after the fingerprint of its tree (see phylo.Tree.get_fingerprint()) and its dtype, and is memory-mapped read-only when loaded, so reopening a large tree does not require its distance matrix to be recalculated or even read into memory. The modification time of each file is updated whenever it is loaded, and the least recently used files are deleted whenever the total size of the cache would exceed 'max_size' bytes.
+
+The progress of long clustering runs can also be saved next to the matrices as small .json files, named after the fingerprint of the tree and a key identifying the run (see VariantFinder._brute_force_clustering()), so a run can be resumed by another process. They are loaded and evicted in the same way as the matrices.
+"""
+import os, sys, tempfile, json
+import numpy as np
+from navargator_resources.distance_matrix import condensed_length
+
+if sys.version_info >= (3,3):
+    _replace_file = os.replace
+else:
+    _replace_file = os.rename # Only atomic on POSIX systems
+
+
+def default_cache_dir():
+    """Returns the directory used when a DistanceCache is created without one."""
+    base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base_dir, 'navargator', 'distance_matrices')
+
+
+class DistanceCache(object):
+    def __init__(self, cache_dir=None, max_size=4*1024**3, min_leaves=1000, verbose=False):
+        """'max_size' is in bytes. Trees with fewer than 'min_leaves' leaves are not worth caching, as their matrices are calculated in a fraction of a second."""
+        self.cache_dir = cache_dir if cache_dir else default_cache_dir()
+        self.max_size = max_size
+        self.min_leaves = min_leaves
+        self.verbose = bool(verbose)
+        self._file_ext = '.npy'
+        self._progress_ext = '.json'
+
+    # # # # #  Public methods  # # # # #
+    def should_store(self, num_leaves, dtype='float64'):
+        """Returns True if a tree with 'num_leaves' leaves should be loaded from and saved to the cache."""
+        return num_leaves >= self.min_leaves and condensed_length(num_leaves) * np.dtype(dtype).itemsize <= self.max_size
+    def load(self, fingerprint, num_leaves, dtype='float64'):
+        """Returns the read-only condensed distance matrix of the given 'dtype' saved under 'fingerprint', or None if there isn't one. Any problem reading the file is treated as a cache miss."""
+        file_path = self._file_path(fingerprint, dtype)
+        if not os.path.isfile(file_path):
+            return None
+        try:
+            dist_mat = np.load(file_path, mmap_mode='r', allow_pickle=False)
+            if dist_mat.shape != (condensed_length(num_leaves),) or dist_mat.dtype != np.dtype(dtype):
+                raise ValueError('matrix of shape {} and dtype {} does not match a tree of {} leaves'.format(dist_mat.shape, dist_mat.dtype, num_leaves))
+            os.utime(file_path, None) # Marks it as recently used
+        except (IOError, OSError, ValueError) as err:
+            if self.verbose:
+                print('\nWarning: could not load the cached distance matrix {}: {}'.format(file_path, err))
+            self._remove_file(file_path)
+            return None
+        return dist_mat.view(np.ndarray) # Still backed by the memory map
+    def save(self, fingerprint, dist_mat):
+        """Writes 'dist_mat' to the cache under 'fingerprint' and its dtype, evicting the least recently used matrices to make room for it. Returns True if the matrix was saved. Failing to write is never an error; the matrix just won't be cached."""
+        if dist_mat.nbytes > self.max_size:
+            return False
+        tmp_path = None
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            self._evict(self.max_size - dist_mat.nbytes)
+            tmp_fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            with os.fdopen(tmp_fd, 'wb') as f:
+                np.save(f, dist_mat, allow_pickle=False)
+            _replace_file(tmp_path, self._file_path(fingerprint, dist_mat.dtype)) # So a partially written file is never loaded
+        except (IOError, OSError) as err:
+            if self.verbose:
+                print('\nWarning: could not save the distance matrix to the cache in {}: {}'.format(self.cache_dir, err))
+            if tmp_path:
+                self._remove_file(tmp_path)
+            return False
+        return True
+    def load_progress(self, fingerprint, key):
+        """Returns the data saved by save_progress() under 'fingerprint' and 'key', or None if there isn't any. Any problem reading the file is treated as a cache miss."""
+        file_path = self._progress_path(fingerprint, key)
+        if not os.path.isfile(file_path):
+            return None
+        try:
+            with open(file_path) as f:
+                data = json.load(f)
+            os.utime(file_path, None) # Marks it as recently used
+        except (IOError, OSError, ValueError) as err:
+            if self.verbose:
+                print('\nWarning: could not load the saved progress {}: {}'.format(file_path, err))
+            self._remove_file(file_path)
+            return None
+        return data
+    def save_progress(self, fingerprint, key, data):
+        """Writes 'data', which must be serializable as JSON, to the cache under 'fingerprint' and 'key', replacing anything saved there before. Returns True if it was saved. As with save(), failing to write is never an error."""
+        tmp_path = None
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            with os.fdopen(tmp_fd, 'w') as f:
+                json.dump(data, f)
+            self._evict(self.max_size - os.path.getsize(tmp_path))
+            _replace_file(tmp_path, self._progress_path(fingerprint, key))
+        except (IOError, OSError) as err:
+            if self.verbose:
+                print('\nWarning: could not save progress to the cache in {}: {}'.format(self.cache_dir, err))
+            if tmp_path:
+                self._remove_file(tmp_path)
+            return False
+        return True
+    def clear(self):
+        """Deletes every matrix and saved progress in the cache."""
+        for file_path, mtime, size in self._cached_files():
+            self._remove_file(file_path)
+
+    # # # # #  Private methods  # # # # #
+    def _file_path(self, fingerprint, dtype):
+        return os.path.join(self.cache_dir, '{}_{}{}'.format(fingerprint, np.dtype(dtype).name, self._file_ext))
+    def _progress_path(self, fingerprint, key):
+        return os.path.join(self.cache_dir, '{}_{}{}'.format(fingerprint, key, self._progress_ext))
+    def _cached_files(self):
+        """Returns a list of (file_path, modification_time, size) for each matrix and saved progress in the cache, least recently used first."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        files = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith((self._file_ext, self._progress_ext)):
+                continue
+            file_path = os.path.join(self.cache_dir, file_name)
+            try:
+                stats = os.stat(file_path)
+            except OSError:
+                continue # Deleted by another process
+            files.append((file_path, stats.st_mtime, stats.st_size))
+        files.sort(key=lambda file_info: file_info[1])
+        return files
+    def _evict(self, max_size):
+        """Deletes the least recently used files until the cache holds at most 'max_size' bytes."""
+        files = self._cached_files()
+        total_size = sum(size for file_path, mtime, size in files)
+        for file_path, mtime, size in files:
+            if total_size <= max_size:
+                break
+            if self._remove_file(file_path):
+                total_size -= size
+    def _remove_file(self, file_path):
+        try:
+            os.remove(file_path)
+        except OSError: # Windows will not delete a file that is currently memory-mapped
+            return False
+        return True
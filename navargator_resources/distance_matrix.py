@@ -0,0 +1,321 @@
+"""
+Defines the CondensedDistanceMatrix and DistanceOracle classes, which VariantFinder uses in place of a full symmetrical distance matrix.
+
+Both support the subset of Numpy's 2D indexing used by the clustering methods (integers, index sequences, ':', and np.ix_() meshes), as well as row(), rows(), within(threshold) for the boolean neighbour matrix of the qt methods, and submatrix(inds) for the distances between a subset of the leaves. As the matrices are symmetrical, rows are also used wherever the code asks for columns.
+
+CondensedDistanceMatrix holds the upper triangle of the matrix, including the diagonal, in a 1D array in row-major order; this is the same layout as flatten_distance_matrix() in variant_finder.py and phylo.Tree.get_distance_matrix(condensed=True), so those arrays can be wrapped without copying them. It needs half of the memory of the full matrix.
+
+DistanceOracle stores no matrix at all. Distances are calculated when they are requested from the lowest common ancestor index of a phylo.Tree (see Tree.get_leaf_distance_function()), which takes O(n) for each row. This allows the k-medoids methods to run on trees whose matrices would not fit in memory, though anything that needs every distance (the qt methods, or saving the distances to a file) still takes O(n^2) time.
+
+If a 'memory_budget' in bytes is given, any array larger than that (the condensed data, transformed copies, or the boolean matrices from within()) is created as a memory-mapped temporary file instead, and is filled in blocks of rows that stay within the budget. The operating system then pages the data to and from the disk as needed, so trees whose matrices don't fit in memory can still be clustered as long as they fit on the local disk. The files are placed in 'memmap_dir' (the system temporary directory by default), and are deleted as soon as their arrays are.
+
+Half of each full row is strided through a condensed array, and a row from an oracle must be calculated, so both are much slower to read than a row sliced from a full matrix. Recently used rows are therefore kept in a small cache, as the clustering methods read the rows of their current medoids over and over, and k-medoids sweeps through the same candidate rows for each medoid. Once the cache is full, a new row only displaces the least recently used one if it is read again before the next miss; with plain LRU, sweeping through more rows than fit would evict every row just before it was needed again.
+"""
+import numbers, threading, tempfile
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+import numpy as np
+
+memmap_dir = None # Where arrays larger than their memory_budget are created; None uses the system temporary directory.
+
+
+def budgeted_empty(shape, dtype, memory_budget=None):
+    """Returns a new uninitialized array. If it would be larger than 'memory_budget' bytes, it is backed by an anonymous temporary file instead of memory."""
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if memory_budget is None or nbytes <= memory_budget:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(tempfile.TemporaryFile(dir=memmap_dir), dtype=dtype, mode='w+', shape=shape)
+def budgeted_copy(arr, memory_budget=None):
+    """Returns a copy of 'arr', created by budgeted_empty()."""
+    new_arr = budgeted_empty(arr.shape, arr.dtype, memory_budget)
+    block = rows_per_block(memory_budget, arr[:1].nbytes, len(arr))
+    for start in range(0, len(arr), block):
+        new_arr[start:start+block] = arr[start:start+block]
+    return new_arr
+def rows_per_block(memory_budget, row_nbytes, default):
+    """Returns the number of rows of 'row_nbytes' bytes that fit in 'memory_budget', or 'default' if there is no budget. Always at least 1."""
+    if memory_budget is None:
+        return max(1, default)
+    return max(1, int(memory_budget // max(1, row_nbytes)))
+
+def condensed_length(size):
+    """Returns the length of the condensed array of a matrix with 'size' rows."""
+    return size * (size+1) // 2
+def condensed_size(length):
+    """Returns the number of rows of the matrix represented by a condensed array of 'length' values."""
+    size = int(round((np.sqrt(8*length + 1) - 1) / 2.0))
+    if condensed_length(size) != length:
+        raise ValueError('an array of length {} cannot be the upper triangle of a square matrix'.format(length))
+    return size
+def condensed_row_bases(size):
+    """Returns an array 'bases' such that the value of row i and column j of the matrix, where i <= j, is found at index 'bases[i] + j' of the condensed array."""
+    inds = np.arange(size, dtype=np.int64)
+    return inds * (2*size - inds - 1) // 2
+
+
+class CachedRowMatrix(ABCMeta('ABC', (object,), {})): # Works as an abstract base class in Python 2 and 3
+    """The indexing and row cache shared by CondensedDistanceMatrix and DistanceOracle. Subclasses must implement _values() and _calculate_row(), or they cannot be instantiated."""
+    def __init__(self, size, dtype, row_cache_bytes=64*1024**2, memory_budget=None):
+        """Rows are cached up to 'row_cache_bytes', but always at least 16 rows. Arrays larger than 'memory_budget' bytes are memory-mapped; see budgeted_empty()."""
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self.memory_budget = memory_budget
+        self.row_cache_bytes = row_cache_bytes
+        self._max_cached_rows = max(16, row_cache_bytes // max(1, size * self.dtype.itemsize))
+        self._row_cache = OrderedDict()
+        self._new_row = (None, None)
+        self._cache_lock = threading.Lock() # Instances are shared between VariantFinder copies in different threads.
+
+    # # # # #  Public methods  # # # # #
+    def __getitem__(self, key):
+        """Mimics Numpy indexing of the full matrix with a (row_key, col_key) tuple. Each key may be an integer, a sequence of integers, or the full slice ':'; two array keys are broadcast against each other, as with np.ix_() or paired indices."""
+        row_key, col_key = key
+        if isinstance(row_key, numbers.Integral) and isinstance(col_key, numbers.Integral):
+            return self._value(row_key, col_key)
+        if isinstance(row_key, slice) and isinstance(col_key, slice):
+            return self.rows(np.arange(self.size)[row_key])[:,col_key]
+        elif isinstance(col_key, slice):
+            return self.rows(row_key)[...,col_key]
+        elif isinstance(row_key, slice):
+            cols = self.rows(col_key)[...,row_key]
+            return np.ascontiguousarray(cols.T)
+        return self._values(np.asarray(row_key), np.asarray(col_key))
+    def row(self, ind):
+        """Returns the full row at index 'ind' as a read-only 1D array. As the matrix is symmetrical, this is also the column."""
+        ind = int(ind)
+        with self._cache_lock:
+            row = self._row_cache.pop(ind, None)
+            if row is None and self._new_row[0] == ind:
+                row = self._new_row[1]
+                self._new_row = (None, None)
+            if row is not None:
+                self._row_cache[ind] = row # Moves it to the most recently used end.
+                while len(self._row_cache) > self._max_cached_rows:
+                    self._row_cache.popitem(last=False)
+                return row
+        row = self._calculate_row(ind)
+        row.flags.writeable = False
+        with self._cache_lock:
+            if len(self._row_cache) < self._max_cached_rows:
+                self._row_cache[ind] = row
+            else:
+                self._new_row = (ind, row) # Only enters the full cache if it is used again before the next miss.
+        return row
+    def rows(self, inds):
+        """Returns the full rows at the given indices. An integer gives a 1D array, and a sequence a 2D array with one row per index."""
+        inds = np.asarray(inds)
+        if inds.ndim == 0:
+            return self.row(inds)
+        rows = np.empty((len(inds), self.size), dtype=self.dtype)
+        for i, ind in enumerate(inds):
+            rows[i] = self.row(ind)
+        return rows
+    def within(self, threshold):
+        """Returns the full 2D boolean array of 'dists <= threshold'. Filled in blocks of rows, so the distances are never all held at once."""
+        mask = budgeted_empty((self.size, self.size), bool, self.memory_budget)
+        all_inds = np.arange(self.size)
+        block = max(1, 1048576 // max(1, self.size))
+        if self.memory_budget is not None: # Several temporary arrays are needed for each distance
+            block = min(block, rows_per_block(self.memory_budget, 64*self.size, block))
+        for start in range(0, self.size, block):
+            stop = min(start+block, self.size)
+            np.less_equal(self._values(all_inds[start:stop,None], all_inds), threshold, out=mask[start:stop])
+        return mask
+    def clear_row_cache(self):
+        with self._cache_lock:
+            self._row_cache.clear()
+            self._new_row = (None, None)
+
+    # # # # #  Array-like attributes  # # # # #
+    @property
+    def shape(self):
+        return (self.size, self.size)
+    def __len__(self):
+        return self.size
+
+    # # # # #  Implemented by subclasses  # # # # #
+    def _value(self, ind1, ind2):
+        """Returns the single distance between the two integer indices."""
+        return self._values(ind1, ind2)[()]
+    @abstractmethod
+    def _values(self, inds1, inds2):
+        """Returns the distances between the broadcast integer arrays 'inds1' and 'inds2'."""
+    @abstractmethod
+    def _calculate_row(self, ind):
+        """Returns a new writeable array of the full row at 'ind'."""
+
+
+class CondensedDistanceMatrix(CachedRowMatrix):
+    def __init__(self, data, size=None, row_cache_bytes=64*1024**2, memory_budget=None):
+        """'data' is the 1D array of the upper triangle, which is used without being copied. It must not be modified except through fill_rows(), or the row cache will be out of date."""
+        data = np.asarray(data)
+        if data.ndim != 1:
+            raise ValueError('the data of a condensed matrix must be 1-dimensional, not {}-dimensional'.format(data.ndim))
+        if size == None:
+            size = condensed_size(len(data))
+        elif condensed_length(size) != len(data):
+            raise ValueError('an array of length {} cannot be the upper triangle of a matrix with {} rows'.format(len(data), size))
+        CachedRowMatrix.__init__(self, size, data.dtype, row_cache_bytes, memory_budget)
+        self.data = data
+        self._row_bases = condensed_row_bases(size)
+
+    @classmethod
+    def from_full(cls, dist, dtype=None):
+        """Returns a new instance holding the upper triangle of the square 2D array 'dist', cast to 'dtype' if given. Filled one row at a time, so no large index arrays are created."""
+        size = dist.shape[0]
+        if dist.shape != (size, size):
+            raise ValueError('cannot condense a matrix of shape {} as it is not square'.format(dist.shape))
+        data = np.empty(condensed_length(size), dtype=dist.dtype if dtype is None else dtype)
+        bases = condensed_row_bases(size)
+        for i in range(size):
+            data[bases[i]+i : bases[i]+size] = dist[i,i:]
+        return cls(data, size)
+    @classmethod
+    def from_leaf_distances(cls, leaf_distances, size, dtype='float64', memory_budget=None):
+        """Returns a new instance filled from a function returned by phylo.Tree.get_leaf_distance_function(). The data is written sequentially one row at a time, so it can be built directly into a memory-mapped file larger than 'memory_budget'; phylo.Tree.get_distance_matrix(condensed=True) is several times faster, but writes all over the array."""
+        bases = condensed_row_bases(size)
+        data = budgeted_empty(condensed_length(size), dtype, memory_budget)
+        all_inds = np.arange(size)
+        for i in range(size):
+            data[bases[i]+i : bases[i]+size] = leaf_distances(i, all_inds[i:])
+        if isinstance(data, np.memmap):
+            data.flush()
+        return cls(data, size, memory_budget=memory_budget)
+
+    # # # # #  Public methods  # # # # #
+    def flat_indices(self, rows, cols):
+        """Returns the indices into self.data of the broadcast arrays of row and column indices."""
+        low, high = np.minimum(rows, cols), np.maximum(rows, cols)
+        return self._row_bases[low] + high
+    def within(self, threshold):
+        return self.expand(lambda dists: dists <= threshold, bool)
+    def fill_rows(self, inds, value):
+        """Sets every value in the given rows, and so also their columns, to 'value'. Modifies self.data in place."""
+        all_inds = np.arange(self.size)
+        for ind in inds:
+            self.data[self.flat_indices(ind, all_inds)] = value
+        self.clear_row_cache()
+    def transformed(self, transform_fxn):
+        """Returns a new instance holding 'transform_fxn(self.data)', which must return an array of the same dtype. With a memory budget the data is transformed in chunks."""
+        if self.memory_budget is None:
+            new_data = transform_fxn(self.data)
+        else:
+            new_data = budgeted_empty(self.data.shape, self.dtype, self.memory_budget)
+            chunk = 4096 * rows_per_block(self.memory_budget, 4*4096*self.dtype.itemsize, 1) # A multiple of any SIMD width, so the results are identical to a single call
+            for start in range(0, len(self.data), chunk):
+                new_data[start:start+chunk] = transform_fxn(self.data[start:start+chunk])
+        return CondensedDistanceMatrix(new_data, self.size, self.row_cache_bytes, self.memory_budget)
+    def expand(self, fxn=None, dtype=None):
+        """Returns the full symmetrical 2D array of 'fxn(self.data)', or of self.data if 'fxn' isn't given. 'fxn' must work elementwise, like 'lambda dists: dists <= threshold' with a 'dtype' of bool. The upper triangle is filled row by row, then mirrored one block at a time to limit the temporary memory."""
+        size, bases, block = self.size, self._row_bases, 512
+        full = budgeted_empty((size, size), self.dtype if dtype is None else dtype, self.memory_budget)
+        for i in range(size):
+            segment = self.data[bases[i]+i : bases[i]+size]
+            full[i,i:] = segment if fxn is None else fxn(segment)
+        for start in range(0, size, block):
+            stop = min(start+block, size)
+            full[start:stop,:start] = full[:start,start:stop].T
+            for i in range(start+1, stop):
+                full[i,start:i] = full[start:i,i]
+        return full
+    def submatrix(self, inds):
+        """Returns a new instance holding the distances between the rows at 'inds', in that order. Pruning a tree doesn't change the distances between its remaining leaves, so this is the distance matrix of the pruned tree. Filled one row at a time, within the memory budget."""
+        inds = np.asarray(inds, dtype=np.intp)
+        size = len(inds)
+        bases = condensed_row_bases(size)
+        data = budgeted_empty(condensed_length(size), self.dtype, self.memory_budget)
+        for i in range(size):
+            data[bases[i]+i : bases[i]+size] = self._values(inds[i], inds[i:])
+        return CondensedDistanceMatrix(data, size, self.row_cache_bytes, self.memory_budget)
+    def condensed(self):
+        return self
+    def copy(self):
+        return CondensedDistanceMatrix(budgeted_copy(self.data, self.memory_budget), self.size, self.row_cache_bytes, self.memory_budget)
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    # # # # #  Private methods  # # # # #
+    def _value(self, ind1, ind2):
+        if ind1 > ind2:
+            ind1, ind2 = ind2, ind1
+        return self.data[self._row_bases[ind1] + ind2]
+    def _values(self, inds1, inds2):
+        return self.data[self.flat_indices(inds1, inds2)]
+    def _calculate_row(self, ind):
+        row = np.empty(self.size, dtype=self.dtype)
+        base = self._row_bases[ind]
+        np.take(self.data, self._row_bases[:ind] + ind, out=row[:ind])
+        row[ind:] = self.data[base+ind : base+self.size]
+        return row
+
+
+class DistanceOracle(CachedRowMatrix):
+    def __init__(self, leaf_distances, size, dtype='float64', transform_fxn=None, filled_rows=None, row_cache_bytes=64*1024**2, memory_budget=None):
+        """'leaf_distances' is a function from phylo.Tree.get_leaf_distance_function(), and 'size' is the number of leaves. The distances are rounded to 'dtype' before 'transform_fxn' is applied to them, to match a CondensedDistanceMatrix built with the same dtype."""
+        CachedRowMatrix.__init__(self, size, dtype, row_cache_bytes, memory_budget)
+        self._leaf_distances = leaf_distances
+        self._transform_fxn = transform_fxn
+        self._filled_rows = dict(filled_rows) if filled_rows else {} # Maps an index to the value of its row and column, set by fill_rows()
+        self._all_inds = np.arange(size)
+        self._update_fill_arrays()
+
+    @classmethod
+    def from_tree(cls, tree, dtype='float64', memory_budget=None):
+        """Returns a new instance for the leaves of 'tree', indexed in the order of tree.get_named_leaves()."""
+        return cls(tree.get_leaf_distance_function(), len(tree.leaves), dtype, memory_budget=memory_budget)
+
+    # # # # #  Public methods  # # # # #
+    def fill_rows(self, inds, value):
+        """Every value in the given rows, and so also their columns, will be returned as 'value'."""
+        for ind in inds:
+            self._filled_rows[int(ind)] = value
+        self._update_fill_arrays()
+        self.clear_row_cache()
+    def transformed(self, transform_fxn):
+        """Returns a new instance whose distances are 'transform_fxn' of these ones."""
+        if self._transform_fxn is None:
+            new_fxn = transform_fxn
+        else:
+            new_fxn = lambda dists: transform_fxn(self._transform_fxn(dists))
+        return DistanceOracle(self._leaf_distances, self.size, self.dtype, new_fxn, self._filled_rows, self.row_cache_bytes, self.memory_budget)
+    def submatrix(self, inds):
+        """Returns a new instance for the rows at 'inds', in that order, which calculates its distances through this one's."""
+        inds = np.asarray(inds, dtype=np.intp)
+        leaf_distances = self._leaf_distances
+        sub_distances = lambda inds1, inds2: leaf_distances(inds[inds1], inds[inds2])
+        filled_rows = dict((new_ind, self._filled_rows[old_ind]) for new_ind, old_ind in enumerate(inds.tolist()) if old_ind in self._filled_rows)
+        return DistanceOracle(sub_distances, len(inds), self.dtype, self._transform_fxn, filled_rows, self.row_cache_bytes, self.memory_budget)
+    def condensed(self):
+        """Returns a new CondensedDistanceMatrix holding every distance, calculated one row at a time. Takes O(n^2) time and memory."""
+        bases = condensed_row_bases(self.size)
+        data = budgeted_empty(condensed_length(self.size), self.dtype, self.memory_budget)
+        for i in range(self.size):
+            data[bases[i]+i : bases[i]+self.size] = self._values(i, self._all_inds[i:])
+        return CondensedDistanceMatrix(data, self.size, self.row_cache_bytes, self.memory_budget)
+    def copy(self):
+        return DistanceOracle(self._leaf_distances, self.size, self.dtype, self._transform_fxn, self._filled_rows, self.row_cache_bytes, self.memory_budget)
+    @property
+    def nbytes(self):
+        """Only the cached rows take up memory."""
+        return len(self._row_cache) * self.size * self.dtype.itemsize
+
+    # # # # #  Private methods  # # # # #
+    def _values(self, inds1, inds2):
+        dists = self._leaf_distances(inds1, inds2).astype(self.dtype, copy=False)
+        if self._transform_fxn is not None:
+            dists = self._transform_fxn(dists)
+        if self._filled_rows:
+            order1, order2 = self._fill_order[inds1], self._fill_order[inds2]
+            fill_values = np.where(order2 > order1, self._fill_values[inds2], self._fill_values[inds1])
+            dists = np.where(np.maximum(order1, order2) >= 0, fill_values, dists)
+        return dists
+    def _update_fill_arrays(self):
+        """Sets the lookup arrays used by _values(): the value of each filled index, and its position in self._filled_rows (-1 if it isn't filled). Where a filled row meets a filled column, the later of the two is used."""
+        self._fill_values = np.zeros(self.size, dtype=self.dtype)
+        self._fill_order = np.full(self.size, -1, dtype=np.intp)
+        for order, (ind, value) in enumerate(self._filled_rows.items()):
+            self._fill_values[ind] = value
+            self._fill_order[ind] = order
+    def _calculate_row(self, ind):
+        return self._values(ind, self._all_inds)
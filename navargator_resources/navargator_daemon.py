@@ -68,12 +68,20 @@ class NavargatorDaemon(object):
     5514 - Error parsing data from the client.
     5515 - Error clustering the tree.
     """
-    def __init__(self, server_port, threads=2, web_server=False, verbose=False):
+    def __init__(self, server_port, threads=2, web_server=False, distance_dtype='float64', lazy_distances=False, memory_budget=None, distance_workers=1, distance_cache_dir=None, distance_cache_size=4*1024**3, k_medoids_init='random', clustering_workers=1, verbose=False):
         self.sessionID_length = 20 # Length of the unique session ID used
         self.check_interval = 30 # Garbage collection interval on server
         self.maintain_interval = 30 # Interval the client sends a signal to maintain the session
         self.server_port = server_port
         self.web_server = web_server
+        self.distance_dtype = distance_dtype # Passed to every VariantFinder; 'float32' halves their memory use
+        self.lazy_distances = lazy_distances # Passed to every VariantFinder built from a tree; True calculates distances as needed instead of storing them
+        self.memory_budget = memory_budget # Also passed to every VariantFinder; matrices larger than this many bytes are memory-mapped from temporary files
+        self.distance_workers = distance_workers # Processes used to calculate the distance matrix of each uploaded tree; None uses every CPU
+        self.distance_cache_dir = None if web_server else distance_cache_dir # Where the distance matrices of large trees are saved and reloaded; None turns off the cache. Always off for a web server, which would otherwise store every uploaded tree
+        self.distance_cache_size = distance_cache_size # In bytes; the maximum size of the distance cache
+        self.k_medoids_init = k_medoids_init # How the k medoids replicates of each uploaded tree pick their starting medoids; one of 'random', 'lab', 'build', or 'k-medoids++'
+        self.clustering_workers = clustering_workers # Processes that run the k medoids replicates and brute force ranges of each uploaded tree; None uses every CPU
         self.verbose = verbose
         self.sessions = {} # Holds the navargator instances, with session IDs as keys.
         self.job_queue = JobQueue(threads)
@@ -176,7 +184,7 @@ class NavargatorDaemon(object):
                     name2 = datum.get('name2')
                     if name1 not in vf.leaves or name2 not in vf.leaves:
                         return ("malformed data for fit_curve() from the client.", 5514)
-                    dist = vf.orig_dists[vf.index[name1], vf.index[name2]]
+                    dist = float(vf.orig_dists[vf.index[name1], vf.index[name2]])
                     datum['distance'] = dist
                     xvals.append(dist)
                     yvals.append(float(datum['value']))
@@ -218,7 +226,7 @@ class NavargatorDaemon(object):
                 return msg
             try:
                 if file_format == 'nvrgtr':
-                    vf = navargator_from_data(file_data.splitlines(), file_name=file_name, verbose=self.verbose)
+                    vf = navargator_from_data(file_data.splitlines(), file_name=file_name, distance_dtype=self.distance_dtype, verbose=self.verbose)
                     new_s_id = self.add_variant_finder(vf, browser_id=b_id)
                 else:
                     new_s_id = self.new_variant_finder(file_data, file_format, file_name=file_name, browser_id=b_id)
@@ -389,12 +397,13 @@ class NavargatorDaemon(object):
             elif vf == None:
                 return ("error in check_results_done(), there is no valid variant finder for session ID '{}'".format(s_id), 5509)
             run_ids = request.json['run_ids']
-            scores, num_clusts, max_dists = [], [], []
+            scores, num_clusts, max_dists, cycle_totals = [], [], [], []
             for run_id in run_ids:
                 if run_id not in vf.cache:
                     error_msg = 'Error: attempting to retrieve results for a clustering run that was never started.'
                     return (error_msg, 5506)
                 results = vf.cache[run_id]
+                cycle_totals.append(results.get('cycles_total', False)) # Only known for brute force runs
                 if results['status'] == 'running':
                     scores.append(False) # Used to signal that processing is ongoing.
                     num_clusts.append(results['cycles_used'])
@@ -409,7 +418,7 @@ class NavargatorDaemon(object):
                     max_dists.append(results['max_distance'])
                 else:
                     raise NavargatorRuntimeError('Error: unknown status code "{}" in check_results_done()'.format(results['status']))
-            return json.dumps({'run_ids':run_ids, 'scores':scores, 'num_clusts':num_clusts, 'max_dists':max_dists})
+            return json.dumps({'run_ids':run_ids, 'scores':scores, 'num_clusts':num_clusts, 'max_dists':max_dists, 'cycle_totals':cycle_totals})
         @self.server.route(self.daemonURL('/update-visual-options'), methods=['POST'])
         def update_visual_options():
             vf, s_id, b_id, msg = self.get_instance()
@@ -504,7 +513,7 @@ class NavargatorDaemon(object):
     def new_variant_finder(self, tree_data, tree_format, file_name='unknown file', browser_id='unknown', available=[], ignored=[]):
         if type(tree_data) == bytes:
             tree_data = tree_data.decode()
-        vf = VariantFinder(tree_data, tree_format=tree_format, file_name=file_name, verbose=self.verbose)
+        vf = VariantFinder(tree_data, tree_format=tree_format, file_name=file_name, distance_dtype=self.distance_dtype, lazy_distances=self.lazy_distances, memory_budget=self.memory_budget, distance_workers=self.distance_workers, distance_cache_dir=self.distance_cache_dir, distance_cache_size=self.distance_cache_size, k_medoids_init=self.k_medoids_init, clustering_workers=self.clustering_workers, verbose=self.verbose)
         vf.available = vf.leaves # By default
         return self.add_variant_finder(vf, browser_id)
     def add_variant_finder(self, vf, browser_id='unknown'):
@@ -580,7 +589,7 @@ class NavargatorDaemon(object):
         ignrd = set(request.json['ignored'])
         avail = set(request.json['available'])
         if chsn != vf.chosen or ignrd != vf.ignored or avail != vf.available:
-            vf = vf.copy()
+            vf = vf.copy(include_cache=False) # The cache would be cleared by the setters below anyway.
             vf.chosen = []; vf.ignored = []; vf.available = []
             vf.chosen = chsn; vf.ignored = ignrd; vf.available = avail
             try:
@@ -659,18 +668,20 @@ class NavargatorDaemon(object):
                 run_id = vf.cache['params'][params]
                 prev_method = vf.cache[run_id]['method']
                 prev_args = vf.cache[run_id]['args']
+                # A finished brute force run that was quit or ran out of cycles is run again, which continues from the combinations it already scored. That progress is kept by the session's VariantFinder, and also saved to the distance cache if there is one, so it survives the daemon stopping or the session expiring.
+                prev_brute_force = prev_method == 'brute force' and (vf.cache[run_id]['status'] == 'running' or vf.cache[run_id]['cycles_used'] >= vf.cache[run_id].get('cycles_total', 0))
                 if cluster_method == 'brute force':
-                    if prev_method == 'brute force':
+                    if prev_brute_force:
                         to_run_clustering = False
                 elif cluster_method == 'k medoids':
-                    if prev_method == 'brute force':
+                    if prev_brute_force:
                         to_run_clustering = False
                     elif prev_method == 'k medoids':
                         prev_rand_starts, rand_starts = prev_args[5], arg_list[4]
                         if prev_rand_starts >= rand_starts:
                             to_run_clustering = False
                 elif cluster_method == 'k minibatch':
-                    if prev_method == 'brute force' or prev_method == 'k medoids':
+                    if prev_brute_force or prev_method == 'k medoids':
                         to_run_clustering = False
                     elif prev_method == 'k minibatch':
                         prev_rand_starts, prev_batch = prev_args[5:7]
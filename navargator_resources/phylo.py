@@ -32,6 +32,10 @@ load_multiple_phyloxml_string(tree_string, **tree_args)
 load_multiple_nexml(tree_filename, **tree_args)
 load_multiple_nexml_string(tree_string, **tree_args)
   - These functions return a list of Tree instances. Otherwise, the same considerations described for the standard loading functions apply.
+iter_multiple_nexus(tree_filename, internal_as_names=False, **tree_args)
+iter_multiple_phyloxml(tree_filename, **tree_args)
+iter_multiple_nexml(tree_filename, **tree_args)
+  - These generator functions read the file incrementally, yielding each Tree instance as soon as it has been parsed. Only one tree is held in memory at a time, which is useful for large sets of bootstrap or posterior trees. The trees are the same as those returned by the matching load_multiple_FORMAT function.
 
 Saving methods for Tree objects
 -------------------------------
@@ -71,6 +75,7 @@ Tree.root_outgroup(outgroup, distance=0.5, distance_proportion=True)
   - Importantly, if the most recent common ancestor of the outgroup in the current tree representation is not the root, then 'outgroup' only needs to contain as few as 2 names with that same recent common ancestor. If the most recent common ancestor of the outgroup is the current root, then 'outgroup' must include the name of every leaf in the outgroup.
 Tree.root_nodes(node1, node2, distance)
   - This method re-roots the tree, placing it between the given nodes. 'node1' and 'node2' must be TreeNode objects, where one is the direct parent of the other, and the root will be placed at a phylogenetic distance of 'distance' from 'node1'.
+  - All of the rooting methods only modify the nodes on the path between the old and new roots; the other nodes are not re-validated or renamed. The arrays describing the tree are still rebuilt, as re-rooting changes the pre-order position and root distance of every node, so re-rooting takes O(n) time rather than time proportional to the depth of the moved path.
 
 Tree modification methods
 -------------------------
@@ -78,7 +83,7 @@ Tree.reorder_children(increasing=True)
   - This method reorders each node's children for asthetic purposes and ease of viewing. If increasing=True, children are ordered so that short leaves come before leaves with long branches, which come before children that are internal nodes. Setting increasing=False reverses this. Note that most phylogenetic tree viewing software respects the given order of children, but not all.
 Tree.prune_to(names, merge_monotomies=True)
 Tree.prune_to_nodes(nodes, merge_monotomies=True)
-  - These methods modify the tree in place, keeping the designated nodes and their relevant predecessors but pruning off all others. Nodes of interest can be passed directly to Tree.prune_to_nodes(nodes), or they can be designated with a list of their names to Tree.prune_to(names). If the tree is expected to be bifurcating 'merge_monotomies' should remain True. When a node is pruned, that node's sibling will be the only remaining child of the parental node. When 'merge_monotomies' is True the parental node is also removed (unless it is designated to be kept by being a part of 'names' or 'nodes'), and the sibling is connected directly to its grandparental node while retaining the original overall branch lengths. Set it to False if those monotomies should be retained.
+  - These methods modify the tree in place, keeping the designated nodes and their relevant predecessors but pruning off all others. Nodes of interest can be passed directly to Tree.prune_to_nodes(nodes), or they can be designated with a list of their names to Tree.prune_to(names). If the tree is expected to be bifurcating 'merge_monotomies' should remain True. When a node is pruned, that node's sibling will be the only remaining child of the parental node. When 'merge_monotomies' is True the parental node is also removed (unless it is designated to be kept by being a part of 'names' or 'nodes'), and the sibling is connected directly to its grandparental node while retaining the original overall branch lengths. Set it to False if those monotomies should be retained. Clades that contain none of the designated nodes are removed entirely either way. The whole tree is pruned in a single post-order pass, so this takes O(n) time regardless of how many nodes are removed.
   - Note that the Tree.get_nodes_starting_with(prefixes) method may be useful here to generate a list of nodes that all begin with one or more prefixes. This can be helpful when pruning trees that contain nodes with the same or similar names, or to capture various levels of taxonomy in a tree of life.
 Tree.replace_in_names(replacements, ignore_case=False)
   - This method modifies the names of all nodes in the tree. 'replacements' must be a dictionary={'pattern1':'new_text1', 'pattern2':'new_text2', ...}, that will replace the given 'pattern' substrings with their respective replacements in a single pass. For example, to remove all '&' characters, replace all spaces with underscores, and simplify a species designation, 'replacements' would be {'&':'', ' ':'_', 'C.elegans':'cel'}. If 'ignore_case' is True, patterns will match to substrings regardless of their case (upper, lower, or mixed). If 'ignore_case' is False, only substrings that exactly match the pattern will be replaced. In either case, the case of the new_text will not be altered.
@@ -99,22 +104,31 @@ Tree.get_named_leaves()
   - This method returns the names of the leaves as a list of strings, sorted alphabetically.
 Tree.get_ordered_names()
   - This method returns the names of the leaves as a list of strings, in the order present in the tree file.
+  - Both of these lists are generated on the first call after the tree has been modified, and are then cached until it is modified again.
+Tree.check_unique_names(max_name_length=None)
+  - This method raises a PhyloUniqueNameError if two node names would become identical when the tree is saved to Newick or PhyloXML format using the given 'max_name_length'. It is much faster than formatting the tree strings.
 Tree.get_node(name, prevent_error=False)
   - This method returns the TreeNode object named 'name'. An error will be raised if no node matches the given string, unless 'prevent_error'=True, which will cause the function to return None instead. Mappings from node names to their TreeNode objects may also be accessed through the Tree.node_names dictionary object. If the Tree instance was created with the default argument remove_name_quotes=True, the given name will also have its containing quotes removed, if present.
 Tree.get_nodes(names)
   - This method takes a sequence of node names as strings, and returns the corresponding list of TreeNode objects. A warning will be printed for any names that do not match a TreeNode object, but nothing will be added to the returned list; a consequence is that an empty list will be returned if no names match.
 Tree.get_nodes_starting_with(prefixes)
-  - This method takes a sequence of node name prefixes as strings, and returns a list of all TreeNode objects whose name begins with at least one of those prefixes.
+  - This method takes a sequence of node name prefixes as strings, and returns a list of all TreeNode objects whose name begins with at least one of those prefixes, sorted by name. The names are kept in a sorted list that is cached until the tree is modified or a node renamed, so each prefix is found by bisection in O(log(n) + matches) time; the module function names_with_prefix(sorted_names, prefix) does the same for any sorted list of names.
 Tree.get_ordered_nodes()
   - This method returns all nodes as an ordered list of TreeNode objects. It starts with the root, then its first child, then that child's first child, and so on in a depth-first pre-order (NLR) traversal.
 Tree.get_node_leaves(node)
-  - This method returns a set of TreeNode objects that are the terminal children of the given TreeNode object.
+  - This method returns a set of TreeNode objects that are the terminal children of the given TreeNode object. Whenever the tree is processed each node is given the interval of pre-order positions spanned by its clade, along with the range of its leaves in a pre-order list of all leaves, so this only takes time proportional to the size of the clade.
+Tree.is_ancestor(ancestor, node)
+  - This method returns True if the TreeNode 'ancestor' is 'node' or one of its ancestors. It takes constant time from the pre-order intervals.
+Tree.get_clade_size(node)
+  - This method returns the number of leaves at or below the TreeNode 'node' in constant time.
 Tree.get_recent_common_ancestor(nodes)
   - This method takes a sequence of TreeNode objects, and returns the most recent commont ancestor TreeNode shared by all.
 Tree.get_subtree(names, keep_root_branch=False)
   - This method takes a sequence of node names as strings, and returns a new Tree object of the subtree containing all nodes specified by 'names'. It is not necessary to include all desired node names in 'names' - in fact only one internal node name or two leaf names are required - as the returned Tree will be rooted at the most recent common ancestor of the given names. Normally the branch length of the new root will be discarded, but setting 'keep_root_branch' to True will keep it.
 Tree.get_node_subtree(node, keep_root_branch=False)
   - This method takes a TreeNode object 'node', and returns a new Tree object of the subtree rooted at that node. Normally the branch length of the new root will be discarded, but setting 'keep_root_branch' to True will keep it.
+Tree.get_pruned_tree(nodes, merge_monotomies=True)
+  - This method returns a new Tree object equivalent to a copy of this tree after calling Tree.prune_to_nodes(nodes, merge_monotomies). Only the nodes that remain are copied, so it is much faster than copying the whole tree and then pruning it. The distances between the remaining leaves are unchanged.
 Tree.copy()
   - This method returns a deep copy of the current Tree object. The new tree is independent, and so can be modified without affecting the original tree.
 
@@ -125,11 +139,17 @@ Tree.get_named_children()
 Tree.get_named_paths()
   - This method returns a dictionary describing the ancestry of all nodes in the tree: {'node_name1':['root_name', 'internal_name1', 'internal_name2', 'node_name1'], 'node_name2':[...], ...}. Each list traces the route through the tree from the root to that particular node.
 Tree.node_distance(node1, node2)
-  - This method returns as a float the phylogenetic distance between the two nodes, where 'node1' and 'node2' are both TreeNode objects.
-Tree.get_distance_matrix()
-  - This method returns 'names', 'distance_matrix'; where 'names' contains all tree leaf names as a list of strings (the same as returned by Tree.get_named_leaves()), and 'distance_matrix' is a symmetrical 2D Numpy array. The phylogenetic distance between tree leaves at indices i and j from 'names' is found by 'dist_mat[i,j]'.
-Tree.get_leaf_coordinate_points(max_dimensions=None)
-  - This method returns 'names', 'coordinate_points'; where 'names' contains all tree leaf names as a list of strings (the same as returned by Tree.get_named_leaves()), and 'coordinate_points' is a 2D numpy array. 'coordinate_points[i]' is a numpy array representing a point in Euclidean space for the tree leaf 'names[i]', such that all points respect the pairwise distances in the tree. The coordinates will use the minimum number of dimensions required to satisfy those distances, though 'max_dimensions' can be used to specify a maxinum number of dimensions. Though the least important dimensions will be discarded first, the agreement between pairwise coordinate distances and tree distances will degrade with every lost dimension.
+  - This method returns as a float the phylogenetic distance between the two nodes, where 'node1' and 'node2' are both TreeNode objects. A lowest common ancestor index is built whenever the tree is processed, so this takes constant time regardless of the depth of the tree; the same is true for each pair of nodes given to Tree.get_recent_common_ancestor(nodes).
+Tree.get_max_root_distance()
+  - This method returns as a float the largest phylogenetic distance between the root and any leaf, from the root distances stored whenever the tree is processed.
+Tree.get_distance_matrix(dtype='float', condensed=False, workers=1)
+  - This method returns 'names', 'distance_matrix'; where 'names' contains all tree leaf names as a list of strings (the same as returned by Tree.get_named_leaves()), and 'distance_matrix' is a symmetrical 2D Numpy array. The phylogenetic distance between tree leaves at indices i and j from 'names' is found by 'dist_mat[i,j]'. Set 'dtype' to 'float32' to halve the size of the matrix; the distances are still calculated at full precision, and are only rounded when they are stored. If 'condensed' is True, 'distance_matrix' is instead a 1D array of the upper triangle of the matrix (including the diagonal) in row-major order, the same as 'dist_mat[np.triu_indices(len(names))]', and the full matrix is never created. This needs half of the memory. If 'workers' is greater than 1 (or None, to use every CPU), the rows are instead split into blocks of equal size that are filled in parallel by that many processes, each writing its rows straight into one shared memory buffer from the lowest common ancestor index (see Tree.get_leaf_distance_function()); the returned array is a view of that buffer, so nothing is copied back. The distances may differ from the single process ones in the last bit.
+Tree.get_leaf_distance_function()
+  - This method returns a function 'leaf_distances(inds1, inds2)', where both arguments are integers or broadcastable integer arrays of indices into the list returned by Tree.get_named_leaves(), which returns the phylogenetic distances between those leaves as float64. Each distance takes constant time from the lowest common ancestor index, so one row of the distance matrix takes O(n) time without the matrix ever being stored. The function keeps its own copy of the data it needs, so it is unaffected by later changes to the tree.
+Tree.get_fingerprint()
+  - This method returns a hex string that identifies the tree's leaf names and branch lengths, for use as a cache key. It does not depend on the order of the children of any node or on the names of internal nodes, so two trees that give the same distance matrix from the same root will share a fingerprint. The value is cached until the tree is modified.
+Tree.get_leaf_coordinate_points(max_dimensions=None, dist_mat=None)
+  - This method returns 'names', 'coordinate_points'; where 'names' contains all tree leaf names as a list of strings (the same as returned by Tree.get_named_leaves()), and 'coordinate_points' is a 2D numpy array. 'coordinate_points[i]' is a numpy array representing a point in Euclidean space for the tree leaf 'names[i]', such that all points respect the pairwise distances in the tree. The coordinates will use the minimum number of dimensions required to satisfy those distances, though 'max_dimensions' can be used to specify a maxinum number of dimensions. Though the least important dimensions will be discarded first, the agreement between pairwise coordinate distances and tree distances will degrade with every lost dimension. If 'max_dimensions' is given and SciPy is installed, only that many eigenpairs are found (with scipy.sparse.linalg.eigsh), which is much faster for large trees than the full decomposition. An existing distance matrix of the leaves in the order of Tree.get_named_leaves() can be given as 'dist_mat' to avoid calculating it again; it may be a full 2D array, a condensed 1D array as returned by Tree.get_distance_matrix(condensed=True), or any object with a condensed() method returning one in its 'data' attribute (like VariantFinder.orig_dists).
 
 General notes
 -------------
@@ -143,12 +163,22 @@ Some functions will print warnings or other information during execution that ar
 # All nodes must have their .parent and .children attributes set. All nodes should have their .name, .branch, .support, .support_type, and .comment attributes filled if possible, though all are optional.
 # Use remove_tree_node() to remove nodes from the tree.
 # self.process_tree_nodes() must be called after adding or removing a batch of nodes.
+# Call self.update_version() after modifying node attributes without calling self.process_tree_nodes() or self.calculate_node_arrays(), so that any cached data is regenerated.
 
 
-import re, operator, itertools
+import re, operator, hashlib, ctypes, multiprocessing, bisect
+from multiprocessing.sharedctypes import RawArray
 import xml.etree.ElementTree as ET
 from collections import OrderedDict
 import numpy as np
+try:
+    from scipy.sparse.linalg import eigsh
+except ImportError:
+    eigsh = None # get_leaf_coordinate_points() then always uses the full np.linalg.eigh()
+try:
+    _process_context = multiprocessing.get_context('spawn') # Forking a process with other running threads (like the navargator daemon) can deadlock the child
+except AttributeError:
+    _process_context = multiprocessing # Python 2 can only fork on POSIX systems
 
 verbose = True
 
@@ -171,9 +201,10 @@ def load_tree_string(tree_string, internal_as_names=False, **kwargs):
         return None
 
 def load_newick(tree_filename, internal_as_names=False, **kwargs):
+    tree = Tree(**kwargs)
     with open(tree_filename) as f:
-        tree_string = f.read()
-    return load_newick_string(tree_string, internal_as_names, **kwargs)
+        tree.parse_newick(f, internal_as_names)
+    return tree
 def load_newick_string(tree_string, internal_as_names=False, **kwargs):
     tree = Tree(**kwargs)
     tree.parse_newick(tree_string, internal_as_names)
@@ -194,6 +225,11 @@ def load_multiple_nexus(tree_filename, internal_as_names=False, **kwargs):
 def load_multiple_nexus_string(tree_string, internal_as_names=False, **kwargs):
     tree = Tree(**kwargs)
     return tree.parse_multiple_nexus(tree_string, internal_as_names)
+def iter_multiple_nexus(tree_filename, internal_as_names=False, **kwargs):
+    tree = Tree(**kwargs)
+    with open(tree_filename) as f:
+        for new_tree in tree.iter_multiple_nexus(f, internal_as_names):
+            yield new_tree
 def save_multiple_nexus(trees, tree_filename, translate_command=False, support_as_comment=False, support_values=True, comments=True, internal_names=True, max_name_length=None):
     tree_string = multiple_nexus_string(trees, translate_command, support_as_comment, support_values, comments, internal_names, max_name_length)
     with open(tree_filename, 'w') as f:
@@ -258,6 +294,11 @@ def load_multiple_phyloxml(tree_filename, **kwargs):
 def load_multiple_phyloxml_string(tree_string, **kwargs):
     tree = Tree(**kwargs)
     return tree.parse_multiple_phyloxml(tree_string)
+def iter_multiple_phyloxml(tree_filename, **kwargs):
+    tree = Tree(**kwargs)
+    with open(tree_filename, 'rb') as f:
+        for new_tree in tree.iter_multiple_phyloxml(f):
+            yield new_tree
 def save_multiple_phyloxml(trees, tree_filename, support_values=True, comments=True, internal_names=True, max_name_length=None):
     tree_string = multiple_phyloxml_string(trees, support_values, comments, internal_names, max_name_length)
     with open(tree_filename, 'w') as f:
@@ -296,6 +337,11 @@ def load_multiple_nexml(tree_filename, **kwargs):
 def load_multiple_nexml_string(tree_string, **kwargs):
     tree = Tree(**kwargs)
     return tree.parse_multiple_nexml(tree_string)
+def iter_multiple_nexml(tree_filename, **kwargs):
+    tree = Tree(**kwargs)
+    with open(tree_filename, 'rb') as f:
+        for new_tree in tree.iter_multiple_nexml(f):
+            yield new_tree
 def save_multiple_nexml(trees, tree_filename, support_values=True, comments=True, internal_names=True, max_name_length=None):
     tree_string = multiple_nexml_string(trees, support_values, comments, internal_names, max_name_length)
     with open(tree_filename, 'w') as f:
@@ -329,6 +375,42 @@ def multiple_nexml_string(trees, support_values=True, comments=True, internal_na
         tree.add_nexml_nodes_edges(trees_e, tree_id, node_ids, replacer_fxn, support_values, comments, internal_names, max_name_length)
     return ET.tostring(e_tree, encoding='UTF-8', method='xml').decode()
 
+# # #  Name lookup
+def names_with_prefix(sorted_names, prefix):
+    """Returns the names in the sorted list 'sorted_names' that start with 'prefix', in order. As they are all adjacent, the first is found by bisection and the search stops at the first name that doesn't match."""
+    start = stop = bisect.bisect_left(sorted_names, prefix)
+    while stop < len(sorted_names) and sorted_names[stop].startswith(prefix):
+        stop += 1
+    return sorted_names[start:stop]
+
+# # #  Lowest common ancestor lookup
+def lca_from_euler_firsts(lca_table, first1, first2):
+    """Returns the index of the lowest common ancestor of the nodes first visited at positions 'first1' and 'first2' of the Euler tour, from the sparse table built by Tree.calculate_lca_index(). Both arguments may also be broadcastable integer arrays."""
+    low, high = np.minimum(first1, first2), np.maximum(first1, first2)
+    level = np.frexp(high - low + 1)[1] - 1 # Floor of log2 for integers
+    return np.minimum(lca_table[level, low], lca_table[level, high - (1 << level) + 1])
+def leaf_distances_from_arrays(leaf_data, inds1, inds2):
+    """Returns the float64 distances between the leaves at 'inds1' and 'inds2', from the 'leaf_data' tuple returned by Tree.get_leaf_distance_data()."""
+    leaf_firsts, leaf_root_dists, lca_table, root_dists = leaf_data
+    anc_inds = lca_from_euler_firsts(lca_table, leaf_firsts[inds1], leaf_firsts[inds2])
+    return leaf_root_dists[inds1] + leaf_root_dists[inds2] - 2.0*root_dists[anc_inds]
+
+# # #  Parallel distance matrix workers
+distance_worker_data = {} # Set in each worker process by init_distance_worker()
+def init_distance_worker(shared_buffer, dtype, num_names, condensed, leaf_data):
+    distance_worker_data['dist_mat'] = np.frombuffer(shared_buffer, dtype=dtype)
+    distance_worker_data.update(num_names=num_names, condensed=condensed, leaf_data=leaf_data)
+def fill_distance_rows(row_range):
+    """Fills rows start to stop-1 of the shared distance matrix. Rows of the condensed matrix only start at the diagonal."""
+    dist_mat, num_names, condensed, leaf_data = distance_worker_data['dist_mat'], distance_worker_data['num_names'], distance_worker_data['condensed'], distance_worker_data['leaf_data']
+    all_inds = np.arange(num_names)
+    for i in range(*row_range):
+        if condensed:
+            base = i*(2*num_names - i - 1)//2
+            dist_mat[base+i : base+num_names] = leaf_distances_from_arrays(leaf_data, i, all_inds[i:])
+        else:
+            dist_mat[i*num_names : (i+1)*num_names] = leaf_distances_from_arrays(leaf_data, i, all_inds)
+
 
 class Tree(object):
     # # #  Restricted character sets
@@ -336,6 +418,11 @@ class Tree(object):
     _nexus_replacements = {'[':'(', ']':')', ';':'.', '=':'', ' ':'_', '\t':'_', '\n':''} # Applied to tree name only
     _phyloxml_replacements = {'<':'', '>':''} # Applied to tree name, node names, and comments
     _nexml_replacements = {'<':'', '>':''} # Applied to tree name, node names, and comments
+    # # #  Streaming parser settings
+    _newick_data_regex = re.compile(r'([^(),;\[\]]*)([(),;\[\]])') # Data up to the next delimiter or square bracket
+    _newick_comment_regex = re.compile(r'[\[\]]')
+    _read_chunk_size = 1048576 # Characters read at a time when parsing from a file object
+    _nexus_statement_regex = re.compile(r'[;\[\]]')
 
     def __init__(self, support_label='bootstrap', remove_name_quotes=True):
         """Data structure used to parse and manipulate phylogenetic trees.
@@ -347,9 +434,23 @@ class Tree(object):
         self.leaves = set()
         self.internal = set()
         self.nodes = set()
-        self.paths = {}
-        self.path_dists = {}
         # # #  Private attributes
+        # Compact struct-of-arrays description of the tree, filled out by calculate_node_arrays(). Nodes are indexed by their pre-order position, and -1 indicates no such node.
+        self._node_order = [] # All TreeNodes in pre-order; their positions are used as node indices below. Emptied when the nodes are reset.
+        self._node_inds = {} # Maps a TreeNode to its index in self._node_order
+        self._postorder_inds = None # Array of the node indices in post-order (LRN).
+        self._parent_inds = None # Array of the index of each node's parent.
+        self._first_child = None # Array of the index of each node's first child.
+        self._next_sibling = None # Array of the index of each node's next sibling.
+        self._branches = None # Array of the branch length of each node.
+        self._depths = None # Array of the number of branches between the root and each node.
+        self._root_dists = None # Array of the distance from the root to each node.
+        self._euler_first = None # Array of the position where each node is first visited in the Euler tour.
+        self._lca_table = None # Sparse table of the range minimums of the Euler tour.
+        self._subtree_ends = None # Array of one past the last index in each node's clade, which covers the indices from the node's own up to this.
+        self._leaf_order = [] # All leaf TreeNodes in pre-order, so the leaves of each clade are one contiguous slice.
+        self._leaf_starts = None # Array of the start of each node's slice of self._leaf_order.
+        self._leaf_ends = None # Array of the end of each node's slice of self._leaf_order.
         self._is_cladogram = None # None means it hasn't been set; will be True or False.
         self._cladogram_branch = 1.0 # length of each branch in a cladogram
         self._remove_name_quotes = remove_name_quotes
@@ -358,6 +459,8 @@ class Tree(object):
         self._node_id_template = '_node_{}' # Must not invalidate any restricted character set
         self._node_id_index = 0
         self._max_branch_precision = 10
+        self._version = 0 # Incremented by update_version() whenever the tree is modified.
+        self._cached_data = {} # Data derived from the tree, generated on first access by get_cached_data(). Emptied by update_version().
 
     # # #  Tree rooting functions
     def root_midpoint(self):
@@ -375,14 +478,16 @@ class Tree(object):
         if ancestor != self.root:
             node1 = ancestor
             node2 = ancestor.parent
+            node_dist = ancestor.branch
         else:
-            not_outgroup = [node for node in self.leaves if node not in outgroup_nodes]
+            outgroup_set = set(outgroup_nodes)
+            not_outgroup = [node for node in self.leaves if node not in outgroup_set]
             ancestor = self.get_recent_common_ancestor(not_outgroup)
             if ancestor == self.root:
                 raise PhyloValueError('Error: could not root the tree with the given outgroup. If the outgroup spans the root in the current tree representation, ensure that you include every leaf that should be part of the outgroup. Equivalently, you can try rooting by the ingroup.')
             node2 = ancestor
             node1 = ancestor.parent
-        node_dist = self.node_distance(node1, node2)
+            node_dist = ancestor.branch
         if distance_proportion:
             if not 0 <= distance <= 1.0:
                 raise PhyloValueError("Error: if 'distance_proportion' is True, 'distance' must be a value between 0 and 1.")
@@ -404,6 +509,7 @@ class Tree(object):
             upper_dist, lower_dist = lower_node.branch - distance, distance
         else:
             raise PhyloValueError('root_nodes() requires that one of the given nodes is the parent of the other.')
+        moved_nodes = [upper_node, lower_node] # Every node whose parent or branch is changed
         if len(self.root.children) <= 1:
             raise PhyloValueError('cannot re-root a tree where the existing root has one or no children.')
         elif len(self.root.children) == 2:
@@ -412,12 +518,15 @@ class Tree(object):
                 root_child = self.root.children[1] if self.root.children[0] == lower_node else self.root.children[0]
                 root_child.branch += upper_dist
                 lower_node.branch = lower_dist
+                moved_nodes.append(root_child)
             else:
                 upper_path = self.find_path_to_root(upper_node)
+                moved_nodes.extend(upper_path)
                 # Process the old root child after removing the root:
                 root_child = self.root.children[1] if self.root.children[0] == upper_path[1] else self.root.children[0]
                 root_child.branch += upper_path[1].branch
                 root_child.parent = upper_path[1]
+                moved_nodes.append(root_child)
                 upper_path[1].children.append(root_child)
                 # Process nodes between root and upper_node:
                 prev_node = upper_path[1]
@@ -438,6 +547,7 @@ class Tree(object):
             new_root.branch = self.root.branch # Transfers any existing root branch
             if upper_node != self.root:
                 upper_path = self.find_path_to_root(upper_node)
+                moved_nodes.extend(upper_path)
                 prev_node = self.root
                 for next_node in upper_path[1:]:
                     prev_node.children.remove(next_node)
@@ -452,37 +562,34 @@ class Tree(object):
             new_root.children.append(lower_node)
             upper_node.parent = lower_node.parent = new_root
             self.root = new_root
-        self.process_tree_nodes()
+        self.process_rerooted_nodes(moved_nodes)
 
     # # #  Public functions
     def reorder_children(self, increasing=True):
         """Reorders each node's children for asthetic purposes.
         If increasing=True, children are ordered so that short leaves come before leaves with long branches, which come before children that are internal nodes. Setting increasing=False reverses this."""
         self.traverse_order_children(self.root, increasing)
+        self.calculate_node_arrays() # The cached traversal orders have changed
     def prune_to(self, names, merge_monotomies=True):
         """Modifies the tree in place, keeping 'names' and relevant predecessors but pruning off all others."""
         self.prune_to_nodes(self.get_nodes(names), merge_monotomies)
     def prune_to_nodes(self, nodes, merge_monotomies=True):
         """Modifies the tree in place, keeping 'nodes' and relevant predecessors but pruning off all others."""
-        to_remove = self.leaves - set(nodes)  # This is sufficient to erode all unwanted internal nodes.
-        for node in to_remove:
-            self.remove_tree_node(node)
-            parent = node.parent
-            if parent in nodes:
-                continue  # Only happens if the user wants to keep an internal node.
-            elif merge_monotomies and len(parent.children) == 1:
-                sib = parent.children[0]
-                if parent != self.root:
-                    # node.parent only has 1 child, so it's removed and node's sib is connected to node's grandparent.
-                    sib.branch += parent.branch
-                    par_index = parent.parent.children.index(parent)
-                    parent.parent.children[par_index] = sib
-                    sib.parent = parent.parent
-                else:
-                    # self.root now has only 1 child, so it's replaced by that child.
-                    self.root = sib
-                    self.root.branch = 0
-                self.remove_tree_node(parent, remove_from_parent=False)
+        new_root, children, branches = self.pruned_structure(nodes, merge_monotomies)
+        for node in list(self.nodes):
+            if node not in children:
+                self.remove_tree_node(node, remove_from_parent=False)
+        for node, node_children in children.items():
+            node.children = node_children
+            for child in node_children:
+                child.parent = node
+        for node, branch in branches.items():
+            node.branch = branch
+        if new_root != self.root:
+            # self.root had only 1 child, so it's replaced by that child.
+            self.root = new_root
+            self.root.parent = None
+            self.root.branch = 0
         self.process_tree_nodes()
     def replace_in_names(self, replacements, ignore_case=False):
         """Expects 'replacements' to be a dictionary={'pattern':'new_text', ...}, that will replace the string 'pattern' with 'new_text' in a single pass in all node names. 'ignore_case' allows patterns to match regardless of their case."""
@@ -497,6 +604,7 @@ class Tree(object):
         for node in self.nodes:
             if node.support is not None:
                 node.support_type = support_type
+        self.update_version()
     def clear_supports(self, value, relation='<'):
         """Removes all support values in the tree < the given 'value'. This can be modified by setting the 'relation' argument to one of: '<', '<=', '>', '>=', '=', '=='."""
         compare = {'<':operator.lt, '<=':operator.le, '>':operator.gt, '>=':operator.ge, '=':operator.eq, '==':operator.eq}.get(relation, None)
@@ -506,6 +614,7 @@ class Tree(object):
             if node.support is not None and compare(node.support, value):
                 node.support = None
                 node.support_type = None
+        self.update_version()
     def clear_negative_branches(self, new_value=0.0):
         """Sets all negative branch lengths in the tree to new_value=0.0"""
         for node in self.nodes:
@@ -549,16 +658,30 @@ class Tree(object):
             if node != self.root:
                 node.branch = cladogram_branch
         self.root.branch = 0.0
+        self.calculate_node_arrays()
 
     # # #  Public functions for working with my data structures
     def get_named_leaves(self):
         """Returns the names of the leaves as a list of strings, sorted alphabetically."""
-        names = [node.name for node in self.leaves]
-        return sorted(names)
+        return list(self.get_cached_data('named_leaves', lambda: sorted(node.name for node in self.leaves)))
     def get_ordered_names(self):
         """Returns the names of the leaves as a list of strings, in the order present in the tree file."""
-        nodes = self.get_ordered_nodes()
-        return [node.name for node in nodes if node in self.leaves]
+        return list(self.get_cached_data('ordered_names', lambda: [node.name for node in self.iter_preorder() if node in self.leaves]))
+    def get_cached_data(self, key, generate_fxn):
+        """Returns the data stored under 'key', calling generate_fxn() to create it if that hasn't been done since the tree was last modified. The returned object is shared, and so must not be modified."""
+        if key not in self._cached_data:
+            self._cached_data[key] = generate_fxn()
+        return self._cached_data[key]
+    def update_version(self):
+        """Marks the tree as modified, discarding any data cached by get_cached_data()."""
+        self._version += 1
+        if self._cached_data:
+            self._cached_data = {}
+    def check_unique_names(self, max_name_length=None):
+        """Raises a PhyloUniqueNameError if two node names would become identical when the tree is saved to Newick or PhyloXML with the given 'max_name_length', without formatting either string."""
+        for format_name, replacements in (('Newick', self._newick_replacements), ('PhyloXML', self._phyloxml_replacements)):
+            replacer_fxn = self.create_string_replacer_function(replacements)
+            self.format_node_names(self.root, replacer_fxn, set(), max_name_length, format_name)
     def get_node(self, name, prevent_error=False):
         """Given a node name as a string, returns the corresponding TreeNode object."""
         if self._remove_name_quotes and (name[0] == name[-1] == "'" or name[0] == name[-1] == '"'):
@@ -582,39 +705,41 @@ class Tree(object):
         """Given a list of strings, returns a list of TreeNode objects whose names begin with those strings."""
         if self._remove_name_quotes:
             prefixes = [pref[1:-1] if pref[0] == pref[-1] == "'" or pref[0] == pref[-1] == '"' else pref for pref in prefixes]
-        return [node for name, node in self.node_names.items() if name.startswith(tuple(prefixes))]
+        sorted_names = self.get_cached_data('sorted_names', lambda: sorted(self.node_names))
+        names = set()
+        for prefix in prefixes:
+            names.update(names_with_prefix(sorted_names, prefix))
+        return [self.node_names[name] for name in sorted(names)]
     def get_ordered_nodes(self):
         """Returns self.nodes as an ordered list. It starts with self.root, then its first child, then that child's first child, and so on in a depth-first pre-order (NLR) traversal."""
-        nodes = []
-        self.build_nodes_list(self.root, nodes)
-        return nodes
+        return list(self.iter_preorder())
     def get_node_leaves(self, node):
         """Returns a set of TreeNode objects that are the terminal children of the given node."""
         if node not in self.nodes:
             raise PhyloValueError("Error: cannot get the leaves of an invalid node.")
-        if node in self.leaves:
-            return set(node)
-        children = set()
-        for leaf in self.leaves:
-            if node in self.paths[leaf]:
-                children.add(leaf)
-        return children
+        ind = self._node_inds[node]
+        return set(self._leaf_order[self._leaf_starts[ind] : self._leaf_ends[ind]])
+    def is_ancestor(self, ancestor, node):
+        """Returns True if 'ancestor' is 'node' or any of its ancestors. Both are TreeNode objects."""
+        anc_ind, ind = self._node_inds[ancestor], self._node_inds[node]
+        return anc_ind <= ind < self._subtree_ends[anc_ind]
+    def get_clade_size(self, node):
+        """Returns the number of leaves at or below the given TreeNode."""
+        ind = self._node_inds[node]
+        return int(self._leaf_ends[ind] - self._leaf_starts[ind])
     def get_recent_common_ancestor(self, nodes):
         """Given a list of TreeNode objects, returns the most recent commont ancestor TreeNode shared by all."""
         if len(nodes) == 0:
             raise PhyloValueError("Error: could not determing the recent common ancestor, as no nodes were given.")
         elif len(nodes) == 1:
             return nodes[0]
-        ancestor = None
-        for ancestor_nodes in zip(*(self.paths[node] for node in nodes)):
-            nodes_set = set(ancestor_nodes)
-            if len(nodes_set) == 1:
-                ancestor = nodes_set.pop()
-            else:
-                break
-        if ancestor == None:
+        try:
+            anc_ind = self._node_inds[nodes[0]]
+            for node in nodes[1:]:
+                anc_ind = self.lca_index(anc_ind, self._node_inds[node])
+        except KeyError:
             raise PhyloValueError("Error: could not determing the recent common ancestor. This might indicate nodes have no single common ancestor or that the tree structure is malformed.")
-        return ancestor
+        return self._node_order[anc_ind]
     def get_subtree(self, names, keep_root_branch=False):
         """Returns a new Tree object of the subtree containing all nodes specified by 'names'."""
         nodes = self.get_nodes(names)
@@ -632,6 +757,32 @@ class Tree(object):
         self.copy_nodes(node, subtree.root, subtree)
         subtree.process_tree_nodes()
         return subtree
+    def get_pruned_tree(self, nodes, merge_monotomies=True):
+        """Returns a new Tree object of this tree as prune_to_nodes() would leave it. Only the remaining nodes are copied, so this is much faster than copying the tree and then pruning it."""
+        new_root, children, branches = self.pruned_structure(nodes, merge_monotomies)
+        new_tree = Tree(support_label=self._support_label, remove_name_quotes=self._remove_name_quotes)
+        new_tree.name = self.name
+        new_tree._is_cladogram = self._is_cladogram
+        new_tree._cladogram_branch = self._cladogram_branch
+        new_tree._node_id_template = self._node_id_template
+        new_tree._node_ids = set() # Filled as each node is copied, so the node ids are kept
+        new_tree._node_id_index = self._node_id_index
+        new_tree.root = new_root.copy(new_tree)
+        new_tree.root.parent = None
+        new_tree.root.children = []
+        if new_root != self.root:
+            new_tree.root.branch = 0.0
+        to_copy = [(old_child, new_tree.root) for old_child in reversed(children[new_root])]
+        while to_copy: # Copied in pre-order, as in copy_nodes()
+            old_node, new_parent = to_copy.pop()
+            new_node = old_node.copy(new_tree)
+            new_node.parent = new_parent
+            new_node.branch = branches.get(old_node, old_node.branch)
+            new_node.children = []
+            new_parent.children.append(new_node)
+            to_copy.extend((old_child, new_node) for old_child in reversed(children[old_node]))
+        new_tree.process_tree_nodes()
+        return new_tree
     def copy(self):
         """Returns a deep copy of the current Tree object."""
         new_tree = Tree(support_label=self._support_label, remove_name_quotes=self._remove_name_quotes)
@@ -644,6 +795,7 @@ class Tree(object):
         new_tree.root = self.root.copy(new_tree)
         self.copy_nodes(self.root, new_tree.root, new_tree)
         new_tree.process_tree_nodes()
+        new_tree._cached_data = self._cached_data.copy() # Still valid, as the trees are identical
         return new_tree
 
     # # #  Functions to extract information
@@ -653,85 +805,131 @@ class Tree(object):
         for node in self.nodes:
             node_children[node.name] = [c.name for c in node.children]
         return node_children
+    def get_fingerprint(self):
+        """Returns a hex string identifying the leaf names and branch lengths of the tree. It does not depend on the order of any node's children or on the names of internal nodes, so any two trees giving the same distance matrix from the same root will share a fingerprint."""
+        return self.get_cached_data('fingerprint', self.calculate_fingerprint)
     def get_named_paths(self):
         """Returns a dict {'name1':['root','node1','node2','name1'], ...}."""
         named_paths = {}
-        for node in self.nodes:
-            named_paths[node.name] = [n.name for n in self.paths[node]]
+        for node, par_ind in zip(self._node_order, self._parent_inds):
+            if par_ind == -1:
+                named_paths[node.name] = [node.name]
+            else: # Parents are always indexed before their children
+                named_paths[node.name] = named_paths[self._node_order[par_ind].name] + [node.name]
         return named_paths
     def node_distance(self, node1, node2):
         """Returns the phylogenetic distance between the two TreeNode objects."""
         if node1 == node2:
             return 0.0
-        for i, (n1, n2) in enumerate(zip(self.paths[node1], self.paths[node2])):
-            if n1 != n2:
-                break
-        else:
-            i = min(len(self.paths[node1]), len(self.paths[node2]))
-        return sum(self.path_dists[node1][i:]) + sum(self.path_dists[node2][i:])
-    def get_distance_matrix(self):
-        """Returns a sorted list of strings, and a 2D Numpy array. The phylogenetic distance between tree leaves i and j from 'names' is found by 'dist_mat[i,j]'."""
+        ind1, ind2 = self._node_inds[node1], self._node_inds[node2]
+        anc_ind = self.lca_index(ind1, ind2)
+        return float(self._root_dists[ind1] + self._root_dists[ind2] - 2.0*self._root_dists[anc_ind])
+    def get_max_root_distance(self):
+        """Returns the largest distance from the root to any leaf."""
+        leaf_root_dists = self._root_dists[self._first_child == -1]
+        return float(leaf_root_dists.max()) if len(leaf_root_dists) else 0.0
+    def get_distance_matrix(self, dtype='float', condensed=False, workers=1):
+        """Returns a sorted list of strings, and a 2D Numpy array of the given 'dtype'. The phylogenetic distance between tree leaves i and j from 'names' is found by 'dist_mat[i,j]'. If 'condensed' is True, the array is instead the 1D upper triangle of that matrix in row-major order, where that distance (for i <= j) is at index 'i*(2*len(names) - i - 1)//2 + j'.
+        The matrix is filled in a single post-order pass. Each node holds the distances from itself to the leaves below it, and the distances between leaves under different children of that node are filled in with one outer addition. If 'workers' is greater than 1 or None (for every CPU), it is instead filled in parallel by fill_distance_matrix_parallel()."""
         names = self.get_named_leaves()
         num_names = len(names)
-        dist_mat = np.zeros((num_names, num_names), dtype='float')
-        for i, j in itertools.combinations(range(num_names), 2):
-            node1, node2 = self.node_names[names[i]], self.node_names[names[j]]
-            dist = self.node_distance(node1, node2)
-            dist_mat[i,j] = dist
-            dist_mat[j,i] = dist
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers > 1 and num_names > 1:
+            return names, self.fill_distance_matrix_parallel(num_names, dtype, condensed, workers)
+        name_inds = {name:i for i, name in enumerate(names)}
+        if condensed:
+            dist_mat = np.zeros(num_names*(num_names+1)//2, dtype=dtype)
+            all_inds = np.arange(num_names, dtype=np.int64)
+            row_bases = all_inds * (2*num_names - all_inds - 1) // 2
+        else:
+            dist_mat = np.zeros((num_names, num_names), dtype=dtype)
+        below_inds, below_dists = {}, {} # Leaf indices under each processed node, and their distances to that node. Always summed as float64, and only rounded to 'dtype' when stored.
+        for node in reversed(self.get_ordered_nodes()): # Children are always processed before their parents.
+            if not node.children:
+                below_inds[node] = np.array([name_inds[node.name]])
+                below_dists[node] = np.zeros(1)
+                continue
+            inds_list, dists_list = [], []
+            for child in node.children:
+                child_inds = below_inds.pop(child)
+                child_dists = below_dists.pop(child) + child.branch
+                for sib_inds, sib_dists in zip(inds_list, dists_list):
+                    block = np.add.outer(sib_dists, child_dists)
+                    if condensed: # Set in chunks of rows, as the index arrays are several times larger than the block.
+                        chunk = max(1, 1048576 // len(child_inds))
+                        for start in range(0, len(sib_inds), chunk):
+                            chunk_inds = sib_inds[start:start+chunk]
+                            low = np.minimum.outer(chunk_inds, child_inds)
+                            high = np.maximum.outer(chunk_inds, child_inds)
+                            dist_mat[row_bases[low] + high] = block[start:start+chunk]
+                    else:
+                        dist_mat[np.ix_(sib_inds, child_inds)] = block
+                        dist_mat[np.ix_(child_inds, sib_inds)] = block.T
+                inds_list.append(child_inds)
+                dists_list.append(child_dists)
+            below_inds[node] = np.concatenate(inds_list)
+            below_dists[node] = np.concatenate(dists_list)
         return names, dist_mat
-    def get_leaf_coordinate_points(self, max_dimensions=None):
+    def get_leaf_distance_function(self):
+        """Returns a function leaf_distances(inds1, inds2), which takes two broadcastable integer arrays of indices into 'names' from get_named_leaves() and returns a float64 array of the distances between those leaves. Each distance takes constant time from the lowest common ancestor index, so a full row of the distance matrix takes O(n).
+        The function holds its own references to the node arrays, and so is unaffected by later changes to the tree. Distances between leaves never change when the tree is rerooted."""
+        leaf_data = self.get_leaf_distance_data()
+        def leaf_distances(inds1, inds2):
+            return leaf_distances_from_arrays(leaf_data, inds1, inds2)
+        return leaf_distances
+    def get_leaf_coordinate_points(self, max_dimensions=None, dist_mat=None):
         """Returns a sorted list of strings, and a 2D Numpy array. The coordinates for tree leaf i are found by 'coords[i]'.
-        If 'max_dimensions' is specified, the least significant dimensions will be discarded.
+        If 'max_dimensions' is specified, the least significant dimensions will be discarded, and if SciPy is available only those eigenpairs are calculated. 'dist_mat' may be given to reuse an existing distance matrix; see the module documentation.
         The algorithm was found at http://math.stackexchange.com/questions/156161/finding-the-coordinates-of-points-from-distance-matrix/423898#423898"""
-        names, dist_mat = self.get_distance_matrix()
+        names = self.get_named_leaves()
         num_leaves = len(names)
-        sqrd_dist = np.square(dist_mat)
-        # Generate the positive semi-definite square matrix M:
-        m_mat = np.zeros((num_leaves, num_leaves), dtype='float')
-        for i in range(num_leaves):
-            di1 = sqrd_dist[0,i]
-            for j in range(i, num_leaves):
-                m = di1 + sqrd_dist[0,j] - sqrd_dist[i,j]
-                m_mat[i,j] = m
-                m_mat[j,i] = m
-        m_mat /= 2.0
+        if dist_mat is None:
+            dist_mat = self.get_distance_matrix(condensed=True)[1]
+        elif hasattr(dist_mat, 'condensed'):
+            dist_mat = dist_mat.condensed().data
+        # Generate the positive semi-definite square matrix M, where M[i,j] = (D[0,i]^2 + D[0,j]^2 - D[i,j]^2) / 2. Built in place, as it is the largest array.
+        m_mat = self.squared_distance_matrix(dist_mat, num_leaves)
+        half_first_sqrd = m_mat[0] * 0.5
+        m_mat *= -0.5
+        m_mat += half_first_sqrd[:,None]
+        m_mat += half_first_sqrd
         # An eigenvalue decomposition of M yields the coordinate points:
-        values, vectors = np.linalg.eigh(m_mat)
-        tokeep = max(len(values) - max_dimensions, 0) if max_dimensions else 0
-        values, vectors = values[tokeep:], vectors[:,range(tokeep, len(values))]
-        coords = np.column_stack(vectors[:,i]*np.sqrt(val) for i, val in enumerate(values) if val > 1e-5)
+        if max_dimensions and eigsh is not None and max_dimensions < num_leaves - 1:
+            v0 = np.random.RandomState(0).uniform(0.5, 1.0, num_leaves) # Fixed, so the results are repeatable
+            values, vectors = eigsh(m_mat, k=max_dimensions, which='LA', v0=v0)
+            order = np.argsort(values)
+            values, vectors = values[order], vectors[:,order]
+        else:
+            values, vectors = np.linalg.eigh(m_mat)
+            tokeep = max(len(values) - max_dimensions, 0) if max_dimensions else 0
+            values, vectors = values[tokeep:], vectors[:,tokeep:]
+        keep = values > 1e-5
+        coords = vectors[:,keep] * np.sqrt(values[keep])
         return names, coords
 
     # # #  Newick parsing and saving functions
     def parse_newick(self, newick_str, internal_as_names=False):
+        """Parses the tree from a Newick string, or from an open file object which is read in chunks."""
         self.reset_nodes()
+        if hasattr(newick_str, 'read'):
+            chunks = iter(lambda: newick_str.read(self._read_chunk_size), '')
+        else:
+            chunks = [newick_str]
         try:
-            newick_str, final_r = self.clean_newick_string(newick_str)
+            tokens = self.tokenize_newick(chunks)
+            for segs, delim in tokens: # Anything before the first ( is ignored.
+                if delim == '(':
+                    break
+            else:
+                raise PhyloParseError('Error: malformed Newick data.')
             self.root = self.new_tree_node()
-            name, comment, branch, support = self.parse_newick_node_data(newick_str[final_r+1 : -1])
-            self.newick_info_to_node(self.root, name, branch, support, comment, internal_as_names)
-            i, r_prev, parent_nodes = newick_str.find('('), False, [self.root]
-            while i < len(newick_str):
-                lj, rj, cj, lsq, rsq = (newick_str.find(c, i+1) for c in '(),[]')
-                # Parses nested comments:
-                sub_lsq = newick_str.find('[', lsq+1)
-                while -1 < sub_lsq < rsq:
-                    sub_lsq = newick_str.find('[', sub_lsq+1)
-                    rsq = newick_str.find(']', rsq+1)
-                # Ensures the found (), are not within a comment:
-                if lsq < lj < rsq:
-                    lj = newick_str.find('(', rsq+1)
-                if lsq < rj < rsq:
-                    rj = newick_str.find(')', rsq+1)
-                if lsq < cj < rsq:
-                    cj = newick_str.find(',', rsq+1)
-                # The closest (), identifies what action to take:
-                j = min(ind for ind in (lj,rj,cj) if ind > 0)
-                if lj == j: # new internal node.
+            r_prev, parent_nodes = False, [self.root]
+            for segs, delim in tokens:
+                if delim == '(': # new internal node.
                     parent_nodes.append( self.new_tree_node(parent_nodes[-1]) )
-                else: # process node
-                    name, comment, branch, support = self.parse_newick_node_data(newick_str[i+1:j])
+                elif delim == ')' or delim == ',': # process node
+                    name, comment, branch, support = self.parse_newick_node_data(segs)
                     if r_prev: # complete latest internal node.
                         node = parent_nodes.pop()
                         is_leaf = False
@@ -740,10 +938,18 @@ class Tree(object):
                         is_leaf = True
                     self.newick_info_to_node(node, name, branch, support, comment, internal_as_names, is_leaf)
                     parent_nodes[-1].children.append(node)
-                if j == final_r:
-                    break
-                r_prev = True if rj == j else False
-                i = j
+                    if delim == ')' and len(parent_nodes) == 1: # The root has been closed.
+                        break
+                else:
+                    raise PhyloParseError('Error: malformed Newick data.')
+                r_prev = True if delim == ')' else False
+            else:
+                raise PhyloParseError('Error: malformed Newick data.')
+            segs, delim = next(tokens)
+            if delim not in (';', None):
+                raise PhyloParseError('Error: malformed Newick data.')
+            name, comment, branch, support = self.parse_newick_node_data(segs)
+            self.newick_info_to_node(self.root, name, branch, support, comment, internal_as_names)
         except:
             raise PhyloParseError('Error: malformed Newick data.')
         self.process_tree_nodes()
@@ -764,7 +970,7 @@ class Tree(object):
         try:
             return self.format_newick_string(self.root, replacer_fxn, set(), support_as_comment, support_values, comments, internal_names, max_name_length) + ';'
         except PhyloUniqueNameError as err:
-            # This is so the entire recursive stack isn't printed on error
+            # Re-raised here so the traceback of the error stays short
             raise PhyloUniqueNameError(str(err))
 
     # # #  NEXUS parsing and saving functions
@@ -772,32 +978,35 @@ class Tree(object):
         tree_commands, translate_command = self.parse_nexus_tree_commands(nexus_str)
         if len(tree_commands) > 1:
             raise PhyloParseError("Error: multiple trees detected. Use the function 'load_multiple_nexus()' instead.")
-        self.reset_nodes()
-        tree_name, _, newick_str = tree_commands[0].partition('=')
-        self.name = tree_name.strip()
-        self.parse_newick(newick_str.strip() + ';', internal_as_names)
-        #self.process_tree_nodes() #This is done in parse_newick()
-        if translate_command:
-            translation = self.format_nexus_translation(translate_command)
-            for node in self.nodes:
-                if node.name in translation:
-                    node.rename(translation[node.name])
+        translation = self.format_nexus_translation(translate_command) if translate_command else None
+        self.parse_nexus_tree_command(tree_commands[0], translation, internal_as_names)
     def parse_multiple_nexus(self, nexus_str, internal_as_names=False):
         tree_commands, translate_command = self.parse_nexus_tree_commands(nexus_str)
+        translation = self.format_nexus_translation(translate_command) if translate_command else None
         trees = []
         for tree_command in tree_commands:
-            self.reset_nodes()
-            tree_name, _, newick_str = tree_command.partition('=')
-            self.name = tree_name.strip()
-            self.parse_newick(newick_str.strip() + ';', internal_as_names)
-            #self.process_tree_nodes() #This is done in parse_newick()
-            if translate_command:
-                translation = self.format_nexus_translation(translate_command)
-                for node in self.nodes:
-                    if node.name in translation:
-                        node.rename(translation[node.name])
+            self.parse_nexus_tree_command(tree_command, translation, internal_as_names)
             trees.append(self.copy())
         return trees
+    def iter_multiple_nexus(self, nexus_file, internal_as_names=False):
+        """Generator that reads the NEXUS data from an open file object one statement at a time, yielding each tree as a new Tree object once it has been parsed. A Translate command must come before the trees that use it, as required by the format."""
+        translation, found_block, found_tree = None, False, False
+        chunks = iter(lambda: nexus_file.read(self._read_chunk_size), '')
+        for block, command, data in self.iter_nexus_commands(chunks):
+            if block != 'trees':
+                continue
+            found_block = True
+            if command == 'translate':
+                translation = self.format_nexus_translation(data)
+            elif command == 'tree':
+                found_tree = True
+                tree = Tree(support_label=self._support_label, remove_name_quotes=self._remove_name_quotes)
+                tree.parse_nexus_tree_command(data, translation, internal_as_names)
+                yield tree
+        if not found_block:
+            raise PhyloParseError('Error: malformed NEXUS file. No TREES block in the given NEXUS file.')
+        elif not found_tree:
+            raise PhyloParseError('Error: malformed NEXUS file. No trees found in the given NEXUS file.')
     def save_nexus(self, tree_filename, translate_command=False, support_as_comment=False, support_values=True, comments=True, internal_names=True, max_name_length=None):
         tree_string = self.nexus_string(translate_command, support_as_comment, support_values, comments, internal_names, max_name_length)
         with open(tree_filename, 'w') as f:
@@ -826,27 +1035,37 @@ class Tree(object):
             raise PhyloParseError("Error: multiple phylogenies detected. Use the function 'load_multiple_phyloxml()' instead.")
         else:
             phy = phylos[0]
-        self.reset_nodes()
-        self.name = phy.findtext('name', None) or phy.findtext(ns + 'name', None)
-        root_e = phy.find('clade')
-        if root_e == None:
-            root_e = phy.find(ns + 'clade')
-        self.root = self.new_tree_node()
-        self.parse_phyloxml_element_info_to_node(self.root, root_e, ns)
-        self.traverse_phyloxml(self.root, root_e, ns)
+        self.parse_phyloxml_phylogeny(phy, ns)
         self.process_tree_nodes()
     def parse_multiple_phyloxml(self, phylo_str):
         phylos, ns = self.parse_phyloxml_phylogenies(phylo_str)
         trees = []
         for phy in phylos:
-            self.reset_nodes()
-            root_e = phy.find(ns + 'clade')
-            self.root = self.new_tree_node()
-            self.parse_phyloxml_element_info_to_node(self.root, root_e, ns)
-            self.traverse_phyloxml(self.root, root_e, ns)
+            self.parse_phyloxml_phylogeny(phy, ns)
             #self.process_tree_nodes() This is done in copy()
             trees.append(self.copy())
         return trees
+    def iter_multiple_phyloxml(self, phylo_file):
+        """Generator that incrementally parses the PhyloXML data from an open file object, yielding each phylogeny as a new Tree object. The elements of each phylogeny are discarded once it has been parsed."""
+        ET_root, ns, found_phylo = None, None, False
+        try:
+            for event, element in ET.iterparse(phylo_file, events=('start', 'end')):
+                if ET_root is None:
+                    if 'phyloxml' not in element.tag:
+                        raise PhyloParseError("Error: malformed file format. The first element of a PhyloXML file must have the tag 'phyloxml'.")
+                    ET_root = element
+                    ns, _, _ = ET_root.tag.rpartition('phyloxml')
+                elif event == 'end' and element.tag in ('phylogeny', ns + 'phylogeny') and element in ET_root:
+                    found_phylo = True
+                    tree = Tree(support_label=self._support_label, remove_name_quotes=self._remove_name_quotes)
+                    tree.parse_phyloxml_phylogeny(element, ns)
+                    tree.process_tree_nodes()
+                    ET_root.remove(element)
+                    yield tree
+        except ET.ParseError:
+            raise PhyloParseError("Error: malformed PhyloXML file.")
+        if not found_phylo:
+            raise PhyloParseError("Error: malformed file format. No phylogenies were found.")
     def save_phyloxml(self, tree_filename, support_values=True, comments=True, internal_names=True, max_name_length=None):
         tree_string = self.phyloxml_string(support_values, comments, internal_names, max_name_length)
         with open(tree_filename, 'w') as f:
@@ -885,6 +1104,43 @@ class Tree(object):
             self.parse_nexml_tree_element(tree_e, ns)
             trees.append(self.copy())
         return trees
+    def iter_multiple_nexml(self, nexml_file):
+        """Generator that incrementally parses the NeXML data from an open file object, yielding each tree as a new Tree object. The elements of each tree are discarded once it has been parsed. As with parse_multiple_nexml(), only the first 'trees' block is used."""
+        ET_root, ns, depth = None, None, 0
+        found_otus, trees_e, found_tree = False, None, False
+        try:
+            for event, element in ET.iterparse(nexml_file, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if ET_root is None:
+                        if 'nexml' not in element.tag:
+                            raise PhyloParseError("Error: malformed NeXML file. The first element of a NeXML file must have the tag 'nexml'.")
+                        ET_root = element
+                        ns, _, _ = ET_root.tag.rpartition('nexml')
+                    elif depth == 2 and element.tag in ('trees', ns + 'trees') and trees_e is None:
+                        trees_e = element
+                    continue
+                depth -= 1
+                if depth == 1:
+                    if element.tag in ('otus', ns + 'otus'):
+                        found_otus = True
+                    if element is not trees_e:
+                        ET_root.remove(element) # Only the first trees block is kept, and it is emptied below.
+                elif depth == 2 and element.tag in ('tree', ns + 'tree') and element in trees_e:
+                    found_tree = True
+                    tree = Tree(support_label=self._support_label, remove_name_quotes=self._remove_name_quotes)
+                    tree.parse_nexml_tree_element(element, ns)
+                    tree.process_tree_nodes()
+                    trees_e.remove(element)
+                    yield tree
+        except ET.ParseError:
+            raise PhyloParseError("Error: malformed NeXML file.")
+        if not found_otus and verbose:
+            print("Warning: malformed NeXML file. No 'otus' block was found, but parsing can continue.")
+        if trees_e is None:
+            raise PhyloParseError("Error: malformed NeXML file. No 'trees' block was found.")
+        elif not found_tree:
+            raise PhyloParseError("Error: malformed NeXML file. No 'tree' blocks were found.")
     def save_nexml(self, tree_filename, support_values=True, comments=True, internal_names=True, max_name_length=None):
         tree_string = self.nexml_string(support_values, comments, internal_names, max_name_length)
         with open(tree_filename, 'w') as f:
@@ -909,26 +1165,22 @@ class Tree(object):
 
     # # #  Misc rooting functions
     def find_middle_point(self):
-        """Identifies leaf1 and leaf2, which are the furthest apart in the tree. Pairwise distances aren't needed, as this pair must proveably include leaf1, which is the leaf furthest from the root.
+        """Identifies leaf1 and leaf2, which are the furthest apart in the tree. Pairwise distances aren't needed, as this pair must proveably include leaf1, which is the leaf furthest from the root. Both are found from the root distances and one vectorized column of the lowest common ancestor index; ties go to the first leaf in pre-order.
         """
-        leaf1, longest_dist = None, 0.0
-        for leaf in self.leaves:
-            dist = sum(self.path_dists[leaf])
-            if dist > longest_dist:
-                leaf1 = leaf
-                longest_dist = dist
-        leaf2, longest_dist = None, 0.0
-        for leaf in self.leaves:
-            dist = self.node_distance(leaf1, leaf)
-            if dist > longest_dist:
-                leaf2 = leaf
-                longest_dist = dist
-        for ind, (n1, n2) in enumerate(zip(self.paths[leaf1], self.paths[leaf2])):
+        leaf_inds = np.flatnonzero(self._first_child == -1)
+        leaf_root_dists = self._root_dists[leaf_inds]
+        ind1 = leaf_inds[np.argmax(leaf_root_dists)]
+        leaf_dists = leaf_root_dists + self._root_dists[ind1] - 2.0*self._root_dists[self.lca_index(ind1, leaf_inds)]
+        ind2 = leaf_inds[np.argmax(leaf_dists)]
+        leaf1, leaf2, longest_dist = self._node_order[ind1], self._node_order[ind2], float(leaf_dists.max())
+        path1, path2 = self.find_path_to_root(leaf1), self.find_path_to_root(leaf2)
+        path_dists1, path_dists2 = [0.0] + [n.branch for n in path1[1:]], [0.0] + [n.branch for n in path2[1:]]
+        for ind, (n1, n2) in enumerate(zip(path1, path2)):
             if n1 != n2:
                 break
-        rev_ind = ind - len(self.paths[leaf1]) - 1
-        nodes = self.paths[leaf1][-1:rev_ind-1:-1] + self.paths[leaf2][ind:]
-        dists = self.path_dists[leaf1][-1:rev_ind:-1] + self.path_dists[leaf2][ind:]
+        rev_ind = ind - len(path1) - 1
+        nodes = path1[-1:rev_ind-1:-1] + path2[ind:]
+        dists = path_dists1[-1:rev_ind:-1] + path_dists2[ind:]
         mid_dist, cur_dist = longest_dist / 2.0, 0.0
         for i in range(len(nodes)-1):
             dist = dists[i]
@@ -944,28 +1196,58 @@ class Tree(object):
         return node1, node2, distance
 
     # # #  Misc newick parsing and saving functions
-    def clean_newick_string(self, newick_str):
-        """Removes whitespace, but only outside of comments."""
-        str_buff = []
-        final_bracket, cur_len = 0, 0
-        for data in self.separate_square_comments(newick_str):
-            if data[0] != '[':
-                clean_data = ''.join(data.split())
-                str_buff.append(clean_data)
-                brck_ind = clean_data.rfind(')')
-                if brck_ind != -1:
-                    final_bracket = cur_len + brck_ind
-                cur_len += len(clean_data)
-            else:
-                str_buff.append(data)
-                cur_len += len(data)
-        return ''.join(str_buff), final_bracket
-    def parse_newick_node_data(self, data):
-        # 'data' is a string with layout 'name[comment]:branch[support]', where all 4 parts are optional.
-        if not data:
+    def tokenize_newick(self, chunks):
+        """Generator that scans the Newick data in one pass. Yields (segments, delimiter) for each of the (),; delimiters, where segments is a list of the data and [comments] preceding that delimiter. Whitespace is removed, but only outside of comments. Yields a delimiter of None at the end of the data."""
+        data_regex, comment_regex = self._newick_data_regex, self._newick_comment_regex
+        segs, comment_buff, comment_depth, carry = [], [], 0, ''
+        for chunk in chunks:
+            text, pos = carry + chunk, 0
+            carry = ''
+            while True:
+                if comment_depth:
+                    m = comment_regex.search(text, pos)
+                    if m is None:
+                        comment_buff.append(text[pos:])
+                        break
+                    comment_buff.append(text[pos:m.end()])
+                    pos = m.end()
+                    if m.group() == '[':
+                        comment_depth += 1
+                    else:
+                        comment_depth -= 1
+                        if comment_depth == 0:
+                            segs.append(''.join(comment_buff))
+                            comment_buff = []
+                else:
+                    m = data_regex.match(text, pos)
+                    if m is None: # The data continues into the next chunk.
+                        carry = text[pos:]
+                        break
+                    data, delim = m.groups()
+                    pos = m.end()
+                    if data:
+                        data = ''.join(data.split())
+                        if data:
+                            segs.append(data)
+                    if delim == '[':
+                        comment_depth = 1
+                        comment_buff.append(delim)
+                    elif delim == ']':
+                        raise PhyloParseError('Error: mismatched square brackets in the Newick data.')
+                    else:
+                        yield segs, delim
+                        segs = []
+        if comment_depth:
+            raise PhyloParseError('Error: mismatched square brackets in the Newick data.')
+        carry = ''.join(carry.split())
+        if carry:
+            segs.append(carry)
+        yield segs, None
+    def parse_newick_node_data(self, segs):
+        # 'segs' are the data and comment segments from tokenize_newick() with layout 'name[comment]:branch[support]', where all 4 parts are optional.
+        if not segs:
             return '', '', '', ''
         name, comment, branch, support = '', '', '', ''
-        segs = self.separate_square_comments(data)
         if len(segs) == 4:
             if segs[0][0] != '[' and segs[1][0] == '[' and segs[2][0] == ':' and segs[3][0] == '[':
                 name, comment, branch, support = segs
@@ -1013,12 +1295,23 @@ class Tree(object):
         if comment:
             node.comment = comment
     def format_newick_string(self, node, replacer_fxn, all_names, support_as_comment, support_values, comments, internal_names, max_name_length):
-        name = replacer_fxn(node.name)[:max_name_length] if node.name != node.id else ''
-        if name != '':
-            if name in all_names:
-                raise PhyloUniqueNameError("Error: cannot save tree in Newick format. After removing restricted characters and truncating to {} characters, two nodes ended up with the name '{}'".format(max_name_length, name))
-            else:
-                all_names.add(name)
+        names, node_strs = self.format_node_names(node, replacer_fxn, all_names, max_name_length, 'Newick'), {}
+        for nd in self.iter_postorder(node):
+            node_strs[nd] = self.format_newick_node(nd, names.pop(nd), [node_strs.pop(child) for child in nd.children], support_as_comment, support_values, comments, internal_names)
+        return node_strs[node]
+    def format_node_names(self, node, replacer_fxn, all_names, max_name_length, format_name):
+        """Returns a dict mapping each node below 'node' to its cleaned and truncated name, or '' if it is unnamed."""
+        names = {}
+        for nd in self.iter_preorder(node): # Names are checked in the order they appear in the file.
+            name = replacer_fxn(nd.name)[:max_name_length] if nd.name != nd.id else ''
+            if name != '':
+                if name in all_names:
+                    raise PhyloUniqueNameError("Error: cannot save tree in {} format. After removing restricted characters and truncating to {} characters, two nodes ended up with the name '{}'".format(format_name, max_name_length, name))
+                else:
+                    all_names.add(name)
+            names[nd] = name
+        return names
+    def format_newick_node(self, node, name, children_strs, support_as_comment, support_values, comments, internal_names):
         comment = '[{}]'.format(node.comment) if node.comment else ''
         if node in self.leaves:
             if comments:
@@ -1028,7 +1321,7 @@ class Tree(object):
             else:
                 return '{}:{}'.format(name, self.format_branch(node.branch))
         else:
-            children_buff = ['(', ','.join(self.format_newick_string(child, replacer_fxn, all_names, support_as_comment, support_values, comments, internal_names, max_name_length) for child in node.children), ')']
+            children_buff = ['(', ','.join(children_strs), ')']
             if support_as_comment:
                 if internal_names and name:
                     children_buff.append(name)
@@ -1051,21 +1344,20 @@ class Tree(object):
 
     # # #  Misc NEXUS parsing and saving functions
     def parse_nexus_blocks(self, nexus_str):
-        nexus_str = nexus_str.strip()
-        if nexus_str[:7].lower() != '#nexus\n':
-            raise PhyloParseError("Error: malformed NEXUS file.")
-        nexus_lines = [] # Ensures the only ; are outside of comments
-        for data_str in self.separate_square_comments(nexus_str[7:]):
-            if not data_str:
-                continue
-            elif data_str[0] == '[':
-                nexus_lines.append(data_str.replace(';','.'))
+        blocks, commands = OrderedDict(), []
+        for block, command, data in self.iter_nexus_commands([nexus_str]):
+            if command == 'begin':
+                commands = []
+            elif command == 'end':
+                blocks[block] = commands
+                commands = []
             else:
-                nexus_lines.append(data_str)
-        nexus_lines = ''.join(nexus_lines).split(';')
-        blocks, block = OrderedDict(), None
-        commands = []
-        for line in nexus_lines:
+                commands.append((command, data))
+        return blocks
+    def iter_nexus_commands(self, chunks):
+        """Generator that yields (block, command, data) for each command within a NEXUS block, as well as (block, 'begin', '') and (block, 'end', '') when a block opens or closes."""
+        block, ended_blocks = None, set()
+        for line in self.iter_nexus_statements(chunks):
             line = line.strip()
             if not line:
                 continue
@@ -1078,20 +1370,53 @@ class Tree(object):
             cmd_line = ''.join(cmds[cmd_ind :]).strip()
             if cmd_line.lower().startswith('begin '):
                 block = cmd_line[6:].lower().strip()
-                if block in blocks:
+                if block in ended_blocks:
                     raise PhyloParseError("Error: the NEXUS file contains multiple '{}' blocks.".format(block))
-                commands = []
+                yield block, 'begin', ''
             elif cmd_line.lower() == 'end':
-                blocks[block] = commands
-                block, commands = None, []
+                yield block, 'end', ''
+                ended_blocks.add(block)
+                block = None
             elif block is not None:
                 command, _, data = cmd_line.strip().partition(' ')
-                commands.append((command.lower().strip(), data))
+                yield block, command.lower().strip(), data
             else:
                 pass
         if block is not None:
             raise PhyloParseError("Error: malformed NEXUS file. The final block had no end.")
-        return blocks
+    def iter_nexus_statements(self, chunks):
+        """Generator that checks the #NEXUS header, then yields the data between each ; in turn. Any ; found within a [comment] is replaced by a '.'."""
+        header, comment_depth, buff = '', 0, []
+        for chunk in chunks:
+            if header is not None:
+                header += chunk
+                if len(header.lstrip()) < 7:
+                    continue
+                chunk, header = header.lstrip(), None
+                if chunk[:7].lower() != '#nexus\n':
+                    raise PhyloParseError("Error: malformed NEXUS file.")
+                chunk = chunk[7:]
+            pos = 0
+            for m in self._nexus_statement_regex.finditer(chunk):
+                char, ind = m.group(), m.start()
+                if char == '[':
+                    comment_depth += 1
+                elif char == ']':
+                    if comment_depth:
+                        comment_depth -= 1
+                elif comment_depth: # A ; within a comment
+                    buff.append(chunk[pos:ind] + '.')
+                    pos = ind + 1
+                else:
+                    buff.append(chunk[pos:ind])
+                    yield ''.join(buff)
+                    buff, pos = [], ind + 1
+            buff.append(chunk[pos:])
+        if header is not None:
+            raise PhyloParseError("Error: malformed NEXUS file.")
+        if comment_depth:
+            raise PhyloParseError("Error: malformed NEXUS file. Mismatched square brackets.")
+        yield ''.join(buff)
     def parse_nexus_tree_commands(self, nexus_str):
         tree_commands, translate_command = [], None
         blocks = self.parse_nexus_blocks(nexus_str)
@@ -1106,6 +1431,16 @@ class Tree(object):
         if not tree_commands:
             raise PhyloParseError('Error: malformed NEXUS file. No trees found in the given NEXUS file.')
         return tree_commands, translate_command
+    def parse_nexus_tree_command(self, tree_command, translation, internal_as_names):
+        self.reset_nodes()
+        tree_name, _, newick_str = tree_command.partition('=')
+        self.name = tree_name.strip()
+        self.parse_newick(newick_str.strip() + ';', internal_as_names)
+        #self.process_tree_nodes() #This is done in parse_newick()
+        if translation:
+            for node in self.nodes:
+                if node.name in translation:
+                    node.rename(translation[node.name])
     def format_nexus_translation(self, translate_command):
         trans = {}
         for entry in translate_command.split(','):
@@ -1140,12 +1475,23 @@ class Tree(object):
         if len(phylos) == 0:
             raise PhyloParseError("Error: malformed file format. No phylogenies were found.")
         return phylos, ns
+    def parse_phyloxml_phylogeny(self, phy, ns):
+        self.reset_nodes()
+        self.name = phy.findtext('name', None) or phy.findtext(ns + 'name', None)
+        root_e = phy.find('clade')
+        if root_e == None:
+            root_e = phy.find(ns + 'clade')
+        self.root = self.new_tree_node()
+        self.parse_phyloxml_element_info_to_node(self.root, root_e, ns)
+        self.traverse_phyloxml(self.root, root_e, ns)
     def traverse_phyloxml(self, node, element, ns):
-        for child_element in element.findall('clade') + element.findall(ns + 'clade'):
-            child_node = self.new_tree_node(node)
+        to_parse = [(node, child_element) for child_element in reversed(element.findall('clade') + element.findall(ns + 'clade'))]
+        while to_parse: # Nodes are created in pre-order, as they appear in the file
+            parent_node, child_element = to_parse.pop()
+            child_node = self.new_tree_node(parent_node)
             self.parse_phyloxml_element_info_to_node(child_node, child_element, ns)
-            node.children.append(child_node)
-            self.traverse_phyloxml(child_node, child_element, ns)
+            parent_node.children.append(child_node)
+            to_parse.extend((child_node, e) for e in reversed(child_element.findall('clade') + child_element.findall(ns + 'clade')))
     def parse_phyloxml_element_info_to_node(self, node, element, ns):
         seq_element = element.find('sequence')
         if seq_element == None:
@@ -1173,6 +1519,12 @@ class Tree(object):
             if prop_e.get('applies_to') == 'clade' and prop_e.get('ref') == 'comment':
                 node.comment = prop_e.text
     def add_nodes_to_phyloxml(self, node, parent_element, replacer_fxn, all_names, support_values, comments, internal_names, max_name_length):
+        to_add = [(node, parent_element)]
+        while to_add:
+            nd, par_element = to_add.pop()
+            element = self.add_node_to_phyloxml(nd, par_element, replacer_fxn, all_names, support_values, comments, internal_names, max_name_length)
+            to_add.extend((child, element) for child in reversed(nd.children))
+    def add_node_to_phyloxml(self, node, parent_element, replacer_fxn, all_names, support_values, comments, internal_names, max_name_length):
         element = ET.SubElement(parent_element, 'clade')
         name = replacer_fxn(node.name)[:max_name_length] if node.name != node.id else ''
         if name != '':
@@ -1196,8 +1548,7 @@ class Tree(object):
             prop_e = ET.Element('property', attrib={'applies_to':'clade', 'datatype':'xsd:string', 'ref':'comment'})
             prop_e.text = replacer_fxn(str(node.comment))
             element.append(prop_e)
-        for child in node.children:
-            self.add_nodes_to_phyloxml(child, element, replacer_fxn, all_names, support_values, comments, internal_names, max_name_length)
+        return element
 
     # # #  Misc NeXML parsing and saving functions
     def parse_nexml_otus_trees(self, nexml_str):
@@ -1346,6 +1697,8 @@ class Tree(object):
     def reset_nodes(self):
         self.root = None
         self.nodes = set()
+        self._node_order = [] # Invalidates the cached traversal orders
+        self._is_cladogram = None # Re-detected by process_tree_nodes(), so each tree of a multi-tree file gets its own
         self._node_ids = set()
         self._node_id_index = 0
     def new_tree_node(self, parent=None, node_id=None):
@@ -1359,6 +1712,27 @@ class Tree(object):
         node = TreeNode(self, node_id, parent)
         self.nodes.add(node)
         return node
+    def pruned_structure(self, nodes, merge_monotomies):
+        """Used by prune_to_nodes() and get_pruned_tree(). Determines the tree pruned to 'nodes' in a single post-order pass, where each node keeps the children that lead to a kept node, and is itself kept if it has any or is in 'nodes'. Returns (new_root, children, branches), where 'children' maps every remaining node to its list of remaining children, and 'branches' maps each node that replaced a merged monotomy to its new branch length. Does not modify the tree."""
+        keep = set(nodes)
+        if not keep:
+            raise PhyloValueError('Error: cannot prune the tree to an empty set of nodes.')
+        replacements, children, branches = {}, {}, {} # 'replacements' maps each remaining clade to the node that heads it; differs only for merged monotomies.
+        for node in reversed(self._node_order):
+            node_children = [replacements[child] for child in node.children if child in replacements]
+            if not node_children and node not in keep:
+                continue
+            elif merge_monotomies and len(node_children) == 1 and node not in keep:
+                # node only has 1 child, so it's removed and its child is connected to node's parent, retaining the original overall branch length.
+                child = node_children[0]
+                branches[child] = branches.get(child, child.branch) + node.branch
+                replacements[node] = child
+            else:
+                children[node] = node_children
+                replacements[node] = node
+        if self.root not in replacements:
+            raise PhyloValueError('Error: none of the nodes to keep were found in the tree.')
+        return replacements[self.root], children, branches
     def remove_tree_node(self, node, remove_from_parent=True):
         """Expects process_tree_nodes() to be called afterwards, as does not modify self.leaves, self.internal or other such attributes."""
         if remove_from_parent and node != self.root:
@@ -1400,35 +1774,154 @@ class Tree(object):
             if node != self.root:
                 if self._is_cladogram:
                     node.branch = self._cladogram_branch
-            if node.name in self.node_names:
-                i = 2
-                name = '{}_{}'.format(node.name, i)
-                while name in self.node_names:
-                    i += 1
-                    name = '{}_{}'.format(node.name, i)
-                if verbose:
-                    print('Warning: non-unique node "{}" was renamed to "{}"'.format(node.name, name))
-                node.name = name
-            self.node_names[node.name] = node
+            self.add_node_name(node)
             node._been_processed = True
-        self.calculate_paths()
-    def calculate_paths(self):
-        """Fills out self.paths and self.path_dists."""
-        self.paths = {}
-        for node in self.nodes:
-            path = self.find_path_to_root(node)
-            self.paths[node] = path
-            self.path_dists[node] = [0.0] + [n.branch for n in path[1:]]
+        self.calculate_node_arrays()
+    def process_rerooted_nodes(self, moved_nodes):
+        """Used by root_nodes() in place of process_tree_nodes(). Only the nodes in 'moved_nodes' had their parents or branches changed, and the only possible new node is the root, so only those are processed. The node arrays are still rebuilt for the whole tree, so this takes O(n) time."""
+        if not self.root._been_processed: # A new root was added to an unrooted tree
+            if not self.root.name:
+                self.root.name = self.root.id
+            self.internal.add(self.root)
+            self.add_node_name(self.root)
+            self.root._been_processed = True
+        if self._is_cladogram:
+            for node in moved_nodes:
+                if node != self.root:
+                    node.branch = self._cladogram_branch
+        self.calculate_node_arrays() # Every pre-order position, root distance and LCA table entry can change, not only those of the moved nodes
+    def add_node_name(self, node):
+        """Adds 'node' to self.node_names, first renaming it if its name is already taken."""
+        if node.name in self.node_names:
+            i = 2
+            name = '{}_{}'.format(node.name, i)
+            while name in self.node_names:
+                i += 1
+                name = '{}_{}'.format(node.name, i)
+            if verbose:
+                print('Warning: non-unique node "{}" was renamed to "{}"'.format(node.name, name))
+            node.name = name
+        self.node_names[node.name] = node
+    def calculate_node_arrays(self):
+        """Fills out self._node_order, self._node_inds, and the compact arrays describing the tree structure, in a single pre-order walk. Also builds the lowest common ancestor index.
+        The clade of the node at index i covers indices i to self._subtree_ends[i]-1 of self._node_order, and its leaves are self._leaf_order[self._leaf_starts[i]:self._leaf_ends[i]], where self._leaf_order holds every leaf in pre-order."""
+        self.update_version()
+        node_order, node_inds = [self.root], {self.root:0}
+        parent_inds, first_child, next_sibling = [-1], [-1], [-1]
+        branches, depths, root_dists = [self.root.branch], [0], [0.0]
+        euler_first, euler, postorder = [0], [0], []
+        subtree_ends = [0]
+        stack = [[self.root, iter(self.root.children), -1]] # [node, remaining children, index of the last child visited]
+        while stack:
+            node, children, prev_ind = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                node_ind = node_inds[node]
+                postorder.append(node_ind)
+                subtree_ends[node_ind] = len(node_order)
+                if stack:
+                    euler.append(node_inds[stack[-1][0]])
+                continue
+            ind, par_ind = len(node_order), node_inds[node]
+            node_order.append(child)
+            node_inds[child] = ind
+            parent_inds.append(par_ind)
+            first_child.append(-1)
+            next_sibling.append(-1)
+            if prev_ind == -1:
+                first_child[par_ind] = ind
+            else:
+                next_sibling[prev_ind] = ind
+            stack[-1][2] = ind
+            branches.append(child.branch)
+            depths.append(depths[par_ind] + 1)
+            root_dists.append(root_dists[par_ind] + child.branch)
+            euler_first.append(len(euler))
+            euler.append(ind)
+            subtree_ends.append(0)
+            stack.append([child, iter(child.children), -1])
+        self._node_order, self._node_inds = node_order, node_inds
+        self._parent_inds = np.array(parent_inds, dtype=np.int32)
+        self._first_child = np.array(first_child, dtype=np.int32)
+        self._next_sibling = np.array(next_sibling, dtype=np.int32)
+        self._branches = np.array(branches, dtype='float')
+        self._depths = np.array(depths, dtype=np.int32)
+        self._root_dists = np.array(root_dists, dtype='float')
+        self._postorder_inds = np.array(postorder, dtype=np.int32)
+        self._euler_first = np.array(euler_first, dtype=np.int32)
+        self._subtree_ends = np.array(subtree_ends, dtype=np.int32)
+        is_leaf = self._first_child == -1
+        self._leaf_order = [node_order[ind] for ind in np.flatnonzero(is_leaf)]
+        leaves_before = np.concatenate(([0], np.cumsum(is_leaf, dtype=np.int32))) # The number of leaves before each pre-order index
+        self._leaf_starts = leaves_before[:-1]
+        self._leaf_ends = leaves_before[self._subtree_ends]
+        self.calculate_lca_index(euler)
+    def calculate_fingerprint(self):
+        """Hashes each node in post-order from its branch length and either its name (leaves) or the sorted hashes of its children (internal nodes). The root branch is ignored."""
+        digests = {}
+        for ind in self._postorder_inds:
+            node = self._node_order[ind]
+            branch = repr(float(node.branch)) if ind != 0 else '0.0'
+            if node.children:
+                data = b'N' + b''.join(sorted(digests.pop(child) for child in node.children))
+            else:
+                data = b'L' + node.name.encode('utf-8')
+            digests[node] = hashlib.sha1(branch.encode('ascii') + b':' + data).digest()
+        return hashlib.sha1(digests[self.root]).hexdigest()
+    def calculate_lca_index(self, euler):
+        """Fills out the sparse table used for constant-time lowest common ancestor queries. Nodes are numbered in pre-order, so the ancestor of any stretch of the Euler tour is simply the node with the smallest index in that stretch; a sparse table of those minimums answers each query with two lookups."""
+        num_levels = max(len(euler).bit_length(), 1)
+        table = np.zeros((num_levels, len(euler)), dtype=np.int32)
+        table[0] = euler
+        for level in range(1, num_levels):
+            half = 1 << (level-1)
+            table[level,:-half] = np.minimum(table[level-1,:-half], table[level-1,half:])
+        self._lca_table = table
+    def lca_index(self, ind1, ind2):
+        """Returns the index of the most recent common ancestor of the nodes at indices 'ind1' and 'ind2' of self._node_order. Both arguments may also be equally sized integer arrays, in which case an array of ancestor indices is returned."""
+        return lca_from_euler_firsts(self._lca_table, self._euler_first[ind1], self._euler_first[ind2])
+    def get_leaf_distance_data(self):
+        """Returns a tuple of the arrays needed by leaf_distances_from_arrays(), for the leaves in the order of get_named_leaves(). The arrays are never modified, as calculate_node_arrays() replaces them."""
+        node_inds, node_names = self._node_inds, self.node_names
+        leaf_inds = np.array([node_inds[node_names[name]] for name in self.get_named_leaves()], dtype=np.int32)
+        return (self._euler_first[leaf_inds], self._root_dists[leaf_inds], self._lca_table, self._root_dists)
     def find_path_to_root(self, node):
-        path = []
-        self.traverse_parents_to_root(node, path)
+        path = [node]
+        while node != self.root:
+            node = node.parent
+            path.append(node)
         return path[::-1]
-    def traverse_parents_to_root(self, node, path):
-        path.append(node)
-        if node == self.root:
+    def has_cached_order(self):
+        """Returns True if the traversal orders built by calculate_node_arrays() still describe the current nodes."""
+        return len(self._node_order) == len(self.nodes) and self._node_order[0] == self.root
+    def iter_preorder(self, node=None):
+        """Yields the nodes at and below 'node' (the root by default) in depth-first pre-order (NLR), without recursion. The cached order is used when the whole tree is walked."""
+        if (node is None or node == self.root) and self.has_cached_order():
+            for nd in self._node_order:
+                yield nd
             return
-        else:
-            self.traverse_parents_to_root(node.parent, path)
+        to_visit = [node or self.root]
+        while to_visit:
+            nd = to_visit.pop()
+            yield nd
+            to_visit.extend(reversed(nd.children))
+    def iter_postorder(self, node=None):
+        """Yields the nodes at and below 'node' (the root by default) in depth-first post-order (LRN), without recursion. The cached order is used when the whole tree is walked. Each node is yielded only after all of its children, so it is safe to modify a node's children once it has been yielded."""
+        if (node is None or node == self.root) and self.has_cached_order():
+            for ind in self._postorder_inds:
+                yield self._node_order[ind]
+            return
+        node = node or self.root
+        stack = [(node, iter(node.children))]
+        while stack:
+            nd, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                yield nd
+            else:
+                stack.append((child, iter(child.children)))
     def separate_square_comments(self, data_str):
         """Given a string, separates it into data and comments.
         Ex: 'some_data[a comment] data [now [a nested] comment]end' becomes ['some_data', '[a comment]', ' data ', '[now [a nested] comment]', 'end']."""
@@ -1469,30 +1962,69 @@ class Tree(object):
         else:
             return '{{:.{}f}}'.format(self._max_branch_precision).format(branch)
     def copy_nodes(self, old_parent, new_parent, new_tree):
-        new_children = []
-        for old_child in old_parent.children:
+        new_parent.children = []
+        to_copy = [(old_child, new_parent) for old_child in reversed(old_parent.children)]
+        while to_copy: # Nodes are copied in pre-order, so new node ids are assigned in the same order as before
+            old_child, new_node = to_copy.pop()
             new_child = old_child.copy(new_tree)
-            new_child.parent = new_parent
-            new_children.append(new_child)
+            new_child.parent = new_node
+            new_child.children = []
+            new_node.children.append(new_child)
             new_tree.nodes.add(new_child)
-            self.copy_nodes(old_child, new_child, new_tree)
-        new_parent.children = new_children
+            to_copy.extend((grandchild, new_child) for grandchild in reversed(old_child.children))
+    def squared_distance_matrix(self, dist_mat, num_leaves):
+        """Used by get_leaf_coordinate_points(). Returns a new full float64 array of the squares of 'dist_mat', which may be full or condensed. A condensed matrix is expanded row by row, then mirrored in blocks."""
+        if dist_mat.ndim == 2:
+            return np.square(dist_mat, dtype=np.float64)
+        sqrd, base, block = np.empty((num_leaves, num_leaves), dtype=np.float64), 0, 512
+        for i in range(num_leaves):
+            np.square(dist_mat[base+i : base+num_leaves], out=sqrd[i,i:], dtype=np.float64)
+            base += num_leaves - i - 1
+        for start in range(0, num_leaves, block):
+            stop = min(start + block, num_leaves)
+            sqrd[start:stop,:start] = sqrd[:start,start:stop].T
+            diag_block = sqrd[start:stop,start:stop]
+            lower = np.tril_indices(stop - start, -1)
+            diag_block[lower] = diag_block.T[lower]
+        return sqrd
+    def fill_distance_matrix_parallel(self, num_names, dtype, condensed, workers):
+        """Used by get_distance_matrix(). The rows are split into several blocks per worker with about the same number of values each, and every worker process writes its blocks straight into a shared buffer, which is returned as a Numpy array without being copied. The workers are spawned rather than forked, so this is safe to call from a multithreaded program."""
+        dtype = np.dtype(dtype)
+        if condensed:
+            row_lengths = np.arange(num_names, 0, -1, dtype=np.int64)
+        else:
+            row_lengths = np.full(num_names, num_names, dtype=np.int64)
+        row_ends = np.cumsum(row_lengths)
+        num_blocks = min(num_names, 4*workers) # More blocks than workers, so none sit idle at the end.
+        bounds = np.searchsorted(row_ends, np.linspace(0, row_ends[-1], num_blocks+1)[1:-1], side='right')
+        bounds = np.unique(np.concatenate(([0], bounds, [num_names])))
+        row_ranges = [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+        shared_buffer = RawArray(ctypes.c_char, int(row_ends[-1]) * dtype.itemsize) # Zeroed, and shared with the worker processes.
+        pool = _process_context.Pool(workers, initializer=init_distance_worker, initargs=(shared_buffer, dtype, num_names, condensed, self.get_leaf_distance_data()))
+        try:
+            pool.map(fill_distance_rows, row_ranges, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        dist_mat = np.frombuffer(shared_buffer, dtype=dtype)
+        return dist_mat if condensed else dist_mat.reshape((num_names, num_names))
     def traverse_order_children(self, node, increasing):
-        order, total_children = {}, 0
-        for child in node.children:
-            if child in self.leaves:
-                order[child] = (0, child.branch)
-                total_children += 1
-            else:
-                sub_children = self.traverse_order_children(child, increasing)
-                order[child] = (sub_children, child.branch)
-                total_children += sub_children
-        node.children.sort(key=lambda nd: order[nd], reverse=not increasing)
-        return total_children
-    def build_nodes_list(self, node, lst):
-        lst.append(node)
-        for child in node.children:
-            self.build_nodes_list(child, lst)
+        total_children = {} # The number of leaves below each internal node
+        for nd in self.iter_postorder(node):
+            if nd in self.leaves:
+                continue
+            order, num_children = {}, 0
+            for child in nd.children:
+                if child in self.leaves:
+                    order[child] = (0, child.branch)
+                    num_children += 1
+                else:
+                    sub_children = total_children.pop(child)
+                    order[child] = (sub_children, child.branch)
+                    num_children += sub_children
+            nd.children.sort(key=lambda n: order[n], reverse=not increasing)
+            total_children[nd] = num_children
+        return total_children.get(node, 0)
     def __str__(self):
         _str = 'phylo.Tree leaves={}'.format(len(self.leaves))
         if self.name != None:
@@ -1505,6 +2037,7 @@ class Tree(object):
 
 
 class TreeNode(object):
+    __slots__ = ('tree', 'id', 'parent', 'children', 'name', 'branch', 'support', 'support_type', 'comment', '_been_processed') # Avoids a __dict__ for every node in large trees.
     def __init__(self, tree, node_id, parent):
         self.tree = tree
         self.id = node_id
@@ -1524,6 +2057,7 @@ class TreeNode(object):
         del self.tree.node_names[self.name]
         self.name = new_name
         self.tree.node_names[new_name] = self
+        self.tree.update_version()
     def copy(self, new_tree):
         """Deep copies the current TreeNode, adding it to the Tree object 'new_tree'."""
         new_node = new_tree.new_tree_node(parent=self.parent, node_id=self.id)
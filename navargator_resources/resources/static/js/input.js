@@ -1210,6 +1210,17 @@ function updateResultsLinksPane(run_ids, descriptions, tooltips) {
   clearTimeout(nvrgtr_page.check_results_timer); // In case it's still checking for a previous run.
   checkIfProcessingDone();
 }
+function formatCycleCount(cycles) {
+  if (cycles < 1000) {
+    return cycles.toString();
+  } else if (cycles < 10000) {
+    return roundFloat(cycles/1000, 1) + ' k';
+  } else if (cycles < 1000000) {
+    return Math.round(cycles/1000) + ' k';
+  } else {
+    return roundFloat(cycles/1000000, 1) + ' M';
+  }
+}
 function checkIfProcessingDone() {
   $.ajax({
     url: daemonURL('/check-results-done'),
@@ -1232,16 +1243,11 @@ function checkIfProcessingDone() {
           if (score == false) { // Run has not yet ended
             num_running += 1;
             cycles_used = data.num_clusts[i];
-            if (cycles_used < 1000) {
-              score_str = '(cycles: ' + cycles_used + ')';
-            } else if (cycles_used < 10000) {
-              score_str = '(cycles: ' + roundFloat(cycles_used/1000, 1) + ' k)';
-            } else if (cycles_used < 1000000) {
-              score_str = '(cycles: ' + Math.round(cycles_used/1000) + ' k)';
-            } else {
-              score_str = '(cycles: ' + roundFloat(cycles_used/1000000, 1) + ' M)';
+            score_str = '(cycles: ' + formatCycleCount(cycles_used);
+            if (data.cycle_totals[i]) { // Only known for brute force runs
+              score_str += ' of ' + formatCycleCount(data.cycle_totals[i]);
             }
-            running[run_id].score_span.html(score_str);
+            running[run_id].score_span.html(score_str + ')');
           } else if (score == 'error') {  // Run ended in error
             error_msg = data.num_clusts[i];
             running[run_id].score = 'error';
@@ -2,21 +2,31 @@
 Defines the following public functions:
   load_navargator_file(file_path)
 """
-import os, sys, itertools, random, time, base64
-from math import log, exp, ceil
+import os, sys, random, time, base64, hashlib, json, ctypes, multiprocessing, threading, weakref
+from multiprocessing.sharedctypes import RawArray, RawValue
+from math import log, exp, ceil, sqrt
 from io import BytesIO
 from copy import deepcopy
 from collections import Counter
 import numpy as np
 from navargator_resources import phylo
+from navargator_resources.distance_cache import DistanceCache
+from navargator_resources.distance_matrix import CondensedDistanceMatrix, DistanceOracle, budgeted_copy, rows_per_block, condensed_length
 from navargator_resources.navargator_common import NavargatorValidationError, NavargatorValueError
 #from navargator_resources.navargator_common import NavargatorRuntimeError
 
 phylo.verbose = False
+if sys.version_info >= (3,1):
+    _base64_encode, _base64_decode = base64.encodebytes, base64.decodebytes
+else: # The old names were removed in Python 3.9
+    _base64_encode, _base64_decode = base64.encodestring, base64.decodestring
+try:
+    _process_context = multiprocessing.get_context('spawn') # The daemon runs clustering from its job threads, and forking a multithreaded process can deadlock the child
+except AttributeError:
+    _process_context = multiprocessing # Python 2 can only fork on POSIX systems
 
 # TODO:
 
-# Implement LAB in _heuristic_rand_starts()
 # In find_variants() calculate unassigned_orphans from nbrs. Get rid of reduced. Change _qt_radius_clustering_minimal so it uses nbrs instead of reduced. Make sure it's using claimed_inds from the greedy; this is the large speedup from the k-medoids authors. Might be a good idea to run the greedy algo first (without refinement) to get an initial upper bound on the solution size (check if this is faster / better than the average time needed to get the first solution in the current implementation; I bet it's way faster).
 
 # - Change all instances calling something a "center"/"centre" into a "medoid". It's a more correct term, and what I use in the paper.
@@ -26,8 +36,7 @@ phylo.verbose = False
 
 # - Move _test_dominated_inds(). Working well, but put it in the cluster_subset fxn. it should also integrate with single_pass_optimize somehow
 
-# - In the K- cluster methods (and at least the final_optimize step in qt_minimal) I have a set of inds and try swapping out one at a time with a set of avails to see if there is any improvement. I'm pretty sure that whole bit should be vectorizable; it's possible I have to set self dists to inf or something.
-#   - The original author of k-medoids recently published a pretty substantial improvement to the algorithm (https://www.sciencedirect.com/science/article/pii/S0306437921000557#b4) I need to incorporate these.
+# - The final_optimize step in qt_minimal has a set of inds and tries swapping out one at a time with a set of avails to see if there is any improvement. The K- cluster methods now do this with FasterPAM (https://www.sciencedirect.com/science/article/pii/S0306437921000557#b4) in _swap_medoids(); see if the same approach can work with the coverage constraint.
 
 # - I'd like a hierarchical k-clustering method that generates k monophyletic groups. 
 #   - Should be easy and blazingly fast; start at root with 2 clusters, test effect of splitting each cluster, pick the one that results in lowest tree score, repeat until reaching the user's k. 
@@ -55,8 +64,12 @@ phylo.verbose = False
 # NOTE:
 # - I originally had allowed comments in nvrgtr files, but large encoded distance matrices spawned too many random characters that duplicated it.
 # - Calculating the distance matrix for a tree of 4173 leaves took around 67 seconds, while loading it's nvrgtr file took 4. The file was 94MB though.
-#   - I feel like I must be able to vectorize / parallelize that calculation. Right now, I think I'm re-calculating the distances between various internal nodes a ton of times. I think I can more efficiently build the distance matrix while parsing the tree file the first time. Keep track of distance from each terminal node read so far to internal nodes, when encountering new terminal nodes finalize their distances as I go.
-#   - Should work. I've sketched out a plan in the Steno book in my drawer
+#   - phylo.Tree.get_distance_matrix() now fills the matrix in a single post-order pass, keeping the distances from each node to the leaves below it and setting the distances between sibling clades with one outer addition. The same tree takes well under a second.
+#   - Given a distance_cache_dir, large matrices are also saved to a DistanceCache (see distance_cache.py) there, keyed by phylo.Tree.get_fingerprint(). Reopening the same tree memory-maps the saved matrix instead of calculating it again.
+#   - self.orig_dists is a CondensedDistanceMatrix (see distance_matrix.py) holding only the upper triangle, which halves its memory. It is built directly from the tree, the cache, or the nvrgtr file without a full matrix ever being created. Full matrices are only made of booleans (nbrs in the qt methods), 1/8 the size of the distances.
+#   - With lazy_distances=True, self.orig_dists is instead a DistanceOracle that calculates each row from the tree when it's needed. k-medoids and k minibatch never need more than a few hundred rows at a time, so they run on trees far too large for any matrix (200k leaves would need 160GB condensed). The qt methods still need the n^2 boolean nbrs matrix.
+#   - With a memory_budget (in bytes), any distance or boolean matrix larger than the budget is a numpy.memmap in a temporary file, and the passes over whole matrices (building orig_dists, transforming it, within(), nbrs, partitioning, and finding dominated inds) work through them in blocks of rows within the budget. This lets the qt methods run on trees whose matrices only fit on the disk, at the cost of paging them in and out.
+#   - VariantFinder.subset(names) copies only the given leaves and their relevant predecessors from the tree (see phylo.Tree.get_pruned_tree()), and slices its distance matrix from self.orig_dists (see CondensedDistanceMatrix.submatrix()), as the distances between the remaining leaves are unchanged. Analyzing one clade of a large tree needs no distances recalculated.
 
 # - Check out the methods in Treeswift (https://github.com/niemasd/TreeSwift), they may have solved some of the optimized algorithms I'm thinking about. Not sure if their distance_matrix calculation is as efficient as what I'm looking for, but it's most likely better than my current implementation.
 
@@ -74,7 +87,7 @@ dist_matrix_tag = 'Distance matrix'
 sg_order_key = '__sg_order__'  # The order of the selection groups; key is for internal representation.
 
 # # # # #  Misc functions  # # # # #
-def load_navargator_file(file_path, verbose=True):
+def load_navargator_file(file_path, distance_dtype='float64', verbose=True):
     if not os.path.isfile(file_path) and not file_path.lower().endswith('.nvrgtr'):
         file_path += '.nvrgtr'
     if not os.path.isfile(file_path):
@@ -83,9 +96,9 @@ def load_navargator_file(file_path, verbose=True):
         print('Loading information from %s...' % file_path)
     file_name = os.path.basename(file_path)
     with open(file_path, 'r') as f:
-        vfinder = navargator_from_data(f, file_name=file_name, verbose=verbose)
+        vfinder = navargator_from_data(f, file_name=file_name, distance_dtype=distance_dtype, verbose=verbose)
     return vfinder
-def navargator_from_data(data_lines, file_name='unknown file', verbose=False):
+def navargator_from_data(data_lines, file_name='unknown file', distance_dtype='float64', verbose=False):
     """Expects data as an iterable of lines. Should be either a file object or a str.splitlines()."""
     data = {}
     # #  Start of process_tag_data()
@@ -154,7 +167,7 @@ def navargator_from_data(data_lines, file_name='unknown file', verbose=False):
     else:
         distance_matrix = None
     # Create the VF object:
-    vfinder = VariantFinder(tree_data, tree_format='newick', file_name=file_name, display_options=display_options, selection_groups_order=selection_groups_order, selection_groups_data=selection_groups_data, distance_matrix=distance_matrix, verbose=verbose)
+    vfinder = VariantFinder(tree_data, tree_format='newick', file_name=file_name, display_options=display_options, selection_groups_order=selection_groups_order, selection_groups_data=selection_groups_data, distance_matrix=distance_matrix, distance_dtype=distance_dtype, verbose=verbose)
     # Fill out the assigned variants if present:
     chsn, avail, ignor = data.get(chosen_nodes_tag), data.get(available_nodes_tag), data.get(ignore_nodes_tag)
     if chsn:
@@ -165,20 +178,17 @@ def navargator_from_data(data_lines, file_name='unknown file', verbose=False):
         vfinder.ignored = ignor
     return vfinder
 def decode_distance_matrix(encoded):
-    """Takes an ascii string representing a flattened numpy array, decodes it, then rebuilds and returns the full distance matrix."""
-    bin_data = base64.decodestring(encoded.encode()) # From ascii string to decoded Bytes object
+    """Takes an ascii string representing a flattened numpy array, decodes it, and returns it as a CondensedDistanceMatrix without building the full matrix."""
+    bin_data = _base64_decode(encoded.encode()) # From ascii string to decoded Bytes object
     flat = np.load(BytesIO(bin_data), allow_pickle=False) # Load the flattened numpy array
-    return unflatten_distance_matrix(flat)
+    return CondensedDistanceMatrix(flat)
 def unflatten_distance_matrix(flat):
     """Takes a flattened array of the upper trianglular values of a distance matrix, and rebuilds the full symmetrical distance matrix."""
-    # (size * (size+1)) / 2 = len(flat)
-    size = int(round(max(np.roots([1, 1, -2*len(flat)])))) # Solves the quadratic equation. The 'round' is very needed to deal with floating point errors.
-    inds = np.triu_indices(size)
-    dist = np.zeros((size, size))
-    dist[inds] = flat
-    return dist + np.tril(dist.T, -1)
+    return CondensedDistanceMatrix(flat).expand()
 def flatten_distance_matrix(dist):
-    """As dist is symmetrical, this keeps only the upper triangluar values in order to save space."""
+    """As dist is symmetrical, this keeps only the upper triangluar values in order to save space. A CondensedDistanceMatrix is already stored this way, and a DistanceOracle calculates them."""
+    if isinstance(dist, (CondensedDistanceMatrix, DistanceOracle)):
+        return dist.condensed().data
     inds = np.triu_indices(dist.shape[0])
     return dist[inds]
 def binomial_coefficient(n, k):
@@ -193,6 +203,27 @@ def binomial_coefficient(n, k):
             _sum += log(i)
         return _sum
     return int(round(exp(log_factorial(n) - log_factorial(k) - log_factorial(n-k)), 0))
+def combination_count(n, k):
+    """Exactly computes the binomial coefficient of n-choose-k, unlike binomial_coefficient(). Returns 0 if k is not between 0 and n."""
+    if k < 0 or k > n:
+        return 0
+    k = min(k, n-k)
+    count = 1
+    for i in range(1, k+1):
+        count = count * (n-k+i) // i
+    return count
+def unrank_combination(rank, n, k):
+    """Returns the combination at position 'rank' of itertools.combinations(range(n), k) as a tuple, without generating the ones before it. Each value is found in turn by skipping over the combinations that start with each smaller value (the combinatorial number system)."""
+    combination, value = [], 0
+    for remaining in range(k, 0, -1):
+        count = combination_count(n-value-1, remaining-1)
+        while rank >= count:
+            rank -= count
+            value += 1
+            count = combination_count(n-value-1, remaining-1)
+        combination.append(value)
+        value += 1
+    return tuple(combination)
 def format_integer(num, max_num_chars=15, sci_notation=False):
     """Formats the number into a string using commas if it is large. If the string would be longer than max_num_chars, or if sci_notation=True, scientific notation is used instead."""
     abs_num = abs(num)
@@ -213,14 +244,90 @@ def format_integer(num, max_num_chars=15, sci_notation=False):
         num_str = '-' + num_str
     return num_str
 
+# # # # #  Parallel clustering functions  # # # # #
+clustering_worker_data = {} # Set in each worker process by init_clustering_worker()
+def init_clustering_worker(shared_buffer, dtype, size, quit_flag, memory_budget):
+    vf = VariantFinder(tree_input='', distance_dtype=dtype, memory_budget=memory_budget, verbose=False, _blank_init=True)
+    clustering_worker_data['dists'] = CondensedDistanceMatrix(np.frombuffer(shared_buffer, dtype=dtype), size, memory_budget=memory_budget)
+    clustering_worker_data.update(vf=vf, quit_flag=quit_flag, generation=None)
+def update_clustering_worker(run_state):
+    """Sets the settings of the VariantFinder running the current task in a worker process, and clears its cached rows if the shared buffer has been refilled since they were read. 'run_state' is from ClusteringPool.start_run()."""
+    generation, k_medoids_init, not_ignored_inds = run_state
+    vf = clustering_worker_data['vf']
+    vf.k_medoids_init, vf._not_ignored_inds = k_medoids_init, not_ignored_inds
+    if clustering_worker_data['generation'] != generation:
+        clustering_worker_data['dists'].clear_row_cache()
+        clustering_worker_data['generation'] = generation
+def run_replicate(task):
+    """Runs one replicate of VariantFinder._cluster_k_medoids() in a worker process, returning its medoids, scores, and the cycles it used."""
+    run_state, (num_variants, chsn_indices, avail_indices, batch_size), seed, max_cycles = task
+    update_clustering_worker(run_state)
+    cache = WorkerCache(clustering_worker_data['quit_flag'])
+    variants, scores = clustering_worker_data['vf']._cluster_k_medoids(num_variants, chsn_indices, avail_indices, clustering_worker_data['dists'], cache, max_cycles, random.Random(seed), batch_size)
+    return variants, scores, cache['cycles_used']
+def run_brute_force_range(task):
+    """Runs VariantFinder._score_combination_range() in a worker process, returning the start of the range along with its results."""
+    run_state, start, stop, (num_new, chsn_tup, avail_indices) = task
+    update_clustering_worker(run_state)
+    cache = WorkerCache(clustering_worker_data['quit_flag'])
+    reached, candidates = clustering_worker_data['vf']._score_combination_range(start, stop, num_new, chsn_tup, avail_indices, clustering_worker_data['dists'], cache)
+    return start, reached, candidates
+class ClusteringPool(object):
+    """A multiprocessing.Pool of spawned worker processes set up by init_clustering_worker(), kept by a VariantFinder so its later runs don't have to start new processes. The workers read the distances from a buffer shared with this process, which is only refilled when a run uses a different distance matrix."""
+    def __init__(self, workers, size, dtype, memory_budget):
+        self.workers, self.size, self.dtype = workers, size, np.dtype(dtype)
+        self.lock = threading.Lock() # Held for the length of a run; see VariantFinder._acquire_clustering_pool()
+        self.shared_buffer = RawArray(ctypes.c_char, condensed_length(size) * self.dtype.itemsize)
+        self.quit_flag = RawValue(ctypes.c_bool, False)
+        self.generation = 0 # Counts the times the shared buffer has been filled
+        self._buffer_dists = None # A weak reference to the matrix in the shared buffer
+        self.pool = _process_context.Pool(workers, initializer=init_clustering_worker, initargs=(self.shared_buffer, self.dtype, size, self.quit_flag, memory_budget))
+    def fits(self, workers, dists):
+        return self.pool is not None and self.workers == workers and self.size == dists.size and self.dtype == dists.dtype
+    def start_run(self, dists, k_medoids_init, not_ignored_inds):
+        """Copies 'dists' into the shared buffer unless it is already there, and resets the quit flag. Returns the state that each task sends to update_clustering_worker()."""
+        if self._buffer_dists is None or self._buffer_dists() is not dists:
+            np.frombuffer(self.shared_buffer, dtype=self.dtype)[:] = dists.data
+            self._buffer_dists = weakref.ref(dists)
+            self.generation += 1
+        self.quit_flag.value = False
+        return self.generation, k_medoids_init, not_ignored_inds
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+    def __del__(self):
+        self.close()
+class WorkerCache(dict):
+    """The cache of a replicate or brute force range in a worker process. 'quit_now' is read from a flag shared with the parent process."""
+    def __init__(self, quit_flag):
+        dict.__init__(self, cycles_used=0)
+        self.quit_flag = quit_flag
+    def __getitem__(self, key):
+        if key == 'quit_now':
+            return self.quit_flag.value
+        return dict.__getitem__(self, key)
+
 
 class VariantFinder(object):
-    def __init__(self, tree_input, tree_format='auto', file_name='unknown file', display_options=None, selection_groups_order=None, selection_groups_data=None, distance_matrix=None, verbose=True, _blank_init=False):
+    def __init__(self, tree_input, tree_format='auto', file_name='unknown file', display_options=None, selection_groups_order=None, selection_groups_data=None, distance_matrix=None, distance_dtype='float64', lazy_distances=False, memory_budget=None, distance_workers=1, distance_cache_dir=None, distance_cache_size=4*1024**3, k_medoids_init='random', clustering_workers=1, verbose=True, _blank_init=False):
         self.file_name = file_name
         self.verbose = bool(verbose)
+        self.distance_dtype = self._validate_distance_dtype(distance_dtype) # 'float32' halves the memory used by the distance matrices, and speeds up clustering.
+        self._tie_tolerance = 4 * np.finfo(np.float32).eps if self.distance_dtype == np.float32 else 0.0 # Relative difference below which two clustering scores are considered equal. float64 scores must match exactly.
+        self.lazy_distances = bool(lazy_distances) # If True, distances are calculated from the tree as needed instead of being stored; ignored if a distance_matrix is given.
+        self.memory_budget = self._validate_memory_budget(memory_budget) # In bytes; larger matrices are memory-mapped from temporary files. None means no limit.
+        self.distance_workers = distance_workers # Processes used to calculate the distance matrix of a large tree; None uses every CPU. See phylo.Tree.get_distance_matrix().
+        self.distance_cache_dir = distance_cache_dir # Directory where the distance matrices of large trees and the progress of brute force runs are saved and reloaded; None means they are always calculated. See distance_cache.py.
+        self.distance_cache_size = distance_cache_size # In bytes; the least recently used matrices are deleted to keep the cache below this. None also means no cache.
+        self.k_medoids_init = self._validate_k_medoids_init(k_medoids_init) # How the k medoids and k minibatch replicates choose their starting medoids; see _initial_medoids().
+        self.clustering_workers = clustering_workers # Processes that run the k medoids and k minibatch replicates, and the brute force ranges; None uses every CPU. See ClusteringPool.
+        self._clustering_pool = None # Started by the first run that uses worker processes, and kept for later runs until _close_clustering_pool()
         self.leaves = []
-        self.ordered_names = []
         self.tree_size = 0
+        self._tree_data_truncation = None # Set by update_tree_data()
+        self._tree_sharers = weakref.WeakSet([self]) # Every live copy of this VariantFinder that shares self.tree; see _own_tree()
         self._clear_cache(reset_normalize=False) # self.cache = {}
         self.normalize = self._empty_normalize()
         self.k_cluster_methods = set(['k minibatch', 'k medoids', 'brute force'])
@@ -257,27 +364,41 @@ class VariantFinder(object):
             if distance_matrix is not None:
                 self.leaves = self.tree.get_named_leaves()
                 self.tree_size = len(self.leaves)
-                if type(distance_matrix) != type(np.zeros(1)):
+                if type(distance_matrix) != type(np.zeros(1)) and not isinstance(distance_matrix, CondensedDistanceMatrix):
                     raise NavargatorValueError("Error: cannot initiate VariantFinder with the given 'distance_matrix' as it is the incorrect object type")
                 elif distance_matrix.shape != (self.tree_size, self.tree_size):
                     raise NavargatorValueError("Error: cannot initiate VariantFinder with the given 'distance_matrix' as its shape '{}' is incompatible with the  given tree of length {}".format(distance_matrix.shape, self.tree_size))
-                self.orig_dists = distance_matrix
+                if isinstance(distance_matrix, CondensedDistanceMatrix):
+                    dist_data = distance_matrix.data.astype(self.distance_dtype, copy=False)
+                else:
+                    dist_data = CondensedDistanceMatrix.from_full(distance_matrix, dtype=self.distance_dtype).data
+            elif self.lazy_distances:
+                self.leaves = self.tree.get_named_leaves()
+                self.tree_size = len(self.leaves)
+                dist_data = None
+                self.orig_dists = DistanceOracle.from_tree(self.tree, dtype=self.distance_dtype, memory_budget=self.memory_budget) # Unaffected by later changes to self.tree, so can be shared.
             else:
-                self.leaves, self.orig_dists = self.tree.get_distance_matrix()
+                self.leaves, dist_data = self._load_distance_matrix()
                 self.tree_size = len(self.leaves)
+            if dist_data is not None:
+                dist_data = dist_data.view()
+                dist_data.flags.writeable = False # Shared between copies of this VariantFinder, so must never be modified.
+                self.orig_dists = CondensedDistanceMatrix(dist_data, self.tree_size, memory_budget=self.memory_budget)
             self.index = {name:index for index, name in enumerate(self.leaves)}
             max_name_length = self.display_options.setdefault('sizes', {}).get('max_variant_name_length', None)
             if max_name_length == None:
                 max_name_length = max(len(name) for name in self.leaves)
                 self.display_options['sizes']['max_variant_name_length'] = max_name_length
             self.update_tree_data()
-            self.max_root_distance = self._calc_max_root_dist()
+            self.max_root_distance = self.tree.get_max_root_distance()
         self._ignored = set() # Accessible as self.ignored
         self._available = set() # Accessible as self.available
         self._chosen = set() # Accessible as self.chosen
         # # #  Private attributes # # #
         self._not_ignored_inds = set(range(self.tree_size))
-        self._max_brute_force_attempts = 1000000 # Under 1 minute for 1 million.
+        self._max_brute_force_attempts = 1000000 # A few seconds for 1 million.
+        self._brute_force_range_size = 100000 # Combinations scored by each task of a parallel brute force run, or between saves of its progress.
+        self._brute_force_save_interval = 10.0 # Seconds between saves of the progress of a brute force run to the distance cache.
         self._private_display_opts = set(['cluster_background_trans', 'cluster_highlight_trans'])
 
     # # # # #  Public methods  # # # # #
@@ -300,28 +421,27 @@ class VariantFinder(object):
             elif method == 'brute force':
                 if self.verbose:
                     num_possible_combinations = binomial_coefficient(num_avail, num_variants-num_chsn)
-                    expected_runtime = int(round(num_possible_combinations * 0.000042, 0))
+                    expected_runtime = int(round(num_possible_combinations * 0.000003, 0))
                     print('Finding optimal variants using brute force. This should take ~{} seconds...'.format(expected_runtime))
                 variants, scores, alt_variants = self._brute_force_clustering(num_variants, tolerance, self.cache[run_id], max_cycles)
             elif method == 'k medoids':
                 num_replicates = args[2]
                 if self.verbose:
                     print('Choosing variants using k medoids...')
-                fxn, fxn_args = self._cluster_k_medoids, (num_variants, tolerance, self.cache[run_id])
-                variants, scores, alt_variants = self._heuristic_rand_starts(fxn, fxn_args, num_replicates, self.cache[run_id], max_cycles)
+                variants, scores, alt_variants = self._heuristic_rand_starts(num_variants, tolerance, None, num_replicates, self.cache[run_id], max_cycles)
             elif method == 'k minibatch':
                 num_replicates, batch_size = args[2:]
                 if self.verbose:
                     print('Choosing variants using k minibatch...')
-                fxn, fxn_args = self._cluster_k_medoids_minibatch, (num_variants, tolerance, batch_size, self.cache[run_id])
-                variants, scores, alt_variants = self._heuristic_rand_starts(fxn, fxn_args, num_replicates, self.cache[run_id], max_cycles)
+                variants, scores, alt_variants = self._heuristic_rand_starts(num_variants, tolerance, batch_size, num_replicates, self.cache[run_id], max_cycles)
             if self.verbose:
                 self._print_clustering_results(num_variants, variants, scores, alt_variants)
         elif method in self.threshold_cluster_methods:
             threshold, thresh_percent = args[:2]
             params = (threshold, thresh_percent)
+            threshold = self.distance_dtype.type(threshold) # Ensures every comparison to the distances rounds it the same way
 
-            reduced, unassigned_orphans = self._reduce_distances(threshold)
+            in_range, unassigned_orphans = self._reduce_distances(threshold)
 
             min_to_cluster = ceil(thresh_percent/100.0 * len(self._not_ignored_inds))
             num_allowed_orphans = len(self._not_ignored_inds) - min_to_cluster
@@ -331,7 +451,7 @@ class VariantFinder(object):
                 error_msg = 'Error: infeasible parameters (only {:.2f}% could be clustered within the given threhsold). To fix this, raise the critical threshold, lower the critical percent, or add more available variants.'.format(percent_feasible)
                 variants, scores, alt_variants = [], error_msg, []
             elif method == 'qt minimal':
-                variants, scores, alt_variants = self._qt_radius_clustering_minimal(min_to_cluster, reduced, unassigned_orphans, self.cache[run_id], max_cycles)
+                variants, scores, alt_variants = self._qt_radius_clustering_minimal(min_to_cluster, in_range, unassigned_orphans, self.cache[run_id], max_cycles)
             elif method == 'qt greedy':
                 variants, scores, alt_variants = self._qt_radius_clustering_greedy(min_to_cluster, threshold, self.cache[run_id], max_cycles)
         else:
@@ -340,30 +460,34 @@ class VariantFinder(object):
         return variants, scores, alt_variants
 
     def root_midpoint(self):
+        self._own_tree()
+        num_nodes = len(self.tree.nodes)
         self.tree.root_midpoint()
-        self.update_tree_data()
+        self._update_rerooted_tree_data(num_nodes)
         if self.verbose:
             print('\nRe-rooted the tree to its midpoint')
 
     def root_outgroup(self, outgroup_names):
-        # self.tree needs the original leaf names to re-root them
-        full_leaves = set(self.tree.get_named_leaves())
+        # self.tree needs the original leaf names to re-root them. Truncating keeps the sorted order, so self.leaves[i] is always the truncation of full_leaves[i].
+        full_leaves = self.tree.get_named_leaves()
         full_outgroup = []
         for name in outgroup_names:
-            if name in full_leaves:
-                full_outgroup.append(name)
+            if name in self.index:
+                full_outgroup.append(full_leaves[self.index[name]])
             else:
-                for leaf in full_leaves:
-                    if leaf.startswith(name):
-                        # this works as names are guaranteed to be unique at the current truncation
-                        full_outgroup.append(leaf)
-                        break
+                matches = phylo.names_with_prefix(full_leaves, name)
+                if matches:
+                    # this works as names are guaranteed to be unique at the current truncation
+                    full_outgroup.append(matches[0])
+        self._own_tree()
+        num_nodes = len(self.tree.nodes)
         self.tree.root_outgroup(full_outgroup, distance=0.5, distance_proportion=True)
-        self.update_tree_data()
+        self._update_rerooted_tree_data(num_nodes)
         if self.verbose:
             print('\nRe-rooted the tree to the given outgroup')
 
     def reorder_tree_nodes(self, increasing):
+        self._own_tree()
         self.tree.reorder_children(increasing=increasing)
         self.update_tree_data()
         if self.verbose:
@@ -384,11 +508,12 @@ class VariantFinder(object):
             sg_data['names'] = [trans[name] for name in sg_data['names']]
         # Don't have to modify self._not_ignored_inds as the order of self.leaves hasn't changed.
         # Re-generate the cache; names have changed, but cluster patterns and scores haven't:
-        old_cache = self.cache
+        old_cache, old_ranges = self.cache, self._brute_force_ranges
         self._clear_cache(reset_normalize=False)
+        self._brute_force_ranges = old_ranges # Only holds indices, so is still valid
         for params, run_id in old_cache['params'].items():
             info = old_cache[run_id]
-            variant_inds = np.array([self.leaves.index(trans[name]) for name in info['variants']])
+            variant_inds = np.array([self.index[trans[name]] for name in info['variants']])
             scores = info['scores'][::]
             alt_variants = [alt.copy() for alt in info['alt_variants']]
             self._calculate_cache_values(run_id, params, variant_inds, scores, alt_variants)
@@ -397,14 +522,11 @@ class VariantFinder(object):
             print('\nTruncated the tree names')
 
     def update_tree_data(self, truncation=None):
-        """Ensures both trees can be formatted before updating the attributes. Also resets self.ordered_names."""
+        """Ensures both trees can be formatted before updating the truncation used. The tree strings themselves are generated when first accessed, and are cached by self.tree until it is modified."""
         if truncation == None:
             truncation = int(self.display_options['sizes']['max_variant_name_length'])
-        newick_tree_data = self.tree.newick_string(support_as_comment=False, support_values=False, comments=False, internal_names=False, max_name_length=truncation)
-        phyloxml_tree_data = self.tree.phyloxml_string(support_values=False, comments=False, internal_names=False, max_name_length=truncation)
-        self.newick_tree_data = newick_tree_data
-        self.phyloxml_tree_data = phyloxml_tree_data
-        self.ordered_names = self.tree.get_ordered_names()
+        self.tree.check_unique_names(max_name_length=truncation)
+        self._tree_data_truncation = truncation
 
     def get_tree_string(self, tree, tree_type):
         truncation = int(self.display_options['sizes']['max_variant_name_length'])
@@ -497,9 +619,9 @@ class VariantFinder(object):
 
     def get_distance(self, name1, name2):
         """Returns the phylogenetic distance between the two given sequence names. Uses the unscaled distance from the tree, and accounts for name truncations."""
-        ind1 = self.leaves.index(name1)
-        ind2 = self.leaves.index(name2)
-        return self.orig_dists[ind1, ind2]
+        ind1 = self.index[name1]
+        ind2 = self.index[name2]
+        return float(self.orig_dists[ind1, ind2])
 
     def encode_distance_matrix(self):
         """Takes the current distance matrix, discards the unnecessary values, saves it in a binary format, then decodes that into an ascii representation that can be handled by JSON."""
@@ -507,23 +629,25 @@ class VariantFinder(object):
         with BytesIO() as b:
             np.save(b, flat, allow_pickle=False)
             bin_data = b.getvalue() # Bytes object, can't be JSON serialized
-        encoded = base64.encodestring(bin_data).decode('ascii') # str/unicode, can be JSON serialized
+        encoded = _base64_encode(bin_data).decode('ascii') # str/unicode, can be JSON serialized
         return encoded
 
-    def copy(self):
-        """Returns a deep copy of self"""
+    def copy(self, include_cache=True):
+        """Returns a copy of self. The tree and distance matrix are shared with the copy; the tree is only duplicated when one of them modifies it. If 'include_cache' is False the new instance starts with an empty cache, which is useful if it will be cleared anyway."""
         # dict.copy() works if all values are immutable, deepcopy(dict) otherwise.
-        vf = VariantFinder(tree_input='', verbose=self.verbose, _blank_init=True)
-        vf.tree = self.tree.copy()
+        vf = VariantFinder(tree_input='', distance_dtype=self.distance_dtype, lazy_distances=self.lazy_distances, memory_budget=self.memory_budget, distance_workers=self.distance_workers, distance_cache_dir=self.distance_cache_dir, distance_cache_size=self.distance_cache_size, k_medoids_init=self.k_medoids_init, clustering_workers=self.clustering_workers, verbose=self.verbose, _blank_init=True)
+        vf.tree = self.tree
+        self._tree_sharers.add(vf)
+        vf._tree_sharers = self._tree_sharers
         vf.tree_size = self.tree_size
         vf.leaves = self.leaves[::]
         vf.index = self.index.copy()
-        vf.ordered_names = self.ordered_names[::]
-        vf.orig_dists = self.orig_dists.copy()
-        vf.newick_tree_data = self.newick_tree_data
-        vf.phyloxml_tree_data = self.phyloxml_tree_data
-        vf.cache = deepcopy(self.cache)
-        vf.normalize = deepcopy(self.normalize)
+        vf.orig_dists = self.orig_dists # Read-only, so it can be shared
+        vf._tree_data_truncation = self._tree_data_truncation
+        if include_cache:
+            vf.cache = deepcopy(self.cache)
+            vf._brute_force_ranges = deepcopy(self._brute_force_ranges)
+            vf.normalize = deepcopy(self.normalize)
         vf.display_options = deepcopy(self.display_options)
         vf.selection_groups_order = self.selection_groups_order[::]
         vf.selection_groups_data = deepcopy(self.selection_groups_data)
@@ -535,42 +659,207 @@ class VariantFinder(object):
         vf._available = self.available.copy()
         return vf
 
+    def subset(self, names):
+        """Returns a new VariantFinder for only the leaves in 'names', with the tree pruned to them. Pruning doesn't change the distances between the remaining leaves, so its distance matrix is sliced from this one instead of being calculated. The assigned and selection group names are kept if they are in 'names', but the cache is not."""
+        try:
+            inds = sorted(set(self.index[name.strip()] for name in names))
+        except KeyError as err:
+            raise NavargatorValueError('Error: could not create a subset including "{}", as it was not found in the tree.'.format(err.args[0]))
+        if not inds:
+            raise NavargatorValueError('Error: cannot create a subset without any leaves.')
+        vf = VariantFinder(tree_input='', distance_dtype=self.distance_dtype, lazy_distances=self.lazy_distances, memory_budget=self.memory_budget, distance_workers=self.distance_workers, distance_cache_dir=self.distance_cache_dir, distance_cache_size=self.distance_cache_size, k_medoids_init=self.k_medoids_init, clustering_workers=self.clustering_workers, verbose=self.verbose, _blank_init=True)
+        full_leaves = self.tree.get_named_leaves() # self.tree has the original leaf names, in the same order as self.leaves
+        vf.tree = self.tree.get_pruned_tree([self.tree.node_names[full_leaves[ind]] for ind in inds])
+        vf.tree_size = len(inds)
+        vf.leaves = [self.leaves[ind] for ind in inds]
+        vf.index = {name:index for index, name in enumerate(vf.leaves)}
+        vf.orig_dists = self.orig_dists.submatrix(inds)
+        if isinstance(vf.orig_dists, CondensedDistanceMatrix):
+            vf.orig_dists.data.flags.writeable = False # Shared between copies of the new instance, so must never be modified.
+        vf.display_options = deepcopy(self.display_options)
+        for sg_name in self.selection_groups_order:
+            sg_data = deepcopy(self.selection_groups_data[sg_name])
+            sg_data['names'] = [name for name in sg_data['names'] if name in vf.index]
+            if sg_data['names']:
+                vf.selection_groups_order.append(sg_name)
+                vf.selection_groups_data[sg_name] = sg_data
+        vf.file_name = self.file_name
+        vf.update_tree_data()
+        vf.max_root_distance = vf.tree.get_max_root_distance()
+        vf._ignored = set(name for name in self.ignored if name in vf.index)
+        vf._chosen = set(name for name in self.chosen if name in vf.index)
+        vf._available = set(name for name in self.available if name in vf.index)
+        vf._not_ignored_inds = set(range(vf.tree_size)) - set(vf.index[name] for name in vf._ignored)
+        return vf
+
     # # # # #  Clustering methods  # # # # #
     def _brute_force_clustering(self, num_variants, tolerance, cache, max_cycles):
+        """Scores every combination of available medoids. The combinations are split into ranges by their rank in the order of itertools.combinations(), which are scored in worker processes if self.clustering_workers allows. Every range scored is kept in self._brute_force_ranges, so running the same parameters again after a run was quit or ran out of cycles only scores the remaining combinations; 'max_cycles' limits the number scored by this run. If self.distance_cache_dir is set, the ranges are also saved there every self._brute_force_save_interval seconds and when the run stops, so a run that was killed or discarded (as the daemon does with expired sessions) can be resumed by a new instance with the same tree and assignments. cache['cycles_used'] counts every combination scored so far, out of cache['cycles_total']."""
         avail_medoid_indices = sorted(self.index[n] for n in self.available)
         chsn_tup = tuple(self.index[n] for n in self.chosen)
+        num_new = num_variants - len(chsn_tup)
         dists = self._transform_distances(tolerance)
-        cache['cycles_used'] = 0
-        best_med_inds, best_score = None, float('inf')
-        alt_variants = []
-        for avail_inds in itertools.combinations(avail_medoid_indices, num_variants-len(chsn_tup)):
-            med_inds = avail_inds + chsn_tup
-            score = self._score_pattern(med_inds, dists)
-            if score == best_score:
-                alt_variants.append(med_inds)
-            elif score < best_score:
-                best_med_inds, best_score = med_inds, score
-                alt_variants = []
-            cache['cycles_used'] += 1
-            if cache['quit_now'] or max_cycles != None and cache['cycles_used'] >= max_cycles:
-                break
+        params = (num_variants, tolerance)
+        if params not in self._brute_force_ranges:
+            self._brute_force_ranges[params] = self._load_brute_force_ranges(params)
+        finished = self._brute_force_ranges[params]
+        cache['cycles_used'] = prev_cycles = sum(reached - start for start, (reached, candidates) in finished.items())
+        cache['cycles_total'] = combination_count(len(avail_medoid_indices), num_new)
+        workers = multiprocessing.cpu_count() if self.clustering_workers is None else self.clustering_workers
+        parallel = workers > 1 and isinstance(dists, CondensedDistanceMatrix) and (self.memory_budget is None or dists.nbytes <= self.memory_budget)
+        saving = self._brute_force_progress_cache() is not None
+        tasks = self._brute_force_tasks(finished, cache['cycles_total'], max_cycles, self._brute_force_range_size if parallel or saving else None)
+        last_save = [time.time()]
+        def range_finished():
+            if saving and time.time() - last_save[0] >= self._brute_force_save_interval:
+                self._save_brute_force_ranges(params, finished)
+                last_save[0] = time.time()
+        if not (parallel and len(tasks) > 1 and self._run_brute_force_parallel(workers, tasks, (num_new, chsn_tup, avail_medoid_indices), dists, cache, finished, range_finished)):
+            # A DistanceOracle, or a matrix only held on disk, is not worth sharing with other processes. Also run here if another run is using the worker processes.
+            for start, stop in tasks:
+                reached, candidates = self._score_combination_range(start, stop, num_new, chsn_tup, avail_medoid_indices, dists, cache)
+                if reached > start:
+                    finished[start] = (reached, candidates)
+                    range_finished()
+                if cache['quit_now']:
+                    break
+        if saving and cache['cycles_used'] > prev_cycles:
+            self._save_brute_force_ranges(params, finished)
+        best_med_inds, best_score, alt_variants = self._merge_brute_force_ranges(finished)
         if best_med_inds == None:
             error_msg = 'Error: big problem in brute force clustering, no comparisons were made.'
             return [], error_msg, []
         final_clusters = self._partition_nearest(best_med_inds, self.orig_dists)
         final_scores = self._sum_dist_scores(best_med_inds, final_clusters, self.orig_dists) # Untransformed distances
         return best_med_inds, final_scores, alt_variants
-    def _heuristic_rand_starts(self, fxn, args, num_replicates, cache, max_cycles):
-        # 'num_replicates' times, initialize with LAB (from FastPAM2) / random chunking, run fxn(), and find the best score
-        optima = {}
+    def _brute_force_tasks(self, finished, num_combinations, max_cycles, range_size):
+        """Used by _brute_force_clustering(). Returns a list of (start, stop) rank ranges covering the combinations not in any of the 'finished' ranges, in order, and split into ranges of at most 'range_size' if it is given. If 'max_cycles' is given, only that many combinations are covered (but always at least 1)."""
+        gaps, prev_reached = [], 0
+        for start in sorted(finished):
+            if start > prev_reached:
+                gaps.append((prev_reached, start))
+            prev_reached = finished[start][0]
+        if num_combinations > prev_reached:
+            gaps.append((prev_reached, num_combinations))
+        tasks, remaining = [], None if max_cycles == None else max(1, max_cycles)
+        for start, stop in gaps:
+            if remaining != None:
+                stop = min(stop, start + remaining)
+                remaining -= stop - start
+            step = stop - start if range_size == None else range_size
+            tasks.extend((rng_start, min(rng_start+step, stop)) for rng_start in range(start, stop, step))
+            if remaining == 0:
+                break
+        return tasks
+    def _score_combination_range(self, start, stop, num_new, chsn_tup, avail_medoid_indices, dists, cache):
+        """Scores the combinations of 'num_new' available medoids (plus the chosen medoids) with ranks from 'start' up to 'stop' in the order of itertools.combinations(), stopping early if cache['quit_now'] is set. The distances to the nearest medoid of each prefix (every medoid but the last) are kept, so all combinations sharing that prefix are scored at once from the rows of the possible last medoids, in blocks of rows. Returns the rank reached, and a list of (score, medoids) for every combination scored that could be the best or tied with it; see _merge_brute_force_ranges()."""
+        num_avail = len(avail_medoid_indices)
+        avail_arr = np.array(avail_medoid_indices, dtype=np.intp)
+        row_nbytes = dists.shape[0] * np.dtype(dists.dtype).itemsize
+        if self.memory_budget is None or num_avail * row_nbytes <= self.memory_budget:
+            avail_rows = dists[avail_arr,:]
+            get_rows = lambda rows_start, rows_stop: avail_rows[rows_start:rows_stop]
+        else:
+            get_rows = lambda rows_start, rows_stop: dists[avail_arr[rows_start:rows_stop],:]
+        block = rows_per_block(self.memory_budget, 2 * row_nbytes, 256)
+        # A combination can only matter to the final merge if it scores within a tie of the lowest score before it (see _merge_brute_force_ranges()); the looser limit here is always enough.
+        limit_tolerance = 4 * self._tie_tolerance
+        combination = unrank_combination(start, num_avail, num_new)
+        prefix, first = list(combination[:-1]), combination[-1]
+        max_prefix = [num_avail - num_new + i for i in range(len(prefix))] # The largest value allowed at each prefix position
+        prefix_mins = [np.full(dists.shape[0], np.inf, dtype=dists.dtype)] # prefix_mins[d] is the distance to the nearest of the chosen and the first d prefix medoids.
+        for ind in chsn_tup:
+            prefix_mins[0] = np.minimum(prefix_mins[0], dists[ind,:])
+        depth = 0 # The first prefix position that changed
+        rank, min_score, candidates = start, np.inf, []
+        while rank < stop:
+            del prefix_mins[depth+1:]
+            for pos in prefix[depth:]:
+                prefix_mins.append(np.minimum(prefix_mins[-1], get_rows(pos, pos+1)[0]))
+            prefix_inds = tuple(avail_medoid_indices[pos] for pos in prefix)
+            for block_start in range(first, num_avail, block):
+                block_stop = min(block_start + block, num_avail, block_start + stop - rank)
+                scores = np.sum(np.minimum(get_rows(block_start, block_stop), prefix_mins[-1]), axis=1, dtype=np.float64)
+                running_mins = np.minimum(np.minimum.accumulate(scores), min_score)
+                for i in np.flatnonzero(scores <= running_mins + limit_tolerance * np.abs(running_mins)):
+                    candidates.append((scores[i], prefix_inds + (avail_medoid_indices[block_start+i],) + chsn_tup))
+                min_score = running_mins[-1]
+                rank += block_stop - block_start
+                cache['cycles_used'] += block_stop - block_start
+                if cache['quit_now']:
+                    return rank, candidates
+                if rank >= stop:
+                    break
+            if rank >= stop:
+                break
+            depth = len(prefix) - 1 # Moves on to the next prefix in lexicographic order
+            while prefix[depth] == max_prefix[depth]:
+                depth -= 1
+            prefix[depth] += 1
+            for i in range(depth+1, len(prefix)):
+                prefix[i] = prefix[i-1] + 1
+            first = prefix[-1] + 1
+        return rank, candidates
+    def _brute_force_progress_cache(self):
+        """Returns the DistanceCache that the progress of brute force runs is saved to, or None if there is no cache."""
+        if self.distance_cache_dir is None or self.distance_cache_size is None:
+            return None
+        return DistanceCache(self.distance_cache_dir, self.distance_cache_size, verbose=self.verbose)
+    def _brute_force_progress_key(self, params):
+        """Identifies the combinations of a brute force run. The rank of a combination depends on the order of the leaves and on the assigned variants, and its score on the dtype and the params (num_variants, tolerance); the tree fingerprint covers the distances."""
+        key_data = [self.leaves, self.distance_dtype.name, sorted(self.available), sorted(self.chosen), sorted(self.ignored), params[0], float(params[1])]
+        return hashlib.sha1(json.dumps(key_data).encode('utf-8')).hexdigest()
+    def _load_brute_force_ranges(self, params):
+        """Returns the finished ranges of a brute force run with 'params' saved by _save_brute_force_ranges(), or an empty dict if none were saved."""
+        progress_cache = self._brute_force_progress_cache()
+        if progress_cache is None:
+            return {}
+        data = progress_cache.load_progress(self.tree.get_fingerprint(), self._brute_force_progress_key(params))
+        if not data:
+            return {}
+        if self.verbose:
+            print('\nResuming brute force from the progress saved in the cache')
+        return dict((start, (reached, [(score, tuple(med_inds)) for score, med_inds in candidates])) for start, reached, candidates in data)
+    def _save_brute_force_ranges(self, params, finished):
+        """Saves the 'finished' ranges of a brute force run with 'params' to the distance cache, as JSON."""
+        data = [[start, reached, [[float(score), list(med_inds)] for score, med_inds in candidates]] for start, (reached, candidates) in sorted(finished.items())]
+        self._brute_force_progress_cache().save_progress(self.tree.get_fingerprint(), self._brute_force_progress_key(params), data)
+    def _merge_brute_force_ranges(self, finished):
+        """Returns the best medoids, their transformed score, and any alternate medoids tied with them, from the 'finished' ranges of a brute force run. The candidates of each range are considered in order, exactly as if every combination had been scored in turn; any combination left out of the candidates cannot be lower than or tied with the best score at that point, since that is never more than one tie above the lowest score before it."""
+        best_med_inds, best_score = None, float('inf')
+        alt_variants = []
+        for start in sorted(finished):
+            for score, med_inds in finished[start][1]:
+                if self._scores_tied(score, best_score):
+                    alt_variants.append(med_inds)
+                elif score < best_score:
+                    best_med_inds, best_score = med_inds, score
+                    alt_variants = []
+        return best_med_inds, best_score, alt_variants
+    def _heuristic_rand_starts(self, num_variants, tolerance, batch_size, num_replicates, cache, max_cycles):
+        # 'num_replicates' times, run _cluster_k_medoids() from starting medoids chosen by self.k_medoids_init, and find the best score. Each replicate has its own random generator, seeded in turn from the random module, so the results don't depend on self.clustering_workers.
+        avail_medoid_indices = [self.index[name] for name in self.tree.get_ordered_names() if name in self.available]
+        chsn_indices = [self.index[n] for n in self.chosen]
+        dists = self._transform_distances(tolerance)
         cache['cycles_used'] = 0
         replicate_cycles = None
-        for i in range(num_replicates):
-            if max_cycles != None:
-                replicate_cycles = ceil(max_cycles / num_replicates)
-            # Requires Python2 compatibility, can't do ... = fxn(*args, replicate_cycles)
-            arg_tup = args + (replicate_cycles,)
-            variants, scores = fxn(*arg_tup)
+        if max_cycles != None:
+            replicate_cycles = ceil(max_cycles / num_replicates)
+        seeds = [random.randrange(2**32) for i in range(num_replicates)]
+        workers = multiprocessing.cpu_count() if self.clustering_workers is None else self.clustering_workers
+        results = None
+        if min(workers, num_replicates) > 1 and isinstance(dists, CondensedDistanceMatrix) and (self.memory_budget is None or dists.nbytes <= self.memory_budget):
+            results = self._run_replicates_parallel(workers, seeds, (num_variants, chsn_indices, avail_medoid_indices, batch_size), dists, cache, replicate_cycles)
+        if results is None: # A DistanceOracle, or a matrix only held on disk, is not worth sharing with other processes. Also run here if another run is using the worker processes.
+            results = []
+            for seed in seeds:
+                prev_cycles = cache['cycles_used']
+                variants, scores = self._cluster_k_medoids(num_variants, chsn_indices, avail_medoid_indices, dists, cache, replicate_cycles, random.Random(seed), batch_size)
+                results.append((variants, scores, cache['cycles_used'] - prev_cycles))
+        optima = {}
+        cycles_to_converge = []
+        for variants, scores, cycles_used in results:
+            cycles_to_converge.append(cycles_used)
             var_tup = tuple(sorted(variants))
             if var_tup in optima:
                 optima[var_tup]['count'] += 1
@@ -584,7 +873,7 @@ class VariantFinder(object):
         alt_optima, alt_variants, opt_count = 0, [], optima[ranked_vars[0]]['count']
         if num_replicates > 1:
             for rv in ranked_vars[1:]:
-                if optima[rv]['score'] == best_trans_score:
+                if self._scores_tied(optima[rv]['score'], best_trans_score):
                     alt_optima += 1
                     alt_variants.append(optima[rv]['variants'])
                     opt_count += optima[rv]['count']
@@ -592,98 +881,145 @@ class VariantFinder(object):
                     break
             if self.verbose:
                 self._print_alt_variant_results(num_replicates, optima, ranked_vars, alt_optima, opt_count)
+        if self.verbose:
+            print('Replicates initialized by {} used an average of {:.0f} swap cycles (min {}, max {}).'.format(self.k_medoids_init, sum(cycles_to_converge) / float(num_replicates), min(cycles_to_converge), max(cycles_to_converge)))
         return best_variants, final_scores, alt_variants
-    def _cluster_k_medoids(self, num_variants, tolerance, cache, max_cycles):
-        avail_medoid_indices = [self.index[name] for name in self.tree.get_ordered_names() if name in self.available]
-        chsn_indices = list(self.index[n] for n in self.chosen)
-        num_chsn = len(chsn_indices)
-        dists = self._transform_distances(tolerance)
-        # This spaces the initial centroids randomly around the tree
-        seq_chunk = len(avail_medoid_indices) // (num_variants - num_chsn)
-        rand_inds = []
-        for i in range(num_variants - num_chsn):
-            rand_inds.append(avail_medoid_indices[random.randint(i*seq_chunk, (i+1)*seq_chunk-1)])
-        best_med_inds = np.array(chsn_indices + rand_inds)
-        # Initial random sets
-        best_clusters = self._partition_nearest(best_med_inds, dists)
-        best_scores = self._sum_dist_scores(best_med_inds, best_clusters, dists)
-        best_score = sum(best_scores)
-        if num_chsn == num_variants:
-            return best_med_inds, best_scores
-        # Using a simple greedy algorithm, typically converges after 2-3 iterations.
-        num_cycles = 0
-        improvement = True
-        while improvement == True:
-            improvement = False
-            med_inds = best_med_inds.copy()
-            for i in range(num_chsn, num_variants):
-                for ind in avail_medoid_indices:
-                    if ind in med_inds: continue
-                    med_inds[i] = ind
-                    score = self._score_pattern(med_inds, dists)
-                    if score < best_score:
-                        best_score = score
-                        best_med_inds[i] = ind
-                        improvement = True
-                    else:
-                        med_inds[i] = best_med_inds[i]
-                    num_cycles += 1
-                    cache['cycles_used'] += 1
-                    if cache['quit_now'] or max_cycles != None and num_cycles >= max_cycles:
-                        break
-                if cache['quit_now'] or max_cycles != None and num_cycles >= max_cycles:
-                    improvement = False
-                    break
-        best_clusters = self._partition_nearest(best_med_inds, dists)
-        best_scores = self._sum_dist_scores(best_med_inds, best_clusters, dists)
-        return best_med_inds, best_scores
-    def _cluster_k_medoids_minibatch(self, num_variants, tolerance, batch_size, cache, max_cycles):
-        """Runs a k-medoids clustering approach, but only on a random subsample of the available variants. Yields massive time savings, with only a minor performance hit (often none)."""
-        avail_medoid_indices = [self.index[name] for name in self.tree.get_ordered_names() if name in self.available]
-        chsn_indices = [self.index[n] for n in self.chosen]
-        num_chsn = len(chsn_indices)
-        dists = self._transform_distances(tolerance)
-        # This spaces the initial centroids randomly around the tree
-        seq_chunk = len(avail_medoid_indices) // (num_variants - num_chsn)
-        rand_inds = []
-        for i in range(num_variants - num_chsn):
-            rand_inds.append(avail_medoid_indices[random.randint(i*seq_chunk, (i+1)*seq_chunk-1)])
-        best_med_inds = np.array(chsn_indices + rand_inds)
-        # Initial random sets
-        best_clusters = self._partition_nearest(best_med_inds, dists)
-        best_scores = self._sum_dist_scores(best_med_inds, best_clusters, dists)
-        best_score = sum(best_scores)
-        # Using a simple greedy algorithm, typically converges after 2-5 iterations.
-        num_cycles = 0
-        improvement = True
-        while improvement == True:
-            improvement = False
-            med_inds = best_med_inds.copy()
-            if len(avail_medoid_indices) > batch_size:
-                avail_minibatch_inds = random.sample(avail_medoid_indices, batch_size)
+    def _initial_medoids(self, num_variants, chsn_indices, avail_indices, dists, rng):
+        """Returns an array of the chosen indices followed by starting medoids from 'avail_indices', picked according to self.k_medoids_init using the random.Random instance 'rng'. 'random' (the default) takes one random variant from each of several equal chunks of the tree order, which spaces them around the tree. 'build' is the greedy BUILD of PAM, which adds the variant that most lowers the score each time; it is the slowest and always gives the same medoids. 'lab' is the linear approximate BUILD of FastPAM (Schubert & Rousseeuw, 2019), which does the same using random samples of about sqrt(n) candidates and variants. 'k-medoids++' picks each one at random, weighted by its squared distance to the nearest medoid so far."""
+        num_new = num_variants - len(chsn_indices)
+        if self.k_medoids_init == 'random':
+            seq_chunk = len(avail_indices) // num_new
+            new_inds = [avail_indices[rng.randint(i*seq_chunk, (i+1)*seq_chunk-1)] for i in range(num_new)]
+        elif self.k_medoids_init == 'build':
+            new_inds = self._build_medoids(num_new, chsn_indices, avail_indices, dists)
+        elif self.k_medoids_init == 'lab':
+            new_inds = self._lab_medoids(num_new, chsn_indices, avail_indices, dists, rng)
+        else:
+            new_inds = self._plusplus_medoids(num_new, chsn_indices, avail_indices, dists, rng)
+        return np.array(list(chsn_indices) + new_inds, dtype=np.intp)
+    def _build_medoids(self, num_new, chsn_indices, avail_indices, dists):
+        """Used by _initial_medoids(). Each candidate's score is found from its row, in blocks of rows."""
+        near_dists = np.full(dists.shape[0], np.inf)
+        for ind in chsn_indices:
+            near_dists = np.minimum(near_dists, dists[ind,:])
+        new_inds, remaining = [], np.array(avail_indices, dtype=np.intp)
+        block = rows_per_block(self.memory_budget, 2 * dists.shape[0] * 8, 256)
+        for i in range(num_new):
+            scores = np.empty(len(remaining))
+            for start in range(0, len(remaining), block):
+                scores[start:start+block] = np.sum(np.minimum(dists[remaining[start:start+block],:], near_dists), axis=1, dtype=np.float64)
+            best = np.argmin(scores)
+            new_inds.append(int(remaining[best]))
+            near_dists = np.minimum(near_dists, dists[remaining[best],:])
+            remaining = np.delete(remaining, best)
+        return new_inds
+    def _lab_medoids(self, num_new, chsn_indices, avail_indices, dists, rng):
+        """Used by _initial_medoids(). Each medoid is the best of a new random sample of candidates, scored on a new random sample of the variants."""
+        medoids, remaining = list(chsn_indices), list(avail_indices)
+        not_ignored = sorted(self._not_ignored_inds)
+        sample_size = 10 + int(ceil(sqrt(len(not_ignored))))
+        for i in range(num_new):
+            cands = rng.sample(remaining, min(sample_size, len(remaining)))
+            points = np.array(rng.sample(not_ignored, min(sample_size, len(not_ignored))), dtype=np.intp)
+            cand_dists = dists[np.ix_(cands, points)]
+            if medoids:
+                cand_dists = np.minimum(cand_dists, np.min(dists[np.ix_(medoids, points)], axis=0))
+            best = cands[np.argmin(np.sum(cand_dists, axis=1, dtype=np.float64))]
+            medoids.append(best)
+            remaining.remove(best)
+        return medoids[len(chsn_indices):]
+    def _plusplus_medoids(self, num_new, chsn_indices, avail_indices, dists, rng):
+        """Used by _initial_medoids(). The first is picked uniformly if there are no chosen variants, as is any medoid when every remaining candidate is at distance 0 from the current ones. Candidates already picked have no weight, so the medoids are always distinct."""
+        avail = np.array(avail_indices, dtype=np.intp)
+        near_dists = np.full(len(avail), np.inf)
+        for ind in chsn_indices:
+            near_dists = np.minimum(near_dists, dists[ind,:][avail])
+        picked = np.zeros(len(avail), dtype=bool)
+        new_inds = []
+        for i in range(num_new):
+            weights = np.square(near_dists) if np.isfinite(near_dists).all() else np.ones(len(avail))
+            weights[picked] = 0.0
+            cumulative = np.cumsum(weights, dtype=np.float64)
+            if cumulative[-1] > 0:
+                pick = int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right'))
+                pick = min(pick, int(np.flatnonzero(weights)[-1])) # In case rounding puts the target at the very end
             else:
-                avail_minibatch_inds = avail_medoid_indices
-            for i in range(num_chsn, num_variants):
-                for ind in avail_minibatch_inds:
-                    if ind in med_inds: continue
-                    med_inds[i] = ind
-                    score = self._score_pattern(med_inds, dists)
-                    if score < best_score:
-                        best_score = score
-                        best_med_inds[i] = ind
-                        improvement = True
-                    else:
-                        med_inds[i] = best_med_inds[i]
-                    num_cycles += 1
-                    cache['cycles_used'] += 1
-                    if cache['quit_now'] or max_cycles != None and num_cycles >= max_cycles:
-                        break
-                if cache['quit_now'] or max_cycles != None and num_cycles >= max_cycles:
-                    improvement = False
-                    break
+                pick = rng.choice(np.flatnonzero(~picked).tolist())
+            picked[pick] = True
+            new_inds.append(int(avail[pick]))
+            near_dists = np.minimum(near_dists, dists[avail[pick],:][avail])
+        return new_inds
+    def _cluster_k_medoids(self, num_variants, chsn_indices, avail_indices, dists, cache, max_cycles, rng, batch_size=None):
+        """Runs one replicate of k medoids, drawing any random numbers from the random.Random instance 'rng'. If 'batch_size' is given, each pass only tries a random subsample of that many available variants as new medoids (the k minibatch method). Yields massive time savings, with only a minor performance hit (often none)."""
+        best_med_inds = self._initial_medoids(num_variants, chsn_indices, avail_indices, dists, rng)
+        if len(chsn_indices) < num_variants:
+            # Using a greedy swap algorithm, typically converges after 2-3 passes (2-5 with a batch_size).
+            best_med_inds = self._swap_medoids(best_med_inds, len(chsn_indices), avail_indices, dists, cache, max_cycles, rng, batch_size)
         best_clusters = self._partition_nearest(best_med_inds, dists)
         best_scores = self._sum_dist_scores(best_med_inds, best_clusters, dists)
         return best_med_inds, best_scores
+    def _acquire_clustering_pool(self, workers, dists):
+        """Returns this instance's ClusteringPool with its lock held, replacing it first if it has a different number of workers or was made for a different size or dtype of matrix. Returns None if another thread is already running clustering with it, so that run should be done in this process."""
+        clustering_pool = self._clustering_pool
+        if clustering_pool is not None and not clustering_pool.fits(workers, dists):
+            self._close_clustering_pool()
+            clustering_pool = None
+        if clustering_pool is None:
+            clustering_pool = self._clustering_pool = ClusteringPool(workers, dists.size, dists.dtype, self.memory_budget)
+        if not clustering_pool.lock.acquire(False):
+            return None
+        return clustering_pool
+    def _close_clustering_pool(self):
+        """Stops the worker processes of this instance's ClusteringPool, if it has one. A pool still in use by a run is closed once that run lets it go."""
+        clustering_pool, self._clustering_pool = self._clustering_pool, None
+        if clustering_pool is not None and clustering_pool.lock.acquire(False):
+            try:
+                clustering_pool.close()
+            finally:
+                clustering_pool.lock.release()
+    def _run_replicates_parallel(self, workers, seeds, replicate_args, dists, cache, replicate_cycles):
+        """Used by _heuristic_rand_starts(). Returns (variants, scores, cycles_used) for the replicate of each seed, in order, or None if the worker processes are busy with another run. Setting cache['quit_now'] sets the flag shared with the workers, which their replicates check instead."""
+        clustering_pool = self._acquire_clustering_pool(workers, dists)
+        if clustering_pool is None:
+            return None
+        try:
+            run_state = clustering_pool.start_run(dists, self.k_medoids_init, self._not_ignored_inds)
+            pending = [clustering_pool.pool.apply_async(run_replicate, ((run_state, replicate_args, seed, replicate_cycles),)) for seed in seeds]
+            results = []
+            for replicate in pending:
+                while not replicate.ready():
+                    replicate.wait(0.1)
+                    if cache['quit_now']:
+                        clustering_pool.quit_flag.value = True
+                variants, scores, cycles_used = replicate.get()
+                cache['cycles_used'] += cycles_used
+                results.append((variants, scores, cycles_used))
+        finally:
+            clustering_pool.lock.release()
+        return results
+    def _run_brute_force_parallel(self, workers, tasks, search_args, dists, cache, finished, range_finished):
+        """Used by _brute_force_clustering(). Scores each (start, stop) range in 'tasks' in a worker process, adding each to 'finished' and its combinations to cache['cycles_used'] as soon as it is done, then calling range_finished(). Setting cache['quit_now'] sets the flag shared with the workers. Returns False without scoring anything if the worker processes are busy with another run."""
+        clustering_pool = self._acquire_clustering_pool(workers, dists)
+        if clustering_pool is None:
+            return False
+        try:
+            run_state = clustering_pool.start_run(dists, self.k_medoids_init, self._not_ignored_inds)
+            pending = [clustering_pool.pool.apply_async(run_brute_force_range, ((run_state, start, stop, search_args),)) for start, stop in tasks]
+            while pending:
+                for task in [task for task in pending if task.ready()]:
+                    start, reached, candidates = task.get()
+                    if reached > start:
+                        finished[start] = (reached, candidates)
+                        range_finished()
+                    cache['cycles_used'] += reached - start
+                    pending.remove(task)
+                if pending:
+                    pending[0].wait(0.1)
+                    if cache['quit_now']:
+                        clustering_pool.quit_flag.value = True
+        finally:
+            clustering_pool.lock.release()
+        return True
 
     def _qt_radius_clustering_greedy(self, min_to_cluster, threshold, cache, max_cycles):
         """Implementation of an adaptation of the QT clustering algorithm. A greedy heuristic, picking new medoids based on the number of unclaimed leaves they cover, with ties broken by the effect each would have on the entire tree score. Then runs a local iterative optimization that I've never seen run for more than 3 cycles. Typically improves overall scores by 5-15%, though it can also drop the number of clusters. Generally doubles or triples the runtime of this function; still extremely fast at 300ms for tree of 1399 and 3s for tree of 4173 (tho it takes 20s when yielding 240 clusters)."""
@@ -752,7 +1088,10 @@ class VariantFinder(object):
                         else:
                             scores[ind] -= min_dists[nbr_beyond,ind].sum() # If a leaf can be skipped, it no longer affects the choice of medoid
                 # Identify best new medoid
-                best_nbrs = np.take(cur_nbrs, np.flatnonzero(scores == scores.min()))
+                tie_limit = scores.min()
+                if np.isfinite(tie_limit):
+                    tie_limit += self._tie_tolerance * abs(tie_limit) # Scores can be negative, so the tolerance is added rather than multiplied
+                best_nbrs = np.take(cur_nbrs, np.flatnonzero(scores <= tie_limit))
                 if med_ind in best_nbrs: # Prevents endless swapping between equivalent medoids
                     new_meds.append(med_ind)
                 else:
@@ -772,7 +1111,7 @@ class VariantFinder(object):
             med = int(claimed_inds[ind,0])
             if med == -1:
                 med = medoids[self.orig_dists[ind,medoids].argmin()]
-            medoid_scores[med] += self.orig_dists[ind,med]
+            medoid_scores[med] += float(self.orig_dists[ind,med])
         final_scores = [medoid_scores[med] for med in medoids]
         alt_variants = []
         return medoids, final_scores, alt_variants
@@ -807,22 +1146,20 @@ class VariantFinder(object):
         #nbrs_remain[:,clstr_inds] = False Don't do this. Sometimes a leaf that has been claimed already will make a good cluster medoid. Falsing the columns prevents that from being considered.
         return new_medoid, clstr_inds
 
-    def _qt_radius_clustering_minimal(self, min_to_cluster, reduced, unassigned_orphans, cache, max_cycles):
+    def _qt_radius_clustering_minimal(self, min_to_cluster, in_range, unassigned_orphans, cache, max_cycles):
         """In the case where all sequences are classified as available, finding cluster centers is equivalent to the dominating set problem. It is similar to the vertex cover problem, and every vertex cover is a dominating set, but dominating sets don't need to include every edge in the graph.
         This implementation is a little different than a typical one, because of the available & unassigned variants. In a normal implementation, every variant is always guaranteed to be able to be placed into a cluster, to form a singleton if nothing else. But there may be no available variant within threshold distance of some unassigned variant. Or worse, the nearest available variant may be assigned to some other cluster, stranding some unassigned variants. This one is greedy(? what do i mean).
         Use constraint propagation with branch/bound; once we find a valid solution, any configuration that yields the same number/more clusters can be pruned. Don't think I can use the total score to prune, but I can prune if too many unassigned are stranded (more than the allowed miss %)."""
         # Separating components and removing dominated indices reduced runtime on tbpb82 0.4@100% from 10s to 10ms.
         # Before removing dominated, tree_275 0.04@100% found a solution with score 4.0485 after 228k cycles. After, found it in 49k. After adding the second Counter to CoverManager, found it under 1k cycles. Each cycle was substantially slower, but the solution still was found ~1000x faster (ms instead of 20 min).
-        out_of_range = reduced.copy()
-        out_of_range[out_of_range != 0] = 1
         neighbors_of = {}
         for ind in self._not_ignored_inds:
-            clstr_inds = np.nonzero(reduced[:,ind] == 0)[0]
+            clstr_inds = np.nonzero(in_range[ind])[0] # Rows are the same as columns, and are contiguous
             neighbors_of[ind] = set(clstr_inds)
         chsn_indices = set(self.index[name] for name in self.chosen)
         avail_indices = set(self.index[name] for name in self.available)
         num_not_ignored = len(self._not_ignored_inds)
-        considered_nbrs, dominated_inds = self._remove_dominated_inds(neighbors_of, chsn_indices, avail_indices, out_of_range)
+        considered_nbrs, dominated_inds = self._remove_dominated_inds(neighbors_of, chsn_indices, avail_indices, in_range)
         # #  Process depending on the run parameters
         cache['cycles_used'] = 0
         final_centre_inds, final_scores = [], []
@@ -836,7 +1173,7 @@ class VariantFinder(object):
                 subset_avail = avail_indices & subset_indices
                 if max_cycles != None:
                     subset_cycles = ceil(subset_to_cluster/float(min_to_cluster) * max_cycles) + cycle_rollover
-                subset_centre_inds, subset_scores, subset_cycles_used = self._qt_radius_cluster_subset(subset_indices, subset_chosen, subset_avail, considered_nbrs, dominated_inds, subset_to_cluster, cache, subset_cycles, out_of_range)
+                subset_centre_inds, subset_scores, subset_cycles_used = self._qt_radius_cluster_subset(subset_indices, subset_chosen, subset_avail, considered_nbrs, dominated_inds, subset_to_cluster, cache, subset_cycles)
                 if subset_cycles_used == None or subset_cycles_used >= subset_cycles:
                     cycle_rollover = 0
                 else:
@@ -858,7 +1195,7 @@ class VariantFinder(object):
                     continue
                 subset_chosen = chsn_indices & subset_indices
                 subset_avail = avail_indices & subset_indices
-                subset_centre_inds, subset_scores, subset_cycles_used = self._qt_radius_cluster_subset(subset_indices, subset_chosen, subset_avail, considered_nbrs, dominated_inds, subset_to_cluster, cache, subset_cycles, out_of_range)
+                subset_centre_inds, subset_scores, subset_cycles_used = self._qt_radius_cluster_subset(subset_indices, subset_chosen, subset_avail, considered_nbrs, dominated_inds, subset_to_cluster, cache, subset_cycles)
                 if subset_cycles_used == None or subset_cycles_used >= subset_cycles:
                     cycle_rollover = 0
                 else:
@@ -870,11 +1207,11 @@ class VariantFinder(object):
             # May be a way to remove some components from consideration, but likely requires running _qt_radius_cluster_subset() multiple times. May still be faster, so worth considering if more speed is actually useful here.
             #  - All unassigned orphans are part of total_allowed_missed by definition. So all other clusters are only allowed to miss allowed_missed = total_allowed_missed - len(unassigned_orphans).
             #  - The global optimal solution for some component is guaranteed to fall between the solution for that component finding 100% of variants, and the solution for that component finding len(component)-allowed_missed variants. If they are equal, that's the global optimal solution for that component, and it can be excluded from the combined run. If they're unequal, it was a waste of time and the component has to be included in the combined run.
-            final_centre_inds, final_scores, _cycles_used = self._qt_radius_cluster_subset(set(neighbors_of.keys()), chsn_indices, avail_indices, considered_nbrs, dominated_inds, min_to_cluster, cache, max_cycles, out_of_range)
+            final_centre_inds, final_scores, _cycles_used = self._qt_radius_cluster_subset(set(neighbors_of.keys()), chsn_indices, avail_indices, considered_nbrs, dominated_inds, min_to_cluster, cache, max_cycles)
         alt_variants = []
         return final_centre_inds, final_scores, alt_variants
 
-    def _qt_radius_cluster_subset(self, subset_indices, subset_chosen, subset_avail, considered_nbrs, dominated_inds, subset_to_cluster, cache, subset_cycles, out_of_range):
+    def _qt_radius_cluster_subset(self, subset_indices, subset_chosen, subset_avail, considered_nbrs, dominated_inds, subset_to_cluster, cache, subset_cycles):
         subset_centre_inds, subset_scores, subset_cycles_used = [], [], None
         subset_len, subset_chosen_len, subset_avail_len = len(subset_indices), len(subset_chosen), len(subset_avail)
         # #  Trivial subset configurations
@@ -896,7 +1233,7 @@ class VariantFinder(object):
             # The 1 avail is the only possible centre.
             subset_centre_ind = next(iter(subset_avail))
             other_inds = list(subset_indices - subset_avail)
-            subset_score = np.sum(self.orig_dists[other_inds,subset_centre_ind])
+            subset_score = float(np.sum(self.orig_dists[other_inds,subset_centre_ind], dtype=np.float64))
             return [subset_centre_ind], [subset_score], subset_cycles_used
         elif subset_len == 2:
             # May be 1 avail and 1 chosen, or 2 avail.
@@ -907,7 +1244,7 @@ class VariantFinder(object):
                 subset_avail_iter = iter(subset_avail)
                 subset_centre_ind = next(subset_avail_iter)
                 other_ind = next(subset_avail_iter)
-            subset_score = self.orig_dists[other_ind,subset_centre_ind]
+            subset_score = float(self.orig_dists[other_ind,subset_centre_ind])
             return [subset_centre_ind], [subset_score], subset_cycles_used
         # #  Non-trivial subsets
         subset_nbrs = {ind:considered_nbrs[ind] for ind in subset_indices if ind in considered_nbrs}
@@ -1008,14 +1345,13 @@ class VariantFinder(object):
         return components
 
     def _reduce_distances(self, threshold):
-        """Returns a copy of the distance matrix, where all distances <= threshold are set to 0. Removes the ignored variants from consideration by setting their columns and rows to inf. If the given threshold is infeasible, returns ([], num_orphans) to indicate an error."""
-        reduced = self.orig_dists.copy()
-        reduced[reduced <= threshold] = 0
+        """Returns a full 2D boolean array, True where the distance between two variants is <= threshold, and an array of the unassigned variants with no chosen or available variant in range. Removes the ignored variants from consideration by setting their columns and rows to False."""
+        in_range = self.orig_dists.within(threshold)
         # Remove ignored from all consideration
         ignrd_indices = [self.index[name] for name in self.ignored]
         if ignrd_indices:
-            reduced[:,ignrd_indices] = np.inf
-            reduced[ignrd_indices,:] = np.inf
+            in_range[:,ignrd_indices] = False
+            in_range[ignrd_indices,:] = False
         # Check if the given parameters are feasible
         chsn_indices = set(self.index[name] for name in self.chosen)
         avail_indices = set(self.index[name] for name in self.available)
@@ -1025,13 +1361,13 @@ class VariantFinder(object):
             unassigned_orphans = unassigned_indices
         else:
             ca_indices = list(ca_indices)
-            avail_in_range = np.count_nonzero(reduced[np.ix_(unassigned_indices,ca_indices)] == 0, axis=1)
+            avail_in_range = np.count_nonzero(in_range[np.ix_(unassigned_indices,ca_indices)], axis=1)
             unassigned_orphans = unassigned_indices[avail_in_range == 0]
-        return reduced, unassigned_orphans
+        return in_range, unassigned_orphans
     
     def _get_nbrs(self, threshold, chsn_indices, avail_indices, ignrd_indices):
         """nbrs is a 2D boolean array where a column nbrs[:,ind] gives you a boolean mask for all neighbours of ind. Setting a column to all False removes that index from consideration as a medoid. Setting a row to all False removes that index from counting as unclaimed."""
-        nbrs = self.orig_dists <= threshold  # very fast to calculate; 17MB for a tree of 4173
+        nbrs = self.orig_dists.within(threshold)  # very fast to calculate; 17MB for a tree of 4173
         unassigned_indices = list(self._not_ignored_inds - avail_indices - chsn_indices)
         if unassigned_indices:
             # Remove unassigned from centre consideration
@@ -1040,7 +1376,7 @@ class VariantFinder(object):
             # Remove ignored from all consideration so they have zero impact.
             nbrs[ignrd_indices,:] = False
             nbrs[:,ignrd_indices] = False
-        nbrs_remain = nbrs.copy() # Working copy of nbrs
+        nbrs_remain = budgeted_copy(nbrs, self.memory_budget) # Working copy of nbrs
         
         # claimed_inds is a tree_size x 2 array, where the first column holds -1, or the medoid ind once that row has been claimed; the second column holds the distance to that medoid. Note that because it is one array, the first column holds floats of the indices, will need to convert to int if used as an index
         claimed_inds = np.zeros((self.tree_size, 2))
@@ -1070,25 +1406,22 @@ class VariantFinder(object):
         if tolerance <= 0.0:
             raise NavargatorValueError('Error: tolerance must be a strictly positive number.')
         if tolerance == 1.0:
+            if not self.ignored:
+                return self.orig_dists # Shares its row cache
             dists = self.orig_dists.copy()
         else:
-            dists = np.power(self.orig_dists.copy()*tolerance + 1.0, 1.0/tolerance) - 1.0
-        for name in self.ignored:
-            ind = self.index[name]
-            dists[ind,:] = 0
-            dists[:,ind] = 0
+            dists = self.orig_dists.transformed(lambda orig: np.power(orig*tolerance + 1.0, 1.0/tolerance) - 1.0)
+        dists.fill_rows([self.index[name] for name in self.ignored], 0)
         return dists
 
-    def _remove_dominated_inds(self, neighbors_of, chsn_indices, avail_indices, out_of_range):
+    def _remove_dominated_inds(self, neighbors_of, chsn_indices, avail_indices, in_range):
         # I need to change the "dominated" terms. Since qt is doing real dominated sets. This function is actually identifying cliques! Mostly. All members of a clique will have the same set of neighbours, except for the nodes in the clique connected to the rest of the graph. We collapse the identical ones.
 
         # Is not a "dominating set" from graph theory. Here, one variant dominates others if they all have identical neighbours under the threshold, and the one variant is the most central (lowest summed distance to other variants).
         # Removing these dominated inds from consideration dramatically speeds up the algorithm, and still guarantees to find the optimal minimum set cover. In some cases the score (but not the clustering pattern) may be slightly non-optimal, which is remedied by _test_dominated_inds().
         considered_nbrs, dominated_inds, repeated_inds = {}, {}, set()
-        uniq_nbrs, count = np.unique(out_of_range.T, axis=0, return_counts=True)
-        repeated_nbrs = uniq_nbrs[count > 1]
-        for rep_nbrs in repeated_nbrs:
-            rep_inds = np.argwhere(np.all(out_of_range.T == rep_nbrs, axis=1)).ravel() # Inds with identical columns in out_of_range
+        for rep_inds in self._identical_rows(in_range):
+            rep_inds = np.array(rep_inds) # Inds with identical columns in in_range
             rep_inds_set = set(rep_inds)
             repeated_inds.update(rep_inds_set)
             chsn_rep_inds = chsn_indices & rep_inds_set
@@ -1108,6 +1441,15 @@ class VariantFinder(object):
         for uniq_ind in (chsn_indices | avail_indices) - repeated_inds:
             considered_nbrs[uniq_ind] = neighbors_of[uniq_ind]
         return considered_nbrs, dominated_inds
+    def _identical_rows(self, bool_mat):
+        """Returns a list of lists of the indices of identical rows in the square 'bool_mat', in ascending order, for each row that has at least one duplicate. The rows are packed into bits and hashed in blocks within self.memory_budget, so no sorted copy of the matrix is needed."""
+        groups = {}
+        block = rows_per_block(self.memory_budget, 2*len(bool_mat), 1024)
+        for start in range(0, len(bool_mat), block):
+            packed = np.packbits(bool_mat[start:start+block], axis=1)
+            for i, packed_row in enumerate(packed):
+                groups.setdefault(hashlib.sha1(packed_row.tobytes()).digest(), []).append(start + i)
+        return [inds for inds in groups.values() if len(inds) > 1]
     def _test_dominated_inds(self, cur_centre_inds, best_score, dominated_inds):
         # All keys in dominated_inds are by definition available.
         final_centre_inds = cur_centre_inds[::]
@@ -1125,30 +1467,135 @@ class VariantFinder(object):
 
 
     def _score_pattern(self, centres, dists, only_these=[]):
-        """Approximately 2-4x faster then _partition_nearest() and _sum_dist_scores(); twice as fast again if only_these is empty."""
+        """Approximately 2-4x faster then _partition_nearest() and _sum_dist_scores(); twice as fast again if only_these is empty. As dists is symmetrical, the rows of the centres are used instead of their columns; a CondensedDistanceMatrix keeps recently used rows expanded, so the rows of the current medoids are not gathered again. The score is always summed as a float64."""
         if len(only_these) == 0:
-            return np.sum(np.min(dists[:,centres], axis=1))
+            return np.sum(np.min(dists[centres,:], axis=0), dtype=np.float64)
         else:
-            return np.sum(np.min(dists[np.ix_(only_these,centres)], axis=1))
+            return np.sum(np.min(dists[np.ix_(centres,only_these)], axis=0), dtype=np.float64)
+    def _swap_medoids(self, medoids, num_fixed, avail_indices, dists, cache, max_cycles, rng, batch_size=None):
+        """The swap phase of the k-medoids methods, following FasterPAM (Schubert & Rousseeuw, 2021). The distances from each variant to its nearest and second nearest medoids are kept, so the change in score from swapping a candidate with each of the medoids is found at once from the candidate's row. The best of those swaps is made as soon as it improves the score. The first 'num_fixed' medoids are never swapped out, and if 'batch_size' is given each pass only tries a sample of that many candidates, drawn from the random.Random instance 'rng'. Each candidate counts as one cycle per medoid it could replace. Returns the new array of medoids."""
+        medoids = np.array(medoids)
+        med_rows = dists[medoids,:]
+        nearest, near_dists, second_dists = self._nearest_medoids(med_rows)
+        best_score = np.sum(near_dists, dtype=np.float64)
+        num_swappable = len(medoids) - num_fixed
+        num_cycles = 0
+        improvement = True
+        while improvement == True:
+            improvement = False
+            if batch_size is not None and len(avail_indices) > batch_size:
+                candidates = rng.sample(avail_indices, batch_size)
+            else:
+                candidates = avail_indices
+            for ind in candidates:
+                if ind in medoids: continue
+                row = dists[ind,:]
+                to_cand = np.minimum(row, near_dists)
+                # Every variant moves to ind if it is closer. The variants nearest to the medoid being replaced otherwise move to their second nearest.
+                deltas = np.bincount(nearest, weights=np.minimum(row, second_dists) - to_cand, minlength=len(medoids))
+                deltas[:num_fixed] = np.inf
+                i = np.argmin(deltas)
+                if deltas[i] + np.sum(to_cand - near_dists, dtype=np.float64) < 0:
+                    old_row = med_rows[i].copy()
+                    med_rows[i] = row
+                    new_nearest, new_near_dists, new_second_dists = self._nearest_medoids(med_rows)
+                    score = np.sum(new_near_dists, dtype=np.float64) # Identical to self._score_pattern(medoids, dists)
+                    if score < best_score: # Checked, as the predicted change can be off by rounding errors
+                        best_score = score
+                        medoids[i] = ind
+                        nearest, near_dists, second_dists = new_nearest, new_near_dists, new_second_dists
+                        improvement = True
+                    else:
+                        med_rows[i] = old_row
+                num_cycles += num_swappable
+                cache['cycles_used'] += num_swappable
+                if cache['quit_now'] or max_cycles != None and num_cycles >= max_cycles:
+                    return medoids
+        return medoids
+    def _nearest_medoids(self, med_rows):
+        """Given the 2D array of the rows of the medoids, returns the index of the nearest medoid to each variant, the distance to that medoid, and the distance to the second nearest medoid (inf if there is only one)."""
+        all_inds = np.arange(med_rows.shape[1])
+        nearest = np.argmin(med_rows, axis=0)
+        near_dists = med_rows[nearest, all_inds]
+        if len(med_rows) == 1:
+            return nearest, near_dists, np.full(med_rows.shape[1], np.inf, dtype=med_rows.dtype)
+        med_rows[nearest, all_inds] = np.inf # Temporarily hides the nearest, instead of copying med_rows
+        second_dists = np.min(med_rows, axis=0)
+        med_rows[nearest, all_inds] = near_dists
+        return nearest, near_dists, second_dists
     def _partition_nearest(self, medoids, dists, only_these=set()):
         """Given an array of indices, returns a list of lists, where the ith sublist contains the indices of the nodes closest to the ith medoid in inds."""
         if len(only_these) == 0:
             allowed_inds = self._not_ignored_inds
         else:
             allowed_inds = self._not_ignored_inds & only_these
-        closest_medoid_ind = np.argmin(dists[:,medoids], 1) # If len(medoids)==3, would look like [2,1,1,0,1,2,...].
+        if self.memory_budget is None:
+            closest_medoid_ind = np.argmin(dists[medoids,:], 0) # If len(medoids)==3, would look like [2,1,1,0,1,2,...]. Uses rows as dists is symmetrical.
+        else: # Same result, but only a block of medoid rows is held at once.
+            closest_medoid_ind = np.zeros(dists.shape[0], dtype=np.intp)
+            closest_dist = np.full(dists.shape[0], np.inf)
+            block = rows_per_block(self.memory_budget, dists.shape[0] * np.dtype(dists.dtype).itemsize, len(medoids))
+            for start in range(0, len(medoids), block):
+                block_dists = dists[medoids[start:start+block],:]
+                block_min_ind = np.argmin(block_dists, 0)
+                block_min = np.take_along_axis(block_dists, block_min_ind[None,:], 0)[0]
+                closer = block_min < closest_dist # Strictly less, so ties go to the earliest medoid like np.argmin()
+                closest_medoid_ind[closer] = block_min_ind[closer] + start
+                closest_dist[closer] = block_min[closer]
         clusts = [[] for i in medoids]
         for node_ind, med_ind in enumerate(closest_medoid_ind):
             if node_ind in allowed_inds:
                 clusts[med_ind].append(node_ind)
         return clusts
     def _sum_dist_scores(self, medoids, clusters, dists):
-        return [sum(dists[med,inds]) for med,inds in zip(medoids,clusters)]
+        return [sum(dists[med,inds].astype(np.float64, copy=False)) for med,inds in zip(medoids,clusters)]
 
     # # # # #  Private methods  # # # # #
+    def _own_tree(self):
+        """Called before self.tree is modified. If the tree is shared with any live copies of this instance, it is replaced by a private copy first. Copies that have been discarded (like the old instance replaced by NavargatorDaemon.update_or_copy_vf()) drop out of self._tree_sharers on their own."""
+        if len(self._tree_sharers) > 1:
+            self._tree_sharers.discard(self)
+            self.tree = self.tree.copy()
+            self._tree_sharers = weakref.WeakSet([self])
+    def _load_distance_matrix(self):
+        """Returns the leaf names and condensed distance matrix data of self.tree, loading it from the distance cache if this tree has been seen before. If the data would be larger than self.memory_budget it is written row by row to a memory-mapped temporary file instead."""
+        self._close_clustering_pool() # Its shared buffer was sized for the old matrix
+        names = self.tree.get_named_leaves()
+        if self.distance_cache_dir is None or self.distance_cache_size is None:
+            return names, self._calculate_distance_matrix(len(names))
+        distance_cache = DistanceCache(self.distance_cache_dir, self.distance_cache_size, verbose=self.verbose)
+        if not distance_cache.should_store(len(names), self.distance_dtype):
+            return names, self._calculate_distance_matrix(len(names))
+        fingerprint = self.tree.get_fingerprint()
+        dist_mat = distance_cache.load(fingerprint, len(names), self.distance_dtype)
+        if dist_mat is None:
+            dist_mat = self._calculate_distance_matrix(len(names))
+            if distance_cache.save(fingerprint, dist_mat) and self.memory_budget is not None:
+                dist_mat = distance_cache.load(fingerprint, len(names), self.distance_dtype) # Maps the saved file, so the temporary one can be deleted
+        elif self.verbose:
+            print('\nLoaded the distance matrix from the cache')
+        return names, dist_mat
+    def _calculate_distance_matrix(self, num_leaves):
+        """Returns the condensed distance matrix data of self.tree, ordered by its named leaves."""
+        dist_nbytes = condensed_length(num_leaves) * np.dtype(self.distance_dtype).itemsize
+        if self.memory_budget is None or dist_nbytes <= self.memory_budget:
+            return self.tree.get_distance_matrix(dtype=self.distance_dtype, condensed=True, workers=self.distance_workers)[1]
+        leaf_distances = self.tree.get_leaf_distance_function()
+        return CondensedDistanceMatrix.from_leaf_distances(leaf_distances, num_leaves, self.distance_dtype, self.memory_budget).data
+    def _update_rerooted_tree_data(self, prev_num_nodes):
+        """Re-rooting only changes the node names if it adds a new root to an unrooted tree, so update_tree_data() is skipped if the names were already checked at the current truncation. The max_root_distance (used for the scale bar) does change."""
+        self.max_root_distance = self.tree.get_max_root_distance()
+        truncation = int(self.display_options['sizes']['max_variant_name_length'])
+        if len(self.tree.nodes) != prev_num_nodes or self._tree_data_truncation != truncation:
+            self.update_tree_data(truncation)
+    def _scores_tied(self, score1, score2):
+        """Clustering scores are sums of many rounded distances. When self.distance_dtype is float32, two patterns that should score equally can differ slightly depending on the order of the sums, so they are compared with self._tie_tolerance; float64 scores are only tied if they are equal."""
+        return abs(score1 - score2) <= self._tie_tolerance * min(abs(score1), abs(score2))
     def _clear_cache(self, reset_normalize=True):
         """self.cache = {'run_id1':{cache_data}, 'run_id2':{}..., 'params':{(params1):'run_id1', ...}}"""
         self.cache = {'params':{}}
+        self._close_clustering_pool()
+        self._brute_force_ranges = {} # {(params1):{start:(reached, candidates), ...}, ...}; see _brute_force_clustering(). Also saved to the distance cache, if there is one.
         if reset_normalize:
             self.normalize = self._empty_normalize()
     def _calculate_cache_values(self, run_id, params, variant_inds, scores, alt_variants):
@@ -1165,7 +1612,7 @@ class VariantFinder(object):
         variant_distance, max_var_dist = {}, 0
         for rep_ind, clst_inds in zip(variant_inds, cluster_inds):
             for var_ind in clst_inds:
-                dist = self.orig_dists[rep_ind, var_ind]
+                dist = float(self.orig_dists[rep_ind, var_ind])
                 variant_distance[self.leaves[var_ind]] = dist
                 if dist > max_var_dist:
                     max_var_dist = dist
@@ -1173,14 +1620,6 @@ class VariantFinder(object):
     def _empty_normalize(self):
         """'method' can be one of 'self', 'global', or 'custom'."""
         return {'method':'self', 'custom_value':None, 'custom_max_count':0, 'global_value':None, 'global_max_count':0, 'processed':set(), 'global_bins':[]}
-    def _calc_max_root_dist(self):
-        max_dist = 0.0
-        root = self.tree.root
-        for node in self.tree.leaves:
-            dist = self.tree.node_distance(root, node)
-            if dist > max_dist:
-                max_dist = dist
-        return max_dist
     def _print_clustering_results(self, num_variants, variants, scores, alt_variants):
         if alt_variants:
             print('Found %i equal sets of %i representative variants.' % (len(alt_variants)+1, num_variants))
@@ -1214,6 +1653,27 @@ class VariantFinder(object):
         if method not in self._cluster_methods:
             raise NavargatorValueError('Error: the given clustering method "{}" is not supported (must be one of: {}).'.format( method, ', '.join(sorted(self._cluster_methods)) ))
         return method
+    def _validate_distance_dtype(self, distance_dtype):
+        try:
+            if distance_dtype is not None and np.dtype(distance_dtype) in (np.dtype('float32'), np.dtype('float64')):
+                return np.dtype(distance_dtype)
+        except TypeError:
+            pass
+        raise NavargatorValueError('Error: the distance matrix dtype "{}" is not supported (must be one of: float32, float64).'.format(distance_dtype))
+    def _validate_k_medoids_init(self, k_medoids_init):
+        if k_medoids_init not in ('random', 'lab', 'build', 'k-medoids++'):
+            raise NavargatorValueError('Error: the k medoids initialization "{}" is not supported (must be one of: random, lab, build, k-medoids++).'.format(k_medoids_init))
+        return k_medoids_init
+    def _validate_memory_budget(self, memory_budget):
+        if memory_budget is None:
+            return None
+        try:
+            memory_budget = int(memory_budget)
+        except (TypeError, ValueError):
+            raise NavargatorValueError('Error: the memory budget "{}" must be a number of bytes.'.format(memory_budget))
+        if memory_budget <= 0:
+            raise NavargatorValueError('Error: the memory budget must be a positive number of bytes.')
+        return memory_budget
     def _validate_node_name(self, node):
         node = node.strip()
         if node not in self.index:
@@ -1222,6 +1682,17 @@ class VariantFinder(object):
 
     # # # # #  Accessible attribute logic  # # # # #
     @property
+    def newick_tree_data(self):
+        truncation = self._tree_data_truncation
+        return self.tree.get_cached_data(('newick_tree_data', truncation), lambda: self.tree.newick_string(support_as_comment=False, support_values=False, comments=False, internal_names=False, max_name_length=truncation))
+    @property
+    def phyloxml_tree_data(self):
+        truncation = self._tree_data_truncation
+        return self.tree.get_cached_data(('phyloxml_tree_data', truncation), lambda: self.tree.phyloxml_string(support_values=False, comments=False, internal_names=False, max_name_length=truncation))
+    @property
+    def ordered_names(self):
+        return self.tree.get_ordered_names()
+    @property
     def chosen(self):
         return self._chosen
     @chosen.setter
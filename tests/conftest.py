@@ -0,0 +1,3 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # So navargator_resources can be imported from the repository
@@ -0,0 +1,143 @@
+"""Checks that the clustering methods give the same results however their work is split between processes."""
+import random, time, itertools
+import numpy as np
+import pytest
+from navargator_resources.variant_finder import VariantFinder
+from test_distance_matrix import random_newick
+
+
+def run_clustering(vf, method, max_cycles, *args):
+    """Starts a run as NavargatorDaemon.process_args_for_find_variants() does, returning (variants, scores, alt_variants) and the run's cache."""
+    run_id = vf.generate_run_id()
+    vf.cache[run_id] = {'status':'running', 'params':args[:2], 'args':args, 'method':method, 'run_time':time.time(), 'cycles_used':0, 'quit_now':False}
+    return vf.find_variants(run_id, method, max_cycles, *args), vf.cache[run_id]
+
+@pytest.fixture(scope='module')
+def tree_string():
+    return random_newick(120, 11)
+
+def new_finder(tree_string, **kwargs):
+    vf = VariantFinder(tree_string, verbose=False, **kwargs)
+    vf.available = vf.leaves[::2]
+    vf.chosen = vf.leaves[1:2]
+    return vf
+
+@pytest.mark.parametrize('method, args', [('k medoids', (6, 1.0, 8)), ('k minibatch', (6, 1.0, 8, 30))])
+def test_replicates_match_serial(tree_string, method, args):
+    results = []
+    for workers in (1, 3):
+        random.seed(5)
+        (variants, scores, alt_variants), cache = run_clustering(new_finder(tree_string, clustering_workers=workers), method, None, *args)
+        results.append((sorted(variants), list(scores), cache['cycles_used']))
+    assert results[0] == results[1]
+
+def test_worker_processes_reused_between_runs(tree_string):
+    serial_vf, vf = new_finder(tree_string), new_finder(tree_string, clustering_workers=3)
+    clustering_pool = None
+    for args in [(6, 1.0, 8), (5, 1.0, 8), (6, 0.5, 8), (6, 1.0, 8)]: # Changing the tolerance refills the shared buffer
+        results = []
+        for finder in (serial_vf, vf):
+            random.seed(5)
+            (variants, scores, alt_variants), cache = run_clustering(finder, 'k medoids', None, *args)
+            results.append((sorted(variants), list(scores)))
+        assert results[0] == results[1]
+        assert clustering_pool is None or vf._clustering_pool is clustering_pool
+        clustering_pool = vf._clustering_pool
+    assert clustering_pool.generation == 3
+    processes = clustering_pool.pool._pool[:]
+    vf.available = vf.leaves[::3] # Clears the cache, and stops the worker processes
+    assert vf._clustering_pool is None and clustering_pool.pool is None
+    assert not any(process.is_alive() for process in processes)
+
+brute_args = (4, 1.0) # 3 new medoids from 60 available: 34220 combinations
+@pytest.fixture(scope='module')
+def serial_brute_force(tree_string):
+    vf = new_finder(tree_string)
+    (variants, scores, alt_variants), cache = run_clustering(vf, 'brute force', None, *brute_args)
+    assert cache['cycles_used'] == cache['cycles_total'] == 34220
+    return sorted(variants), list(scores), [sorted(alt) for alt in alt_variants]
+
+def brute_force_results(results):
+    variants, scores, alt_variants = results
+    return sorted(variants), list(scores), [sorted(alt) for alt in alt_variants]
+
+def test_brute_force_matches_itertools(tree_string, serial_brute_force):
+    vf = new_finder(tree_string)
+    dists = vf._transform_distances(brute_args[1]).condensed().expand()
+    chsn = [vf.index[name] for name in vf.chosen]
+    avail = sorted(vf.index[name] for name in vf.available)
+    best_score, best_meds = min((dists[chsn + list(combo)].min(axis=0).sum(), combo) for combo in itertools.combinations(avail, brute_args[0] - len(chsn)))
+    assert serial_brute_force[0] == sorted(chsn + list(best_meds))
+def test_brute_force_parallel(tree_string, serial_brute_force):
+    vf = new_finder(tree_string, clustering_workers=3)
+    vf._brute_force_range_size = 997 # Many ranges of uneven size
+    results, cache = run_clustering(vf, 'brute force', None, *brute_args)
+    assert brute_force_results(results) == serial_brute_force
+    assert cache['cycles_used'] == 34220
+@pytest.mark.parametrize('workers', [1, 3])
+def test_brute_force_resumes_after_max_cycles(tree_string, serial_brute_force, workers):
+    vf = new_finder(tree_string, clustering_workers=workers)
+    vf._brute_force_range_size = 997
+    cycles_used = []
+    while not cycles_used or cycles_used[-1] < 34220:
+        results, cache = run_clustering(vf, 'brute force', 12000, *brute_args)
+        cycles_used.append(cache['cycles_used'])
+    assert cycles_used == [12000, 24000, 34220]
+    assert brute_force_results(results) == serial_brute_force
+def test_brute_force_resumes_after_quit(tree_string, serial_brute_force):
+    vf = new_finder(tree_string)
+    run_id = vf.generate_run_id()
+    class QuitCache(dict): # Quits once some combinations have been scored
+        def __getitem__(self, key):
+            if key == 'quit_now':
+                return dict.__getitem__(self, 'cycles_used') > 5000
+            return dict.__getitem__(self, key)
+    vf.cache[run_id] = QuitCache({'status':'running', 'params':brute_args, 'args':brute_args, 'method':'brute force', 'run_time':time.time(), 'cycles_used':0, 'quit_now':False})
+    vf.find_variants(run_id, 'brute force', None, *brute_args)
+    assert 5000 < vf.cache[run_id]['cycles_used'] < 34220
+    results, cache = run_clustering(vf, 'brute force', None, *brute_args)
+    assert cache['cycles_used'] == 34220
+    assert brute_force_results(results) == serial_brute_force
+    assert vf.copy()._brute_force_ranges == vf._brute_force_ranges
+def record_scored_ranges(vf):
+    """Returns a list that (start, reached) is appended to for every range 'vf' scores in this process."""
+    scored, score_range = [], vf._score_combination_range
+    def record_range(start, stop, *args):
+        reached, candidates = score_range(start, stop, *args)
+        scored.append((start, reached))
+        return reached, candidates
+    vf._score_combination_range = record_range
+    return scored
+def test_brute_force_resumes_from_saved_progress(tree_string, serial_brute_force, tmp_path):
+    vf = new_finder(tree_string, distance_cache_dir=str(tmp_path))
+    results, cache = run_clustering(vf, 'brute force', 12000, *brute_args)
+    assert cache['cycles_used'] == 12000
+    new_vf = new_finder(tree_string, distance_cache_dir=str(tmp_path)) # As if the first process had exited
+    scored = record_scored_ranges(new_vf)
+    results, cache = run_clustering(new_vf, 'brute force', None, *brute_args)
+    assert scored[0][0] == 12000 and sum(reached - start for start, reached in scored) == 34220 - 12000
+    assert cache['cycles_used'] == 34220
+    assert brute_force_results(results) == serial_brute_force
+    other_vf = new_finder(tree_string, distance_cache_dir=str(tmp_path))
+    other_vf.available = other_vf.leaves[::3] # Different combinations, so nothing is resumed
+    results, cache = run_clustering(other_vf, 'brute force', 1000, *brute_args)
+    assert cache['cycles_used'] == 1000
+def test_brute_force_resumes_after_kill(tree_string, serial_brute_force, tmp_path):
+    class Killed(Exception):
+        pass
+    class KillCache(dict): # Raises once some combinations have been scored, as if the process was killed
+        def __getitem__(self, key):
+            if key == 'quit_now' and dict.__getitem__(self, 'cycles_used') > 5000:
+                raise Killed()
+            return dict.__getitem__(self, key)
+    vf = new_finder(tree_string, distance_cache_dir=str(tmp_path))
+    vf._brute_force_range_size, vf._brute_force_save_interval = 997, 0.0
+    run_id = vf.generate_run_id()
+    vf.cache[run_id] = KillCache({'status':'running', 'params':brute_args, 'args':brute_args, 'method':'brute force', 'run_time':time.time(), 'cycles_used':0, 'quit_now':False})
+    with pytest.raises(Killed):
+        vf.find_variants(run_id, 'brute force', None, *brute_args)
+    new_vf = new_finder(tree_string, distance_cache_dir=str(tmp_path))
+    scored = record_scored_ranges(new_vf)
+    results, cache = run_clustering(new_vf, 'brute force', None, *brute_args)
+    assert scored[0][0] == 997 * 5 # The 5 ranges finished before the kill were saved
+    assert brute_force_results(results) == serial_brute_force
@@ -0,0 +1,222 @@
+"""Checks every way of building a distance matrix against the pairwise distances of the tree.
+
+The reference distances are found by walking from each leaf up to the root, so they share no code with the methods being tested. The matrix is also compared with phylo.Tree.node_distance() for every pair of leaves, which is how it used to be built. The trees are small random ones, with and without a 3-child (unrooted) root, without branch lengths (cladograms), and with zero or negative branches.
+"""
+import os, random
+import numpy as np
+import pytest
+from navargator_resources import phylo
+from navargator_resources.distance_cache import DistanceCache
+from navargator_resources.distance_matrix import CachedRowMatrix, CondensedDistanceMatrix, DistanceOracle
+
+phylo.verbose = False
+
+
+# # # # #  Random trees  # # # # #
+def random_newick(num_leaves, seed, root_children=2, branches='random'):
+    """Returns a Newick string of a random tree. 'branches' is one of 'random', 'none' (a cladogram), 'zero' (some are 0), or 'negative' (some are below 0)."""
+    rng = random.Random(seed)
+    def branch_str():
+        if branches == 'none':
+            return ''
+        length = rng.uniform(0.001, 2.0)
+        if branches == 'zero' and rng.random() < 0.3:
+            length = 0.0
+        elif branches == 'negative' and rng.random() < 0.2:
+            length = -rng.uniform(0.001, 0.5)
+        return ':{:.6f}'.format(length)
+    clades = ['leaf{}{}'.format(i, branch_str()) for i in range(num_leaves)]
+    while len(clades) > root_children:
+        num_joined = 3 if len(clades) > root_children + 2 and rng.random() < 0.1 else 2 # Some multifurcations
+        joined = [clades.pop(rng.randrange(len(clades))) for i in range(num_joined)]
+        clades.append('({}){}'.format(','.join(joined), branch_str()))
+    return '({});'.format(','.join(clades))
+
+def reference_distances(tree):
+    """Returns the sorted leaf names and the full matrix of distances between them, found from the path of each leaf to the root."""
+    names = tree.get_named_leaves()
+    paths = {}
+    for name in names:
+        node, path, dist = tree.node_names[name], [], 0.0
+        while node is not None:
+            path.append((node, dist))
+            dist += node.branch if node.parent is not None else 0.0
+            node = node.parent
+        paths[name] = path
+    size = len(names)
+    dist_mat = np.zeros((size, size))
+    for i in range(size):
+        path1 = paths[names[i]]
+        for j in range(i+1, size):
+            path2 = dict(paths[names[j]])
+            anc, dist = next((node, dist) for node, dist in path1 if node in path2) # The lowest common ancestor is the first shared node on the way up
+            dist_mat[i,j] = dist_mat[j,i] = dist + path2[anc]
+    return names, dist_mat
+
+tree_cases = [
+    ('rooted', dict(root_children=2)),
+    ('unrooted', dict(root_children=3)),
+    ('cladogram', dict(branches='none')),
+    ('unrooted_cladogram', dict(root_children=3, branches='none')),
+    ('zero_branches', dict(branches='zero')),
+    ('negative_branches', dict(branches='negative')),
+]
+@pytest.fixture(params=[(name, kwargs, seed) for name, kwargs in tree_cases for seed in (1, 2)], ids=lambda param: '{}-{}'.format(param[0], param[2]))
+def tree_and_reference(request):
+    name, kwargs, seed = request.param
+    tree = phylo.load_newick_string(random_newick(60, seed, **kwargs))
+    return tree, reference_distances(tree)
+
+
+# # # # #  phylo.Tree  # # # # #
+def test_matches_reference(tree_and_reference):
+    tree, (ref_names, ref_mat) = tree_and_reference
+    names, dist_mat = tree.get_distance_matrix()
+    assert names == ref_names
+    assert dist_mat.dtype == np.float64
+    np.testing.assert_allclose(dist_mat, ref_mat, rtol=1e-12, atol=1e-12)
+    np.testing.assert_array_equal(np.diag(dist_mat), 0.0)
+def test_matches_node_distance(tree_and_reference):
+    tree, (names, ref_mat) = tree_and_reference
+    names, dist_mat = tree.get_distance_matrix()
+    nodes = [tree.node_names[name] for name in names]
+    node_mat = np.array([[tree.node_distance(node1, node2) for node2 in nodes] for node1 in nodes])
+    np.testing.assert_allclose(dist_mat, node_mat, rtol=1e-12, atol=1e-12)
+def test_condensed(tree_and_reference):
+    tree, (names, ref_mat) = tree_and_reference
+    full = tree.get_distance_matrix()[1]
+    cond_names, condensed = tree.get_distance_matrix(condensed=True)
+    assert cond_names == names
+    np.testing.assert_array_equal(condensed, full[np.triu_indices(len(names))])
+def test_float32(tree_and_reference):
+    tree, (names, ref_mat) = tree_and_reference
+    full = tree.get_distance_matrix()[1]
+    dist_mat = tree.get_distance_matrix(dtype='float32')[1]
+    assert dist_mat.dtype == np.float32
+    np.testing.assert_array_equal(dist_mat, full.astype(np.float32)) # Summed as float64, only rounded when stored
+    condensed = tree.get_distance_matrix(dtype='float32', condensed=True)[1]
+    np.testing.assert_array_equal(condensed, dist_mat[np.triu_indices(len(names))])
+@pytest.mark.parametrize('name, kwargs', tree_cases, ids=[name for name, kwargs in tree_cases])
+@pytest.mark.parametrize('dtype, condensed', [('float64', False), ('float32', True)]) # Only a few, as each pool of spawned workers takes a while to start
+def test_parallel(name, kwargs, dtype, condensed):
+    tree = phylo.load_newick_string(random_newick(60, 1, **kwargs))
+    names = tree.get_named_leaves()
+    serial = tree.get_distance_matrix(dtype=dtype, condensed=condensed)[1]
+    par_names, parallel = tree.get_distance_matrix(dtype=dtype, condensed=condensed, workers=3)
+    assert par_names == names
+    assert parallel.dtype == serial.dtype and parallel.shape == serial.shape
+    np.testing.assert_allclose(parallel, serial, rtol=1e-6 if dtype == 'float32' else 1e-12, atol=1e-12) # May differ in the last bit
+def test_leaf_distance_function(tree_and_reference):
+    tree, (names, ref_mat) = tree_and_reference
+    leaf_distances = tree.get_leaf_distance_function()
+    inds = np.arange(len(names))
+    np.testing.assert_allclose(leaf_distances(inds[:,None], inds), ref_mat, rtol=1e-12, atol=1e-12)
+def test_pruned_tree_distances(tree_and_reference):
+    tree, (names, ref_mat) = tree_and_reference
+    if tree._is_cladogram:
+        pytest.skip('a pruned cladogram gets new unit branches')
+    keep = names[::3]
+    pruned = tree.get_pruned_tree([tree.node_names[name] for name in keep])
+    pruned_names, pruned_mat = pruned.get_distance_matrix()
+    assert pruned_names == keep
+    np.testing.assert_allclose(pruned_mat, ref_mat[np.ix_(range(0, len(names), 3), range(0, len(names), 3))], rtol=1e-12, atol=1e-12)
+def test_single_leaf():
+    names, dist_mat = phylo.load_newick_string('(A:1.0);').get_distance_matrix()
+    assert names == ['A']
+    np.testing.assert_array_equal(dist_mat, [[0.0]])
+
+
+# # # # #  Matrix classes  # # # # #
+@pytest.fixture(params=['condensed', 'condensed_budget', 'oracle'])
+def matrix_and_full(request):
+    tree = phylo.load_newick_string(random_newick(40, 7, root_children=3))
+    names, full = tree.get_distance_matrix()
+    if request.param == 'oracle':
+        return DistanceOracle.from_tree(tree), full
+    budget = 1024 if request.param == 'condensed_budget' else None # Small enough that the arrays are memory-mapped
+    return CondensedDistanceMatrix.from_leaf_distances(tree.get_leaf_distance_function(), len(names), memory_budget=budget), full
+
+def test_matrix_indexing(matrix_and_full):
+    dists, full = matrix_and_full
+    inds = [5, 0, 39, 12]
+    assert dists.shape == full.shape
+    np.testing.assert_allclose(dists[3,:], full[3,:], rtol=1e-12)
+    np.testing.assert_allclose(dists[inds,:], full[inds,:], rtol=1e-12)
+    np.testing.assert_allclose(dists[:,inds], full[:,inds], rtol=1e-12)
+    np.testing.assert_allclose(dists[np.ix_(inds, inds[::-1])], full[np.ix_(inds, inds[::-1])], rtol=1e-12)
+    assert dists[4,9] == pytest.approx(full[4,9], rel=1e-12)
+    for i in range(full.shape[0]): # Fills the row cache, then reads past it
+        np.testing.assert_allclose(dists.row(i), full[i], rtol=1e-12)
+def test_matrix_condensed_and_expand(matrix_and_full):
+    dists, full = matrix_and_full
+    condensed = dists.condensed()
+    np.testing.assert_allclose(condensed.data, full[np.triu_indices(full.shape[0])], rtol=1e-12)
+    np.testing.assert_allclose(condensed.expand(), full, rtol=1e-12)
+    threshold = np.median(full)
+    np.testing.assert_array_equal(dists.within(threshold), condensed.expand() <= threshold)
+def test_matrix_submatrix(matrix_and_full):
+    dists, full = matrix_and_full
+    inds = [30, 2, 17, 8, 25]
+    np.testing.assert_allclose(dists.submatrix(inds).condensed().expand(), full[np.ix_(inds, inds)], rtol=1e-12)
+def test_matrix_transform_and_fill(matrix_and_full):
+    dists, full = matrix_and_full
+    trans = dists.transformed(lambda orig: np.power(orig*0.5 + 1.0, 1.0/0.5) - 1.0)
+    expected = np.power(full*0.5 + 1.0, 1.0/0.5) - 1.0
+    np.testing.assert_allclose(trans.condensed().expand(), expected, rtol=1e-12)
+    trans.fill_rows([3, 11], 0)
+    expected[[3, 11],:] = 0
+    expected[:,[3, 11]] = 0
+    np.testing.assert_allclose(trans.condensed().expand(), expected, rtol=1e-12)
+    trans.fill_rows([20], 7.5) # A later fill takes precedence where it meets an earlier one
+    expected[20,:] = 7.5
+    expected[:,20] = 7.5
+    np.testing.assert_allclose(trans.condensed().expand(), expected, rtol=1e-12)
+    np.testing.assert_allclose(trans[[20, 3, 5],:], expected[[20, 3, 5],:], rtol=1e-12)
+    np.testing.assert_allclose(dists.condensed().expand(), full, rtol=1e-12) # The original is unchanged
+def test_condensed_from_full_float32():
+    tree = phylo.load_newick_string(random_newick(30, 3))
+    full = tree.get_distance_matrix()[1]
+    condensed = CondensedDistanceMatrix.from_full(full, dtype='float32')
+    np.testing.assert_array_equal(condensed.expand(), full.astype(np.float32))
+    oracle = DistanceOracle.from_tree(tree, dtype='float32')
+    np.testing.assert_array_equal(oracle.condensed().data, condensed.data) # Rounded the same way
+def test_incomplete_subclass_cannot_be_created():
+    class RowsOnly(CachedRowMatrix):
+        def _calculate_row(self, ind):
+            return np.zeros(self.size)
+    with pytest.raises(TypeError):
+        RowsOnly(5, 'float64')
+
+
+# # # # #  DistanceCache  # # # # #
+def test_distance_cache_round_trip(tmp_path):
+    tree = phylo.load_newick_string(random_newick(50, 4))
+    condensed = tree.get_distance_matrix(condensed=True)[1]
+    cache = DistanceCache(str(tmp_path), min_leaves=1)
+    fingerprint = tree.get_fingerprint()
+    assert cache.load(fingerprint, 50) is None
+    assert cache.save(fingerprint, condensed)
+    np.testing.assert_array_equal(cache.load(fingerprint, 50), condensed)
+    assert cache.load(fingerprint, 50, dtype='float32') is None
+    assert cache.load(fingerprint, 49) is None # The wrong size is treated as a miss, and removed
+    assert cache.load(fingerprint, 50) is None
+def test_distance_cache_evicts_least_recently_used(tmp_path):
+    arrays = [np.arange(condensed_len, dtype=np.float64) for condensed_len in (55, 55, 55)] # 10 leaves each
+    cache = DistanceCache(str(tmp_path), max_size=2*arrays[0].nbytes + 200, min_leaves=1)
+    assert cache.save('a', arrays[0]) and cache.save('b', arrays[1])
+    assert cache.load('a', 10) is not None # 'b' is now the least recently used
+    assert cache.save('c', arrays[2])
+    assert cache.load('b', 10) is None
+    assert cache.load('a', 10) is not None and cache.load('c', 10) is not None
+def test_distance_cache_progress(tmp_path):
+    cache = DistanceCache(str(tmp_path))
+    progress = [[0, 997, [[1.5, [3, 9]]]], [997, 1500, []]]
+    assert cache.load_progress('a', 'run1') is None
+    assert cache.save_progress('a', 'run1', progress)
+    assert cache.load_progress('a', 'run1') == progress and cache.load_progress('a', 'run2') is None
+    with open(os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0]), 'w') as f:
+        f.write('[[0, 99') # A partial file is treated as a miss, and removed
+    assert cache.load_progress('a', 'run1') is None and os.listdir(str(tmp_path)) == []
+    cache.save_progress('a', 'run1', progress)
+    cache.clear()
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,40 @@
+"""Checks the output of phylo.Tree methods that should not change between versions."""
+from navargator_resources import phylo
+
+phylo.verbose = False
+
+
+def test_copy_names_internal_nodes():
+    tree = phylo.load_newick_string('((A:1,B:2):0.5,(C:1,(D:1,E:1):0.3):0.2);')
+    assert tree.newick_string() == '((A:1,B:2):0.5,(C:1,(D:1,E:1):0.3):0.2);'
+    copied = tree.copy() # Each copied node gets a new id, so its old one is written out as an internal name
+    assert copied.newick_string() == '((A:1,B:2)_node_1:0.5,(C:1,(D:1,E:1)_node_6:0.3)_node_4:0.2)_node_0;'
+    assert copied.copy().newick_string() == copied.newick_string()
+    assert copied.get_fingerprint() == tree.get_fingerprint()
+    copied.root_midpoint()
+    assert copied.newick_string() == '(B:2,(A:1,(C:1,(D:1,E:1)_node_6:0.3)_node_4:0.7)_node_1:0)_node_0;'
+    assert tree.newick_string() == '((A:1,B:2):0.5,(C:1,(D:1,E:1):0.3):0.2);'
+
+multi_nexus = '#NEXUS\nBEGIN TREES;\n  Tree first = (A,(B,C));\n  Tree second = (A:1,(B:2,C:3):1);\nEND;\n'
+def test_multiple_nexus_cladogram_flag(tmp_path):
+    # Previously the second tree reused the first tree's cladogram flag, and so lost its branch lengths: ['(A,(B,C)_node_2)_node_0;', '(A,(B,C)_node_2)_node_0;']
+    trees = phylo.load_multiple_nexus_string(multi_nexus)
+    assert [tree.newick_string() for tree in trees] == ['(A,(B,C)_node_2)_node_0;', '(A:1,(B:2,C:3)_node_2:1)_node_0;']
+    file_path = tmp_path / 'trees.nex'
+    file_path.write_text(multi_nexus)
+    assert [tree.newick_string() for tree in phylo.iter_multiple_nexus(str(file_path))] == ['(A,(B,C));', '(A:1,(B:2,C:3):1);']
+
+multi_phyloxml = '''<?xml version="1.0" encoding="UTF-8"?>
+<phyloxml xmlns="http://www.phyloxml.org">
+  <phylogeny rooted="true"><name>first</name><clade><clade><name>A</name></clade><clade><name>B</name></clade></clade></phylogeny>
+  <phylogeny rooted="true"><name>second</name><clade><clade><name>A</name><branch_length>1.0</branch_length></clade><clade><name>C</name><branch_length>2.0</branch_length></clade></clade></phylogeny>
+</phyloxml>'''
+def test_multiple_phyloxml_names(tmp_path):
+    # Previously every tree from load_multiple_phyloxml() had the name None
+    trees = phylo.load_multiple_phyloxml_string(multi_phyloxml)
+    assert [tree.name for tree in trees] == ['first', 'second']
+    assert [tree.newick_string() for tree in trees] == ['(A,B);', '(A:1,C:2);']
+    file_path = tmp_path / 'trees.xml'
+    file_path.write_text(multi_phyloxml)
+    assert [(tree.name, tree.newick_string()) for tree in phylo.iter_multiple_phyloxml(str(file_path))] == [('first', '(A,B);'), ('second', '(A:1,C:2);')]
+    assert phylo.load_phyloxml_string(multi_phyloxml.replace(multi_phyloxml[multi_phyloxml.index('  <phylogeny rooted="true"><name>second'):multi_phyloxml.index('</phyloxml>')], '')).name == 'first'
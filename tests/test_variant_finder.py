@@ -0,0 +1,50 @@
+"""Checks VariantFinder settings that are threaded through copies, subsets and the daemon."""
+import os, random
+import numpy as np
+from navargator_resources.variant_finder import VariantFinder
+from test_distance_matrix import random_newick
+
+
+def test_distance_cache_is_opt_in(tmp_path):
+    tree_string = random_newick(1000, 5) # DistanceCache ignores smaller trees
+    cache_dir = str(tmp_path / 'cache')
+    vf = VariantFinder(tree_string, verbose=False)
+    assert vf.distance_cache_dir is None and not os.path.exists(cache_dir)
+    cached_vf = VariantFinder(tree_string, distance_cache_dir=cache_dir, verbose=False)
+    assert len(os.listdir(cache_dir)) == 1
+    np.testing.assert_array_equal(cached_vf.orig_dists.data, vf.orig_dists.data)
+    reloaded_vf = VariantFinder(tree_string, distance_cache_dir=cache_dir, verbose=False)
+    assert not reloaded_vf.orig_dists.data.flags.owndata # Memory-mapped from the cache
+    np.testing.assert_array_equal(reloaded_vf.orig_dists.data, vf.orig_dists.data)
+    assert cached_vf.copy().distance_cache_dir == cache_dir
+    assert cached_vf.subset(cached_vf.leaves[:10]).distance_cache_dir == cache_dir
+    VariantFinder(tree_string, distance_cache_dir=cache_dir, distance_cache_size=None, verbose=False)
+    assert len(os.listdir(cache_dir)) == 1
+
+def test_tree_shared_until_modified():
+    vf = VariantFinder(random_newick(30, 6), verbose=False)
+    tree = vf.tree
+    vf_copy = vf.copy()
+    assert vf_copy.tree is tree
+    vf_copy.root_midpoint() # Modifies its tree, so it gets its own
+    assert vf_copy.tree is not tree and vf.tree is tree
+    vf_copy2 = vf.copy()
+    del vf_copy2 # As when the daemon replaces a session's instance with a copy
+    vf.root_midpoint() # No longer shared, so not copied
+    assert vf.tree is tree
+def test_only_float32_scores_tie_within_tolerance():
+    tree_string = random_newick(30, 6)
+    vf = VariantFinder(tree_string, verbose=False)
+    assert vf._scores_tied(10.0, 10.0) and not vf._scores_tied(10.0, 10.0 + 1e-13)
+    vf32 = VariantFinder(tree_string, distance_dtype='float32', verbose=False)
+    assert vf32._scores_tied(10.0, 10.0 + 1e-6) and not vf32._scores_tied(10.0, 10.001)
+    assert vf32.copy()._tie_tolerance == vf32._tie_tolerance
+def test_plusplus_medoids_are_distinct():
+    class HighRandom(random.Random): # As if rounding always put the target at the very end of the weights
+        def random(self):
+            return 1.0
+    vf = VariantFinder(random_newick(30, 6), verbose=False)
+    avail = list(range(len(vf.leaves)))
+    for chsn in ([], [3]):
+        medoids = vf._plusplus_medoids(8, chsn, avail, vf.orig_dists, HighRandom(1))
+        assert len(set(medoids)) == 8 and not set(medoids) & set(chsn)